@@ -0,0 +1,66 @@
+"""Скорость построения эхо-запросов: прежние checksum/create_icmp_packet и PacketBuilder.
+
+Запуск: python bench_packets.py [--packets 200000]
+Прежние функции скопированы сюда (время отправки можно задать для проверки); перед
+замером проверяется, что при одном времени все способы дают одинаковые байты.
+"""
+import argparse
+import os
+import socket
+import struct
+import time
+
+from icmp import ICMP_ECHO_REQUEST, PAYLOAD, PacketBuilder, checksum, create_icmp_packet
+
+
+def legacy_checksum(data):
+    sum = 0
+    for i in range(0, len(data), 2):
+        word = (data[i] << 8) + (data[i + 1] if i + 1 < len(data) else 0)
+        sum = sum + word
+        while sum >> 16:
+            sum = (sum & 0xffff) + (sum >> 16)
+    return ~sum & 0xffff
+
+
+def legacy_create_icmp_packet(seq, timestamp=None):
+    header = struct.pack('bbHHH', ICMP_ECHO_REQUEST, 0, 0, os.getpid() & 0xFFFF, seq)
+    data = struct.pack("d", time.time() if timestamp is None else timestamp) + PAYLOAD
+    my_checksum = legacy_checksum(header + data)
+    header = struct.pack('bbHHH', ICMP_ECHO_REQUEST, 0, socket.htons(my_checksum), os.getpid() & 0xFFFF, seq)
+    return header + data
+
+
+def run(build, count):
+    start = time.perf_counter()
+    for seq in range(count):
+        build(seq & 0xFFFF)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=200000)
+    args = parser.parse_args()
+
+    builder = PacketBuilder()
+    now = time.time()
+    for seq in range(0, 65536, 97):
+        packet = builder.build(seq, now + seq)
+        assert packet == legacy_create_icmp_packet(seq, now + seq)
+        assert legacy_checksum(packet) == checksum(packet) == 0
+
+    variants = [
+        ("прежний create_icmp_packet", legacy_create_icmp_packet),
+        ("create_icmp_packet", lambda seq: create_icmp_packet(seq)),
+        ("PacketBuilder.build", builder.build),
+    ]
+    base = None
+    for name, build in variants:
+        rate = run(build, args.packets)
+        base = base or rate
+        print(f"{name:28s} {rate:12,.0f} пакетов/с  x{rate / base:.1f}")
+
+
+if __name__ == "__main__":
+    main()
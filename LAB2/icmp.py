@@ -0,0 +1,95 @@
+import os
+import socket
+import struct
+import time
+
+# Константы для ICMP
+ICMP_ECHO_REPLY = 0  # Тип ICMP Echo Reply
+ICMP_DEST_UNREACHABLE = 3  # Тип ICMP Destination Unreachable
+ICMP_ECHO_REQUEST = 8  # Тип ICMP Echo Request
+ICMP_TIME_EXCEEDED = 11  # Тип ICMP Time Exceeded
+
+
+PAYLOAD = b'Hello, Traceroute!'
+
+
+def _ones_complement_sum(data):
+    """Сумма 16-битных слов с циклическим переносом (RFC 1071).
+
+    65536 = 1 по модулю 65535, поэтому число из байт data (big-endian) даёт по этому
+    модулю ту же сумму, что и сложение слов, а считается одной операцией на C.
+    """
+    if len(data) % 2:
+        data = bytes(data) + b'\0'
+    total = int.from_bytes(data, 'big')
+    folded = total % 0xFFFF
+    return 0xFFFF if folded == 0 and total else folded
+
+
+def checksum(data):
+    """Вычисление контрольной суммы ICMP"""
+    return ~_ones_complement_sum(data) & 0xffff
+
+
+def create_icmp_packet(seq, ident=None):
+    """Создание ICMP пакета"""
+    if ident is None:
+        ident = os.getpid() & 0xFFFF
+    header = struct.pack('bbHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    data = struct.pack("d", time.time()) + PAYLOAD
+    my_checksum = checksum(header + data)
+    header = struct.pack('bbHHH', ICMP_ECHO_REQUEST, 0, socket.htons(my_checksum), ident, seq)
+    return header + data
+
+
+class PacketBuilder:
+    """Эхо-запросы из заготовки: те же байты, что у create_icmp_packet, но быстрее.
+
+    Заголовок и данные упаковываются один раз; для очередного пакета в bytearray
+    заготовки записываются seq и время отправки, а контрольная сумма получается из
+    заранее посчитанной суммы неизменных слов добавлением изменённых (RFC 1624:
+    в заготовке эти поля нулевые).
+    """
+
+    def __init__(self, ident=None, payload=PAYLOAD):
+        if ident is None:
+            ident = os.getpid() & 0xFFFF
+        self.template = bytearray(struct.pack('bbHHH', ICMP_ECHO_REQUEST, 0, 0, ident, 0)
+                                  + struct.pack('d', 0.0) + payload)
+        self.base = _ones_complement_sum(self.template)
+
+    def build(self, seq, timestamp=None):
+        packet = self.template
+        struct.pack_into('=Hd', packet, 6, seq, time.time() if timestamp is None else timestamp)
+        # seq и время - слова 6..15; сумма = base + их сумма по модулю 0xFFFF
+        folded = (self.base + int.from_bytes(packet[6:16], 'big')) % 0xFFFF or 0xFFFF
+        struct.pack_into('!H', packet, 2, ~folded & 0xFFFF)
+        return bytes(packet)
+
+
+def parse_reply(data):
+    """Разбор ответа из raw-сокета (IP-заголовок + ICMP).
+
+    Возвращает (тип ICMP, адрес ответившего, байты id и seq эхо-запроса, на который
+    пришёл ответ) или None. Для Time Exceeded и Destination Unreachable id и seq
+    берутся из вложенного заголовка исходного пакета. Байты сравниваются как есть,
+    поэтому порядок байт при упаковке id и seq не важен.
+    """
+    if len(data) < 20:
+        return None
+    ihl = (data[0] & 0x0F) * 4
+    if len(data) < ihl + 8:
+        return None
+    source = socket.inet_ntoa(data[12:16])
+    icmp_type = data[ihl]
+    if icmp_type == ICMP_ECHO_REPLY:
+        return icmp_type, source, bytes(data[ihl + 4:ihl + 8])
+    if icmp_type not in (ICMP_TIME_EXCEEDED, ICMP_DEST_UNREACHABLE):
+        return None
+    inner = ihl + 8  # вложенный IP-заголовок исходного пакета
+    if len(data) < inner + 20 or data[inner + 9] != socket.IPPROTO_ICMP:
+        return None
+    original = inner + (data[inner] & 0x0F) * 4
+    if len(data) < original + 8 or data[original] != ICMP_ECHO_REQUEST:
+        return None
+    return icmp_type, source, bytes(data[original + 4:original + 8])
@@ -0,0 +1,144 @@
+"""Непрерывный мониторинг маршрутов к нескольким узлам (в духе mtr).
+
+Каждые interval секунд все назначения трассируются одновременно одним
+ProbeEngine. По каждому узлу маршрута хранятся последние window результатов проб
+в кольцевом буфере array('d') (NaN - потеря), из них считаются потери, min/avg/
+max/stddev и jitter. Результат цикла выводится строками JSON, смены маршрута -
+отдельными событиями. Объём памяти зависит только от числа назначений, max_hops
+и window, а не от времени работы.
+"""
+import json
+import math
+import socket
+import sys
+import time
+from array import array
+
+from probe_engine import Trace
+
+LOST = float('nan')
+
+
+class HopStats:
+    """Кольцевой буфер RTT одного узла маршрута"""
+
+    __slots__ = ('samples', 'position', 'count', 'sent', 'address')
+
+    def __init__(self, window):
+        self.samples = array('d', [LOST]) * window
+        self.position = 0
+        self.count = 0  # заполнено ячеек буфера
+        self.sent = 0  # всего проб за время работы
+        self.address = None
+
+    def add(self, rtt):
+        self.samples[self.position] = LOST if rtt is None else rtt
+        self.position = (self.position + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+        self.sent += 1
+
+    def ordered(self):
+        """Результаты в порядке поступления"""
+        if self.count < len(self.samples):
+            return self.samples[:self.count]
+        return self.samples[self.position:] + self.samples[:self.position]
+
+    def summary(self):
+        samples = self.ordered()
+        received = [rtt for rtt in samples if rtt == rtt]  # NaN не равен себе
+        result = {'addr': self.address, 'sent': self.sent,
+                  'loss': round(100.0 * (len(samples) - len(received)) / len(samples), 1) if samples else 0.0}
+        if received:
+            avg = math.fsum(received) / len(received)
+            result.update(
+                last=round(received[-1], 3), min=round(min(received), 3), avg=round(avg, 3),
+                max=round(max(received), 3),
+                stddev=round(math.sqrt(math.fsum((rtt - avg) ** 2 for rtt in received) / len(received)), 3),
+                # средняя разница соседних RTT
+                jitter=round(math.fsum(abs(b - a) for a, b in zip(received, received[1:]))
+                             / (len(received) - 1), 3) if len(received) > 1 else 0.0)
+        return result
+
+
+class Target:
+    def __init__(self, name, ip, window):
+        self.name = name
+        self.ip = ip
+        self.window = window
+        self.hops = []  # HopStats по TTL; длина - длина маршрута в последнем цикле
+        self.reached = None  # TTL, на котором отвечает назначение
+
+    def update(self, trace):
+        """Учёт результатов трассы; возвращает список смен маршрута"""
+        results = trace.result()
+        changes = []
+        if trace.dest_ttl != self.reached and self.hops:
+            changes.append({'ttl': None, 'old_length': self.reached, 'new_length': trace.dest_ttl})
+        self.reached = trace.dest_ttl
+        del self.hops[len(results):]  # маршрут стал короче
+        while len(self.hops) < len(results):
+            self.hops.append(HopStats(self.window))
+
+        for ttl, probes in enumerate(results, 1):
+            hop = self.hops[ttl - 1]
+            addresses = [result[0] for result in probes if result]
+            # молчание узла сменой маршрута не считается: это потери
+            if addresses and addresses[-1] != hop.address:
+                if hop.address is not None:
+                    changes.append({'ttl': ttl, 'old': hop.address, 'new': addresses[-1]})
+                    hop = self.hops[ttl - 1] = HopStats(self.window)  # статистика прежнего узла не нужна
+                hop.address = addresses[-1]
+            for result in probes:
+                hop.add(result[1] if result else None)
+        return changes
+
+    def report(self, resolver=None):
+        hops = [dict(ttl=ttl, **hop.summary()) for ttl, hop in enumerate(self.hops, 1)]
+        if resolver is not None:
+            # имени ещё нет - оно появится в одном из следующих циклов
+            for hop in hops:
+                if hop['addr']:
+                    hop['name'] = resolver.resolve(hop['addr'])
+        return hops
+
+
+def read_targets(path):
+    """Имена узлов из файла: по одному в строке, # - комментарий"""
+    with open(path, encoding='utf-8') as f:
+        return [line.split('#', 1)[0].strip() for line in f if line.split('#', 1)[0].strip()]
+
+
+def emit(record, out):
+    out.write(json.dumps(record, ensure_ascii=False) + '\n')
+    out.flush()
+
+
+def monitor(engine, names, interval=10.0, max_hops=30, probes_per_hop=3, timeout=2.0,
+            window=100, cycles=None, out=sys.stdout, resolver=None):
+    """Цикл мониторинга; cycles=None - до прерывания; resolver - имена узлов в выводе"""
+    targets = []
+    for name in names:
+        try:
+            targets.append(Target(name, socket.gethostbyname(name), window))
+        except socket.gaierror:
+            emit({'event': 'error', 'target': name, 'error': 'не удалось разрешить имя'}, out)
+
+    cycle = 0
+    next_start = time.monotonic()
+    while targets and (cycles is None or cycle < cycles):
+        cycle += 1
+        started = time.time()
+        traces = [Trace(target.ip, max_hops, probes_per_hop, timeout) for target in targets]
+        engine.run(traces)
+        for target, trace in zip(targets, traces):
+            for change in target.update(trace):
+                emit(dict(event='route_change', time=started, target=target.name, ip=target.ip, **change), out)
+            emit({'event': 'cycle', 'cycle': cycle, 'time': started, 'target': target.name,
+                  'ip': target.ip, 'reached': target.reached, 'hops': target.report(resolver)}, out)
+
+        next_start += interval
+        delay = next_start - time.monotonic()
+        if delay > 0 and (cycles is None or cycle < cycles):
+            time.sleep(delay)
+        elif delay <= 0:
+            next_start = time.monotonic()  # цикл длиннее интервала: без попыток догнать
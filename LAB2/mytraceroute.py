@@ -1,89 +1,85 @@
+import argparse
 import socket
-import struct
-import time
 import sys
-import os
-
-# Константы для ICMP
-ICMP_ECHO_REQUEST = 8  # Тип ICMP Echo Request
-ICMP_TIME_EXCEEDED = 11  # Тип ICMP Time Exceeded
-
-
-def checksum(data):
-    """Вычисление контрольной суммы ICMP"""
-    sum = 0
-    for i in range(0, len(data), 2):
-        word = (data[i] << 8) + (data[i + 1] if i + 1 < len(data) else 0)
-        sum = sum + word
-        while sum >> 16:
-            sum = (sum & 0xffff) + (sum >> 16)
-    return ~sum & 0xffff
-
-
-def create_icmp_packet(seq):
-    """Создание ICMP пакета"""
-    header = struct.pack('bbHHh', ICMP_ECHO_REQUEST, 0, 0, os.getpid() & 0xFFFF, seq)
-    data = struct.pack("d", time.time()) + b'Hello, Traceroute!'
-    my_checksum = checksum(header + data)
-    header = struct.pack('bbHHh', ICMP_ECHO_REQUEST, 0, socket.htons(my_checksum), os.getpid() & 0xFFFF, seq)
-    return header + data
-
-
-def resolve_hostname(ip):
-    """Разрешение IP в имя хоста"""
-    try:
-        return socket.gethostbyaddr(ip)[0]
-    except socket.herror:
-        return ip
-
-
-def traceroute(destination, max_hops=30, probes_per_hop=3, resolve_names=False):
-    """Основная функция traceroute"""
+import threading
+
+from monitor import monitor, read_targets
+from probe_engine import ProbeEngine, RawSocketBackend, Trace
+from resolver import Resolver
+from simulated_network import demo_lookup, demo_network
+
+DNS_WAIT = 3.0  # сколько после окончания проб ждать имён, с
+
+
+def format_hop(ttl, results, hop_display=None):
+    times = [f"{result[1]:.2f} ms" if result else "*" for result in results]
+    addresses = [result[0] for result in results if result]
+    times_str = "  ".join(times)
+    if not addresses:
+        return f"{ttl:2d}  {times_str}"
+    return f"{ttl:2d}  {times_str}  {hop_display or addresses[-1]}"
+
+
+class HopPrinter:
+    """Вывод узлов по порядку TTL; с resolver строка узла ждёт имени из фонового запроса.
+
+    Пробы от этого не зависят: on_hop только ставит запрос в очередь, а печатает
+    тот поток, в котором пришло последнее нужное имя.
+    """
+
+    def __init__(self, resolver=None):
+        self.resolver = resolver
+        self.hops = {}  # ttl -> (результаты, адрес)
+        self.names = {}
+        self.printed = 0
+        self.condition = threading.Condition()
+
+    def on_hop(self, ttl, results):
+        addresses = [result[0] for result in results if result]
+        address = addresses[-1] if addresses else None
+        with self.condition:
+            self.hops[ttl] = (results, address)
+        if address and self.resolver is not None:
+            self.resolver.resolve(address, self._resolved)
+        self.flush()
+
+    def _resolved(self, ip, name):
+        with self.condition:
+            self.names[ip] = name or ip
+        self.flush()
+
+    def flush(self, force=False):
+        with self.condition:
+            while self.printed + 1 in self.hops:
+                results, address = self.hops[self.printed + 1]
+                if address and self.resolver is not None and address not in self.names and not force:
+                    break
+                self.printed += 1
+                print(format_hop(self.printed, results, self.names.get(address)), flush=True)
+            self.condition.notify_all()
+
+    def finish(self, count, timeout):
+        """Ожидание имён для count узлов не дольше timeout, затем вывод оставшихся"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.printed >= count, timeout)
+        self.flush(force=True)
+
+
+def traceroute(destination, max_hops=30, probes_per_hop=3, resolve_names=False, timeout=5.0, backend=None,
+               resolver=None):
+    """Основная функция traceroute: пробы всех TTL отправляются сразу (probe_engine)"""
     try:
         dest_ip = socket.gethostbyname(destination)
         print(f"Traceroute to {destination} ({dest_ip}), max hops: {max_hops}")
 
-        for ttl in range(1, max_hops + 1):
-            sender = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
-            receiver = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
-
-            sender.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
-            receiver.settimeout(5.0)
-            receiver.bind(("", 0))
-
-            times = []
-            hop_addr = None
-
-            for probe in range(probes_per_hop):
-                packet = create_icmp_packet(ttl * probes_per_hop + probe)
-                start_time = time.time()
-
-                sender.sendto(packet, (dest_ip, 1))
-
-                try:
-                    response, addr = receiver.recvfrom(1024)
-                    elapsed = (time.time() - start_time) * 1000  # в миллисекундах
-                    times.append(f"{elapsed:.2f} ms")
-                    hop_addr = addr[0]
-
-                    if hop_addr == dest_ip:
-                        break
-
-                except socket.timeout:
-                    times.append("*")
-
-            sender.close()
-            receiver.close()
-
-            times_str = "  ".join(times)
-            if hop_addr:
-                hop_display = resolve_hostname(hop_addr) if resolve_names else hop_addr
-                print(f"{ttl:2d}  {times_str}  {hop_display}")
-            else:
-                print(f"{ttl:2d}  {times_str}")
-
-            if hop_addr == dest_ip:
-                break
+        engine = ProbeEngine(backend or RawSocketBackend())
+        printer = HopPrinter(resolver if resolve_names else None)
+        try:
+            trace = Trace(dest_ip, max_hops, probes_per_hop, timeout, on_hop=printer.on_hop)
+            engine.run([trace])
+        finally:
+            engine.close()
+        printer.finish(trace.last_ttl, DNS_WAIT)
 
     except socket.gaierror:
         print("Не удалось разрешить имя хоста")
@@ -94,20 +90,45 @@ def traceroute(destination, max_hops=30, probes_per_hop=3, resolve_names=False):
 
 
 def main():
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description="traceroute на ICMP Echo")
+    parser.add_argument("-n", dest="resolve_names", action="store_true",
+                        help="разрешать адреса узлов в имена")
+    parser.add_argument("-m", dest="max_hops", type=int, default=30, help="максимальный TTL")
+    parser.add_argument("-q", dest="probes", type=int, default=3, help="проб на узел")
+    parser.add_argument("-w", dest="timeout", type=float, default=5.0, help="ожидание ответа, с")
+    parser.add_argument("--simulate", action="store_true",
+                        help="модель сети вместо raw-сокета (назначения 198.51.100.7-9)")
+    parser.add_argument("-f", dest="targets", help="мониторинг узлов из файла, вывод строками JSON")
+    parser.add_argument("-i", dest="interval", type=float, default=10.0, help="период мониторинга, с")
+    parser.add_argument("-c", dest="cycles", type=int, help="число циклов мониторинга")
+    parser.add_argument("--window", type=int, default=100, help="проб на узел в статистике")
+    parser.add_argument("--dns-cache", help="файл для сохранения кэша имён между запусками")
+    parser.add_argument("host", nargs="?")
+    args = parser.parse_args()
+    if args.host is None and not args.simulate and not args.targets:
         print("Использование: python mytraceroute.py [-n] <host>")
         sys.exit(1)
 
-    resolve_names = False
-    destination = None
-
-    if len(sys.argv) == 3 and sys.argv[1] == "-n":
-        resolve_names = True
-        destination = sys.argv[2]
-    else:
-        destination = sys.argv[1]
-
-    traceroute(destination, resolve_names=resolve_names)
+    backend = demo_network() if args.simulate else None
+    resolver = None
+    if args.resolve_names:
+        resolver = Resolver(cache_file=args.dns_cache, **({"lookup": demo_lookup} if args.simulate else {}))
+    try:
+        if args.targets:
+            engine = ProbeEngine(backend or RawSocketBackend())
+            try:
+                monitor(engine, read_targets(args.targets), args.interval, args.max_hops, args.probes,
+                        args.timeout, args.window, args.cycles, resolver=resolver)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                engine.close()
+        else:
+            traceroute(args.host or "198.51.100.7", args.max_hops, args.probes, args.resolve_names,
+                       args.timeout, backend, resolver)
+    finally:
+        if resolver is not None:
+            resolver.close()
 
 
 if __name__ == "__main__":
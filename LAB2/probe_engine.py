@@ -0,0 +1,225 @@
+"""Отправка проб traceroute сразу для всех TTL через один raw-сокет.
+
+Ответы (Echo Reply, Time Exceeded, Destination Unreachable) сопоставляются с пробой
+по id и seq исходного эхо-запроса, поэтому пробы всех TTL и всех трасс могут
+быть в пути одновременно. Один цикл на селекторе принимает ответы и снимает
+пробы с истёкшим сроком ожидания; трасса занимает примерно время ответа самого
+дальнего узла, а молчащие узлы добавляют не больше одного timeout.
+
+Сокет скрыт за backend с методами send(packet, dest_ip, ttl), recv() и fileno(),
+его можно подменить моделью сети (simulated_network.py).
+"""
+import os
+import selectors
+import socket
+import time
+from collections import deque
+
+from icmp import ICMP_ECHO_REPLY, ICMP_DEST_UNREACHABLE, PacketBuilder, parse_reply
+
+# проб подряд без проверки ответов: иначе при тысячах проб ответы ждут конца
+# отправки, а RTT и сроки ожидания завышаются
+BURST = 64
+
+
+class RawSocketBackend:
+    """ICMP через raw-сокет (нужны права администратора)"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+        self.sock.setblocking(False)
+        self.ttl = None
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, packet, dest_ip, ttl):
+        if ttl != self.ttl:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+            self.ttl = ttl
+        self.sock.sendto(packet, (dest_ip, 1))
+
+    def recv(self):
+        """Очередной пакет или None, если пока больше нет"""
+        try:
+            return self.sock.recv(65535)
+        except (BlockingIOError, InterruptedError):
+            return None
+
+    def close(self):
+        self.sock.close()
+
+
+class Trace:
+    """Один проход до dest_ip: probes_per_hop проб на каждый TTL от 1 до max_hops.
+
+    hops[ttl - 1] - список результатов проб: (адрес, rtt в мс) или None (нет ответа).
+    on_hop(ttl, результаты) вызывается по порядку TTL, как только узел и все
+    предыдущие получили ответы или время ожидания истекло.
+    """
+
+    def __init__(self, dest_ip, max_hops=30, probes_per_hop=3, timeout=5.0, on_hop=None):
+        self.dest_ip = dest_ip
+        self.max_hops = max_hops
+        self.probes_per_hop = probes_per_hop
+        self.timeout = timeout
+        self.on_hop = on_hop
+        self.hops = [[None] * probes_per_hop for _ in range(max_hops)]
+        self.waiting = [probes_per_hop] * max_hops  # неразрешённых проб на каждый TTL
+        self.dest_ttl = None  # ближайший TTL, на котором ответило само назначение
+        self.reported = 0
+        # порядок отправки: сначала по одной пробе на каждый TTL, затем вторые и т.д.
+        self.schedule = deque((ttl, index) for index in range(probes_per_hop)
+                              for ttl in range(1, max_hops + 1))
+
+    @property
+    def last_ttl(self):
+        return self.dest_ttl or self.max_hops
+
+    def resolve(self, ttl, index, result):
+        if ttl > self.last_ttl:
+            return
+        self.hops[ttl - 1][index] = result
+        self.waiting[ttl - 1] -= 1
+        self._report()
+
+    def reached(self, ttl):
+        """Назначение ответило на пробу с этим TTL: дальние TTL больше не нужны"""
+        if self.dest_ttl is not None and ttl >= self.dest_ttl:
+            return
+        self.dest_ttl = ttl
+        self.schedule = deque(item for item in self.schedule if item[0] <= ttl)
+
+    def _report(self):
+        while self.reported < self.last_ttl and self.waiting[self.reported] == 0:
+            self.reported += 1
+            if self.on_hop is not None:
+                self.on_hop(self.reported, self.hops[self.reported - 1])
+
+    @property
+    def done(self):
+        return self.reported >= self.last_ttl
+
+    def result(self):
+        return self.hops[:self.last_ttl]
+
+
+class _Probe:
+    __slots__ = ('trace', 'ttl', 'index', 'key', 'sent', 'deadline')
+
+    def __init__(self, trace, ttl, index, key, sent):
+        self.trace = trace
+        self.ttl = ttl
+        self.index = index
+        self.key = key
+        self.sent = sent
+        self.deadline = sent + trace.timeout
+
+
+class ProbeEngine:
+    """Цикл отправки и приёма проб для любого числа трасс на одном сокете"""
+
+    def __init__(self, backend, ident=None, interval=0.0, build_packet=None):
+        self.backend = backend
+        self.ident = (os.getpid() if ident is None else ident) & 0xFFFF
+        self.interval = interval  # пауза между пробами: маршрутизаторы ограничивают частоту ICMP
+        self.build_packet = build_packet or PacketBuilder(self.ident).build  # build_packet(seq)
+        self.seq = 0
+        self.pending = {}  # байты id и seq -> _Probe
+        self.deadlines = deque()  # пробы в порядке истечения срока
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(backend.fileno(), selectors.EVENT_READ)
+        self.sent = 0
+        self.received = 0
+        self.ignored = 0  # чужие и запоздавшие ответы
+
+    def _next_key(self):
+        while True:
+            self.seq = (self.seq + 1) & 0xFFFF
+            packet = self.build_packet(self.seq)
+            key = bytes(packet[4:8])
+            if key not in self.pending:
+                return packet, key
+
+    def send_probe(self, trace, ttl, index):
+        packet, key = self._next_key()
+        probe = _Probe(trace, ttl, index, key, time.monotonic())
+        self.backend.send(packet, trace.dest_ip, ttl)
+        self.pending[key] = probe
+        self._add_deadline(probe)
+        self.sent += 1
+
+    def _add_deadline(self, probe):
+        # при одинаковом timeout сроки идут по порядку отправки; иначе вставка на место
+        if not self.deadlines or self.deadlines[-1].deadline <= probe.deadline:
+            self.deadlines.append(probe)
+            return
+        for i in range(len(self.deadlines) - 1, -1, -1):
+            if self.deadlines[i].deadline <= probe.deadline:
+                self.deadlines.insert(i + 1, probe)
+                return
+        self.deadlines.appendleft(probe)
+
+    def receive(self):
+        """Разбор всех пришедших пакетов"""
+        while True:
+            data = self.backend.recv()
+            if data is None:
+                return
+            now = time.monotonic()
+            reply = parse_reply(data)
+            probe = self.pending.pop(reply[2], None) if reply is not None else None
+            if probe is None:
+                self.ignored += 1
+                continue
+            icmp_type, address, _ = reply
+            self.received += 1
+            if icmp_type == ICMP_ECHO_REPLY or (icmp_type == ICMP_DEST_UNREACHABLE and address == probe.trace.dest_ip):
+                probe.trace.reached(probe.ttl)
+            probe.trace.resolve(probe.ttl, probe.index, (address, (now - probe.sent) * 1000))
+
+    def expire(self, now):
+        while self.deadlines and self.deadlines[0].deadline <= now:
+            probe = self.deadlines.popleft()
+            if self.pending.get(probe.key) is probe:
+                del self.pending[probe.key]
+                probe.trace.resolve(probe.ttl, probe.index, None)
+
+    def run(self, traces, stop=None):
+        """Выполнение трасс до завершения всех (или до stop(), если задано)"""
+        traces = list(traces)
+        next_send = time.monotonic()
+        while True:
+            active = [trace for trace in traces if not trace.done]
+            if not active or (stop is not None and stop()):
+                break
+            now = time.monotonic()
+            # отправка: без паузы - до BURST проб сразу, иначе по одной на каждый интервал
+            budget = BURST
+            for trace in active:
+                while trace.schedule and budget and now >= next_send:
+                    self.send_probe(trace, *trace.schedule.popleft())
+                    budget -= 1
+                    if self.interval:
+                        next_send += self.interval
+                        now = time.monotonic()
+
+            if not budget:
+                wait = 0.0
+            else:
+                waits = [self.deadlines[0].deadline - now] if self.deadlines else []
+                if any(trace.schedule for trace in active):
+                    waits.append(next_send - now)
+                wait = max(0.0, min(waits)) if waits else 0.0
+            if self.selector.select(wait):
+                self.receive()
+            # сроки проверяются после приёма: пришедший ответ важнее истёкшего срока
+            self.expire(time.monotonic())
+        # пробы законченных трасс больше не ждём
+        finished = {id(trace) for trace in traces}
+        self.pending = {key: probe for key, probe in self.pending.items() if id(probe.trace) not in finished}
+        self.deadlines = deque(probe for probe in self.deadlines if id(probe.trace) not in finished)
+
+    def close(self):
+        self.selector.close()
+        self.backend.close()
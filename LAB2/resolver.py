@@ -0,0 +1,111 @@
+"""Обратное разрешение адресов узлов в фоне, с общим кэшем.
+
+Запросы PTR выполняются в ограниченном пуле потоков и не задерживают отправку и
+приём проб. Кэш LRU хранит и найденные имена (ttl), и неудачи (negative_ttl), его
+можно сохранять в файл между запусками.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def gethostbyaddr(ip):
+    """Имя узла или None"""
+    try:
+        return socket.gethostbyaddr(ip)[0]
+    except OSError:
+        return None
+
+
+class Resolver:
+    def __init__(self, workers=8, ttl=3600.0, negative_ttl=300.0, max_entries=10000,
+                 max_pending=256, cache_file=None, lookup=gethostbyaddr):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_pending = max_pending  # запросов в очереди пула, остальные пропускаются
+        self.cache_file = cache_file
+        self.lookup = lookup
+        self.cache = OrderedDict()  # адрес -> (имя или None, срок годности по time.time)
+        self.pending = {}  # адрес -> функции, ждущие результата
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='dns')
+        if cache_file:
+            self.load()
+
+    def cached(self, ip):
+        """(True, имя или None), если ответ в кэше и не устарел, иначе (False, None)"""
+        with self.lock:
+            return self._cached(ip)
+
+    def _cached(self, ip):
+        entry = self.cache.get(ip)
+        if entry is None or entry[1] < time.time():
+            return False, None
+        self.cache.move_to_end(ip)
+        return True, entry[0]
+
+    def resolve(self, ip, callback=None):
+        """Имя из кэша сразу или None и запрос в фоне; callback(ip, имя) - по готовности.
+
+        Если ответ уже в кэше, callback вызывается сразу в этом потоке, иначе - в потоке
+        пула. Когда очередь пула заполнена, запрос пропускается: callback(ip, None).
+        """
+        with self.lock:
+            found, name = self._cached(ip)
+            if not found:
+                waiting = self.pending.get(ip)
+                if waiting is not None:
+                    if callback is not None:
+                        waiting.append(callback)
+                    return None
+                if len(self.pending) < self.max_pending:
+                    self.pending[ip] = [callback] if callback is not None else []
+                    self.executor.submit(self._resolve, ip)
+                    return None
+        if callback is not None:
+            callback(ip, name)
+        return name
+
+    def _resolve(self, ip):
+        name = self.lookup(ip)
+        expires = time.time() + (self.ttl if name else self.negative_ttl)
+        with self.lock:
+            self.cache[ip] = (name, expires)
+            self.cache.move_to_end(ip)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+            callbacks = self.pending.pop(ip, [])
+        for callback in callbacks:
+            callback(ip, name)
+
+    def load(self):
+        try:
+            with open(self.cache_file, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self.lock:
+            for ip, (name, expires) in entries.items():
+                if expires > now:
+                    self.cache[ip] = (name, expires)
+
+    def save(self):
+        """Запись кэша в файл (через временный файл и замену)"""
+        with self.lock:
+            now = time.time()
+            entries = {ip: entry for ip, entry in self.cache.items() if entry[1] > now}
+        temp = self.cache_file + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(temp, self.cache_file)
+
+    def close(self, wait=False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        if self.cache_file:
+            self.save()
@@ -0,0 +1,131 @@
+"""Модель сети для проверки traceroute без raw-сокетов и прав администратора.
+
+Реализует тот же интерфейс backend, что и RawSocketBackend (send, recv, fileno,
+close): на каждый отправленный эхо-запрос через заданное время приходит готовый
+IP-пакет с ответом - Time Exceeded от маршрутизатора или Echo Reply от назначения.
+"""
+import heapq
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from icmp import ICMP_ECHO_REPLY, ICMP_TIME_EXCEEDED, checksum
+
+
+def _ip_header(source, dest, payload_length, ttl=64):
+    return struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + payload_length, 0, 0, ttl,
+                       socket.IPPROTO_ICMP, 0, socket.inet_aton(source), socket.inet_aton(dest))
+
+
+def _icmp(icmp_type, rest, payload):
+    message = struct.pack('!BBH', icmp_type, 0, 0) + rest + payload
+    return message[:2] + struct.pack('!H', checksum(message)) + message[4:]
+
+
+class SimulatedNetwork:
+    """routes: {адрес назначения: [(адрес маршрутизатора или None, rtt в секундах), ...]}
+
+    Последний элемент маршрута - само назначение; None - узел, который не отвечает.
+    loss - вероятность потери любого ответа.
+    """
+
+    def __init__(self, routes, loss=0.0, seed=None, source='192.0.2.1'):
+        self.routes = routes
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.source = source
+        # сокеты только будят селектор, сами пакеты лежат в delivered
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        self.delivered = deque()
+        self.queue = []  # (время доставки, номер, пакет)
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.sent = 0
+        self.thread = threading.Thread(target=self._deliver, daemon=True)
+        self.thread.start()
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def send(self, packet, dest_ip, ttl):
+        self.sent += 1
+        route = self.routes.get(dest_ip)
+        if not route:
+            return
+        address, rtt = route[min(ttl, len(route)) - 1]
+        if address is None or self.random.random() < self.loss:
+            return
+        original = _ip_header(self.source, dest_ip, len(packet), ttl=1) + packet
+        if ttl >= len(route):
+            reply = _icmp(ICMP_ECHO_REPLY, packet[4:8], packet[8:])
+        else:
+            reply = _icmp(ICMP_TIME_EXCEEDED, b'\0' * 4, original[:28])
+        data = _ip_header(address, self.source, len(reply)) + reply
+        with self.condition:
+            self.counter += 1
+            heapq.heappush(self.queue, (time.monotonic() + rtt, self.counter, data))
+            self.condition.notify()
+
+    def recv(self):
+        if not self.delivered:
+            try:
+                self.reader.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                pass
+            # пакеты, добавленные до прочитанного сигнала, уже в очереди
+            if not self.delivered:
+                return None
+        return self.delivered.popleft()
+
+    def _deliver(self):
+        while True:
+            with self.condition:
+                while not self.closed:
+                    delay = self.queue[0][0] - time.monotonic() if self.queue else None
+                    if delay is not None and delay <= 0:
+                        break
+                    self.condition.wait(delay)
+                if self.closed:
+                    return
+                now = time.monotonic()
+                while self.queue and self.queue[0][0] <= now:
+                    self.delivered.append(heapq.heappop(self.queue)[2])
+            try:
+                self.writer.send(b'.')
+            except BlockingIOError:
+                pass  # сигнал уже ждёт чтения
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.reader.close()
+        self.writer.close()
+
+
+def demo_network():
+    """Маршруты в 10 узлов к 198.51.100.7-9 с общим началом: один узел молчит,
+    часть ответов теряется"""
+    routes = {}
+    for last in (7, 8, 9):
+        route = [(f'203.0.113.{hop}', 0.002 * hop) for hop in range(1, 6)]
+        route += [(f'203.0.{last}.{hop}', 0.002 * hop) for hop in range(6, 10)]
+        route[4] = (None, 0)
+        route.append((f'198.51.100.{last}', 0.025))
+        routes[f'198.51.100.{last}'] = route
+    return SimulatedNetwork(routes, loss=0.05)
+
+
+def demo_lookup(ip):
+    """Медленный PTR для demo_network: имена есть только у маршрутизаторов"""
+    time.sleep(random.uniform(0.05, 1.0))
+    if ip.startswith('203.0.'):
+        return 'r' + ip.split('.', 2)[2].replace('.', '-') + '.demo.example'
+    return None
@@ -0,0 +1,138 @@
+"""Сравнение рассылки с накоплением кадров и без: сообщений/с и задержка доставки.
+
+Запуск: python bench_batching.py [--receivers 100] [--senders 4] [--messages 1000] [--rate 1000]
+Сервер запускается отдельным процессом в режиме selectors с кадрами v2.
+"""
+import argparse
+import selectors
+import socket
+import threading
+import time
+
+from chat_protocol import FrameDecoder, encode_frame, parse_greeting, MSG_TEXT
+from chat_util import spawn_server, percentile
+
+
+def connect(port, nickname):
+    """Подключение с рукопожатием NAME/OK"""
+    sock = socket.create_connection(('127.0.0.1', port))
+    version = parse_greeting(sock.recv(1024))
+    sock.sendall(nickname.encode('utf-8'))
+    response = sock.recv(1024)
+    if version is None or not response.startswith(b"OK"):
+        raise RuntimeError("Ошибка рукопожатия")
+    decoder = FrameDecoder(version)
+    decoder.feed(response[2:])
+    return sock, decoder
+
+
+def run(port, receivers, senders, messages, rate):
+    listeners = [connect(port, f"r{i}") for i in range(receivers)]
+    writers = [connect(port, f"s{i}")[0] for i in range(senders)]
+    for sock in writers:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    expected = receivers * senders * messages
+    latencies = []
+    done = threading.Event()
+
+    def receive():
+        selector = selectors.DefaultSelector()
+        for sock, decoder in listeners:
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ, decoder)
+        deadline = time.monotonic() + 60
+        while len(latencies) < expected and time.monotonic() < deadline:
+            for key, _ in selector.select(0.5):
+                if key.data.recv_into(key.fileobj) == 0:
+                    selector.unregister(key.fileobj)
+                    continue
+                now = time.monotonic_ns()
+                for msg_type, content in key.data.frames():
+                    if msg_type == MSG_TEXT:
+                        sent = int(content.rsplit(b': ', 1)[1])
+                        latencies.append((now - sent) / 1e6)
+        done.set()
+
+    def send(sock):
+        interval = 1 / rate if rate else 0
+        next_time = time.monotonic()
+        for _ in range(messages):
+            payload = str(time.monotonic_ns()).encode()
+            sock.sendall(encode_frame(MSG_TEXT, payload, 2))
+            if interval:
+                next_time += interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    time.sleep(0.5)  # рассылки о подключении
+    for sock, decoder in listeners:
+        sock.setblocking(False)
+        try:
+            while decoder.recv_into(sock):
+                decoder.frames()
+        except BlockingIOError:
+            decoder.frames()
+
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+    start = time.monotonic()
+    threads = [threading.Thread(target=send, args=(sock,)) for sock in writers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    done.wait()
+    elapsed = time.monotonic() - start
+
+    for sock, _ in listeners:
+        sock.close()
+    for sock in writers:
+        sock.close()
+
+    latencies.sort()
+    return {
+        "delivered": len(latencies),
+        "lost": expected - len(latencies),
+        "msgs_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) or 0.0,
+        "p99_ms": percentile(latencies, 99) or 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк накопления кадров в ChatServer")
+    parser.add_argument('--port', type=int, default=5600)
+    parser.add_argument('--receivers', type=int, default=100)
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=1000, help="сообщений от каждого отправителя")
+    parser.add_argument('--rate', type=float, default=1000, help="сообщений/с от каждого отправителя (0 - без паузы)")
+    parser.add_argument('--window', type=float, default=2.0, help="окно накопления, мс")
+    args = parser.parse_args()
+
+    variants = [
+        ("без накопления", []),
+        ("без накопления, nodelay", ['--nodelay']),
+        (f"окно {args.window} мс", ['--batch-window', str(args.window)]),
+        (f"окно {args.window} мс, nodelay", ['--batch-window', str(args.window), '--nodelay']),
+    ]
+    if hasattr(socket, 'TCP_CORK'):
+        variants.append((f"окно {args.window} мс, cork", ['--batch-window', str(args.window), '--cork']))
+
+    print(f"{'режим':32} {'сообщ/с':>10} {'p50, мс':>9} {'p99, мс':>9} {'потеряно':>9}")
+    for index, (name, options) in enumerate(variants):
+        port = args.port + index
+        proc = spawn_server('127.0.0.1', port, ['--mode', 'selectors', '--framing', '2',
+                                                '--queue-limit', '1000000', *options])
+        try:
+            result = run(port, args.receivers, args.senders, args.messages, args.rate)
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"{name:32} {result['msgs_per_sec']:10.0f} {result['p50_ms']:9.2f} "
+              f"{result['p99_ms']:9.2f} {result['lost']:9d}")
+
+
+if __name__ == "__main__":
+    main()
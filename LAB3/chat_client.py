@@ -1,22 +1,38 @@
 import socket
 import threading
+from collections import deque
 from datetime import datetime
 
+from chat_protocol import (FrameDecoder, encode_frame, parse_greeting, V1_LIMIT,
+                           encode_history_request, decode_history_record,
+                           MSG_TEXT, MSG_JOIN, MSG_LEAVE, MSG_NOTICE, MSG_HISTORY)
+
 
 class ChatClient:
-    def __init__(self):
+    def __init__(self, client_host=None, client_port=None, nickname=None,
+                 server_host='127.0.0.1', server_port=5555, history_limit=1000):
         # Настройки сервера (по умолчанию)
-        self.server_host = '127.0.0.1'
-        self.server_port = 5555
-
-        # Настройки клиента (вводятся пользователем)
-        self.client_host = input("Введите IP этого клиента: ") or '127.0.0.1'
-        self.client_port = self.get_port("Введите порт этого клиента: ", 5556)
-        self.nickname = input("Введите ваш никнейм: ") or 'Guest'
+        self.server_host = server_host
+        self.server_port = server_port
+
+        # Настройки клиента (если не переданы - вводятся пользователем, порт 0 - любой свободный)
+        if client_host is None:
+            client_host = input("Введите IP этого клиента: ") or '127.0.0.1'
+        if client_port is None:
+            client_port = self.get_port("Введите порт этого клиента: ", 5556)
+        if nickname is None:
+            nickname = input("Введите ваш никнейм: ") or 'Guest'
+        self.client_host = client_host
+        self.client_port = client_port
+        self.nickname = nickname
 
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.running = False
-        self.history = []
+        self.history = deque(maxlen=history_limit)  # последние сообщения
+        self.framing = 1
+        self.decoder = None
+        self.waiting_for_input = False
+        self.last_seq = 0  # номер последней полученной записи истории сервера
 
     def get_port(self, prompt, default):
         """Получение и валидация порта"""
@@ -33,14 +49,21 @@ class ChatClient:
             # Привязываем клиентский сокет к указанному адресу
             self.client.bind((self.client_host, self.client_port))
             self.client.connect((self.server_host, self.server_port))
+            # каждая строка - отдельное сообщение, копить их в сегменты незачем
+            self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.running = True
 
             # Трехэтапное рукопожатие
             name_request = self.client.recv(1024)
-            if name_request == b"NAME":
+            framing = parse_greeting(name_request)
+            if framing is not None:
+                self.framing = framing
+                self.decoder = FrameDecoder(framing)
                 self.client.send(self.nickname.encode('utf-8'))
                 response = self.client.recv(1024)
-                if response == b"OK":
+                if response.startswith(b"OK"):
+                    # кадры, пришедшие вместе с подтверждением
+                    self.decoder.feed(response[2:])
                     print(f"Успешно подключено к серверу {self.server_host}:{self.server_port}")
                 else:
                     print("Ошибка подключения")
@@ -65,30 +88,16 @@ class ChatClient:
         """Получение сообщений от сервера"""
         while self.running:
             try:
-                message = self.client.recv(1024)
-                if not message:
+                # за одно чтение может прийти несколько кадров или часть кадра
+                for msg_type, content in self.decoder.frames():
+                    if msg_type == MSG_HISTORY:
+                        self.show_history_record(content)
+                    else:
+                        self.show_message(msg_type, content.decode('utf-8'))
+
+                if self.decoder.recv_into(self.client) == 0:
                     break
 
-                msg_type = message[0]
-                msg_len = message[1]
-                content = message[2:2 + msg_len].decode('utf-8')
-
-                timestamp = datetime.now().strftime("%H:%M:%S")
-                log_entry = f"[{timestamp}] {content}"
-
-                if msg_type == 1:  # Обычное сообщение
-                    print(f"{content}")
-                elif msg_type == 3:  # Пользователь подключился
-                    print(f">>> {content} <<<")
-                elif msg_type == 4:  # Пользователь отключился
-                    print(f"<<< {content} >>>")
-
-                self.history.append(log_entry)
-
-                # Выводим приглашение только если пользователь не вводит сообщение
-                if not self.waiting_for_input:
-                    print("Ваше сообщение: ", end="", flush=True)
-
             except ConnectionResetError:
                 break
             except Exception as e:
@@ -98,15 +107,61 @@ class ChatClient:
         print("\nСоединение с сервером разорвано")
         self.running = False
 
+    def show_message(self, msg_type, content):
+        """Вывод полученного сообщения"""
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        log_entry = f"[{timestamp}] {content}"
+
+        if msg_type == MSG_TEXT:  # Обычное сообщение
+            print(f"{content}")
+        elif msg_type == MSG_JOIN:  # Пользователь подключился
+            print(f">>> {content} <<<")
+        elif msg_type == MSG_LEAVE:  # Пользователь отключился
+            print(f"<<< {content} >>>")
+        elif msg_type == MSG_NOTICE:  # Служебное сообщение сервера
+            print(f"*** {content} ***")
+
+        self.history.append(log_entry)
+
+        # Выводим приглашение только если пользователь не вводит сообщение
+        if not self.waiting_for_input:
+            print("Ваше сообщение: ", end="", flush=True)
+
     def send(self, message):
         """Отправка сообщения на сервер"""
         try:
-            self.client.send(message.encode('utf-8'))
+            data = message.encode('utf-8')
+            if self.framing > 1:
+                data = encode_frame(MSG_TEXT, data, self.framing)
+            elif len(data) > V1_LIMIT:
+                print(f"*** Сервер использует первую версию протокола: сообщение длиннее {V1_LIMIT} байт будет обрезано ***")
+            self.client.sendall(data)
             timestamp = datetime.now().strftime("%H:%M:%S")
             self.history.append(f"[{timestamp}] Вы: {message}")
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
 
+    def request_log(self, after_seq=0):
+        """Запрос страницы истории у сервера: сообщения с номером больше after_seq"""
+        if self.framing < 2:
+            print("История сервера доступна только с --framing 2")
+            return
+        try:
+            self.client.sendall(encode_history_request(after_seq=after_seq))
+        except Exception as e:
+            print(f"Ошибка запроса истории: {e}")
+
+    def show_history_record(self, content):
+        """Вывод записи истории сервера"""
+        record = decode_history_record(content)
+        if record is None:
+            print(f"--- конец страницы, следующая: /log {self.last_seq} ---")
+            return
+        seq, ts, msg_type, text = record
+        self.last_seq = seq
+        timestamp = datetime.fromtimestamp(ts).strftime("%d.%m %H:%M:%S")
+        print(f"#{seq} [{timestamp}] {text.decode('utf-8', 'replace')}")
+
     def show_history(self):
         """Показать историю сообщений"""
         print("\n--- История чата ---")
@@ -141,10 +196,14 @@ def main():
             elif message.lower() == '/history':
                 client.show_history()
                 #print("Ваше сообщение: ", end="", flush=True)
+            elif message.lower().startswith('/log'):
+                argument = message[4:].strip()
+                client.request_log(int(argument) if argument.isdigit() else 0)
             elif message.lower() == '/help':
                 print("\nДоступные команды:")
                 print("/exit - выход из чата")
                 print("/history - показать историю сообщений")
+                print("/log [номер] - история сервера после сообщения с этим номером")
                 print("/help - показать справку")
                 #print("Ваше сообщение: ", end="", flush=True)
             else:
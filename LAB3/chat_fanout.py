@@ -0,0 +1,165 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+
+# Политики для клиентов, которые не успевают читать
+DROP_OLDEST = 'drop_oldest'  # выбрасываем самый старый кадр из очереди
+DISCONNECT = 'disconnect'    # отключаем клиента
+COALESCE = 'coalesce'        # заменяем очередь одной сводкой о пропущенных сообщениях
+POLICIES = (DROP_OLDEST, DISCONNECT, COALESCE)
+
+IOV_MAX = 1024  # максимум буферов в одном вызове sendmsg
+
+
+def sendmsg_all(sock, frames):
+    """Блокирующая отправка списка кадров минимальным числом системных вызовов"""
+    if not hasattr(sock, 'sendmsg'):  # Windows
+        sock.sendall(b''.join(frames))
+        return
+
+    buffers = [memoryview(frame) for frame in frames]
+    first = 0
+    while first < len(buffers):
+        sent = sock.sendmsg(buffers[first:first + IOV_MAX])
+        while first < len(buffers) and sent >= len(buffers[first]):
+            sent -= len(buffers[first])
+            first += 1
+        if sent:
+            buffers[first] = buffers[first][sent:]
+
+
+class Outbox:
+    """Ограниченная очередь исходящих кадров одного клиента.
+
+    Кадры кладутся в очередь как есть (bytes), поэтому один и тот же
+    закодированный кадр разделяется всеми получателями рассылки.
+    """
+
+    def __init__(self, limit=256, policy=DROP_OLDEST, summary=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика: {policy}")
+        self.limit = limit        # None - без ограничения
+        self.policy = policy
+        self.summary = summary    # summary(n) -> кадр со сводкой о n пропущенных сообщениях
+        self.frames = deque()
+        self.offset = 0           # сколько байт первого кадра уже отправлено
+        self.cond = threading.Condition()
+        self.closed = False
+
+        # счётчики
+        self.dropped = 0
+        self.max_depth = 0
+        self.skipped = 0          # пропущено с момента последней доставленной сводки
+        self._summary_frame = None
+
+    @property
+    def depth(self):
+        return len(self.frames)
+
+    def push(self, frame, force=False):
+        """Добавление кадра; False - клиента нужно отключить"""
+        with self.cond:
+            if self.closed:
+                return True
+            if not force and self.limit is not None and len(self.frames) >= self.limit:
+                if self.policy == DISCONNECT:
+                    self.dropped += 1
+                    return False
+                if self.policy == DROP_OLDEST:
+                    self._drop_oldest()
+                else:
+                    self._coalesce()
+
+            self.frames.append(frame)
+            if len(self.frames) > self.max_depth:
+                self.max_depth = len(self.frames)
+            self.cond.notify()
+            return True
+
+    def _drop_oldest(self):
+        # частично отправленный кадр выбрасывать нельзя - поток разъедется
+        index = 1 if self.offset else 0
+        if len(self.frames) > index:
+            del self.frames[index]
+            self.dropped += 1
+
+    def _coalesce(self):
+        head = self.frames.popleft() if self.offset else None
+        dropped = len(self.frames)
+        if self._summary_frame is not None:
+            if head is self._summary_frame:
+                self.skipped = 0  # старая сводка уже уходит клиенту
+            else:
+                dropped -= 1      # предыдущая сводка - не сообщение
+
+        self.dropped += dropped
+        self.skipped += dropped
+        self.frames.clear()
+        if head is not None:
+            self.frames.append(head)
+
+        self._summary_frame = None
+        if self.summary is not None:
+            self._summary_frame = self.summary(self.skipped)
+            self.frames.append(self._summary_frame)
+
+    def _delivered(self, frame):
+        if frame is self._summary_frame:
+            self._summary_frame = None
+            self.skipped = 0
+
+    def send(self, sock, batch=False):
+        """Неблокирующая отправка очереди; BlockingIOError - буфер сокета заполнен.
+
+        batch=True - вся очередь уходит одним вызовом sendmsg вместо send на каждый кадр.
+        """
+        batch = batch and hasattr(sock, 'sendmsg')
+        with self.cond:
+            while self.frames:
+                if batch:
+                    buffers = [memoryview(frame) for frame in itertools.islice(self.frames, IOV_MAX)]
+                    buffers[0] = buffers[0][self.offset:]
+                    self._advance(sock.sendmsg(buffers))
+                else:
+                    self._advance(sock.send(memoryview(self.frames[0])[self.offset:]))
+                if self.offset:
+                    return  # кадр ушёл не целиком - буфер сокета заполнен
+
+    def _advance(self, sent):
+        sent += self.offset
+        while self.frames and sent >= len(self.frames[0]):
+            frame = self.frames.popleft()
+            sent -= len(frame)
+            self._delivered(frame)
+        self.offset = sent
+
+    def take(self, window=0):
+        """Ожидание и извлечение всех кадров очереди (режим потоков); None - очередь закрыта.
+
+        window - сколько секунд после первого кадра ждать остальные, чтобы отправить их вместе.
+        """
+        with self.cond:
+            while not self.frames and not self.closed:
+                self.cond.wait()
+            if window:
+                deadline = time.monotonic() + window
+                while not self.closed and (self.limit is None or len(self.frames) < self.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+            if self.closed:
+                return None
+            frames = list(self.frames)
+            self.frames.clear()
+            self._summary_frame = None
+            self.skipped = 0
+            return frames
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.frames.clear()
+            self.cond.notify_all()
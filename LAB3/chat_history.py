@@ -0,0 +1,235 @@
+import bisect
+import itertools
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+
+# Запись журнала: номер, время, тип, длина содержимого
+RECORD = struct.Struct('!QdBI')
+
+HistoryRecord = namedtuple('HistoryRecord', 'seq ts msg_type content')
+
+
+class _Segment:
+    """Файл журнала с разреженным индексом (seq, ts, смещение)"""
+
+    def __init__(self, path, first_seq):
+        self.path = path
+        self.first_seq = first_seq
+        self.first_ts = None
+        self.size = 0
+        self.count = 0
+        self.index = []    # каждая index_every-я запись: (seq, ts, offset)
+        self._map = None
+        self._map_size = 0
+
+    def add(self, seq, ts, offset, index_every):
+        if self.first_ts is None:
+            self.first_ts = ts
+        if self.count % index_every == 0:
+            self.index.append((seq, ts, offset))
+        self.count += 1
+
+    def view(self):
+        """Отображение файла в память; переотображается, если файл вырос"""
+        if self._map_size != self.size:
+            self.close()
+            if self.size:
+                with open(self.path, 'rb') as f:
+                    self._map = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._map_size = self.size
+        return self._map
+
+    def records(self, offset):
+        """Записи начиная со смещения"""
+        view = self.view()
+        while offset + RECORD.size <= self.size:
+            seq, ts, msg_type, length = RECORD.unpack_from(view, offset)
+            start = offset + RECORD.size
+            if start + length > self.size:
+                return  # недописанная запись
+            yield HistoryRecord(seq, ts, msg_type, view[start:start + length])
+            offset = start + length
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._map_size = 0
+
+
+class _Room:
+    def __init__(self, ring_size):
+        self.ring = deque(maxlen=ring_size)
+        self.segments = []
+        self.writer = None
+        self.next_seq = 1
+
+
+class HistoryStore:
+    """История сообщений по комнатам.
+
+    Последние ring_size сообщений комнаты лежат в кольцевом буфере в памяти
+    и отдаются новым клиентам без обращения к диску. Все сообщения
+    дописываются в сегментный журнал; старые читаются через mmap, а нужное
+    место находится по разреженному индексу, без просмотра всего журнала.
+    """
+
+    def __init__(self, directory, ring_size=1000, segment_size=16 * 1024 * 1024,
+                 index_every=64, max_segments=None, flush_interval=1.0):
+        self.directory = directory
+        self.ring_size = ring_size
+        self.segment_size = segment_size
+        self.index_every = index_every
+        self.max_segments = max_segments  # None - хранить всё
+        self.flush_interval = flush_interval  # при аварии теряется не больше этого, с
+        self._last_flush = time.monotonic()
+        self.rooms = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _room_dir(self, room):
+        return os.path.join(self.directory, re.sub(r'[^\w-]', '_', room))
+
+    def _room(self, room):
+        state = self.rooms.get(room)
+        if state is None:
+            state = _Room(self.ring_size)
+            self._load(room, state)
+            self.rooms[room] = state
+        return state
+
+    def _load(self, room, state):
+        """Чтение существующих сегментов: индекс, кольцевой буфер, следующий номер"""
+        directory = self._room_dir(room)
+        os.makedirs(directory, exist_ok=True)
+        names = sorted(name for name in os.listdir(directory) if name.endswith('.log'))
+        for name in names:
+            path = os.path.join(directory, name)
+            segment = _Segment(path, int(name[:-4]))
+            segment.size = os.path.getsize(path)
+            offset = 0
+            for record in segment.records(0):
+                segment.add(record.seq, record.ts, offset, self.index_every)
+                offset += RECORD.size + len(record.content)
+                state.next_seq = record.seq + 1
+                state.ring.append(record)
+
+            if offset < segment.size:
+                # обрезаем недописанную запись после аварийного завершения
+                segment.close()
+                with open(path, 'r+b') as f:
+                    f.truncate(offset)
+                segment.size = offset
+            state.segments.append(segment)
+
+    def append(self, room, msg_type, content, ts=None):
+        """Добавление сообщения; возвращает его номер"""
+        ts = time.time() if ts is None else ts
+        with self.lock:
+            state = self._room(room)
+            seq = state.next_seq
+            state.next_seq += 1
+            record = HistoryRecord(seq, ts, msg_type, content)
+            state.ring.append(record)
+
+            segment = self._active_segment(room, state, seq)
+            state.writer.write(RECORD.pack(seq, ts, msg_type, len(content)))
+            state.writer.write(content)
+            segment.add(seq, ts, segment.size, self.index_every)
+            segment.size += RECORD.size + len(content)
+
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                state.writer.flush()
+                self._last_flush = now
+            return seq
+
+    def _active_segment(self, room, state, seq):
+        """Сегмент для записи; новый, если текущий заполнен"""
+        segment = state.segments[-1] if state.segments else None
+        if segment is not None and segment.size < self.segment_size:
+            if state.writer is None:
+                state.writer = open(segment.path, 'ab')  # продолжаем сегмент после перезапуска
+            return segment
+
+        if state.writer is not None:
+            state.writer.close()
+        segment = _Segment(os.path.join(self._room_dir(room), f"{seq:020d}.log"), seq)
+        state.segments.append(segment)
+        state.writer = open(segment.path, 'ab')
+
+        if self.max_segments is not None:
+            while len(state.segments) > self.max_segments:
+                old = state.segments.pop(0)
+                old.close()
+                os.remove(old.path)
+        return segment
+
+    def recent(self, room, count):
+        """Последние count сообщений из памяти"""
+        with self.lock:
+            ring = self._room(room).ring
+            return list(itertools.islice(ring, max(0, len(ring) - count), None))
+
+    def query(self, room, after_seq=None, since_ts=None, limit=100):
+        """Страница истории: сообщения с номером больше after_seq или со временем не раньше since_ts"""
+        if (after_seq is None) == (since_ts is None):
+            raise ValueError("Нужно указать ровно один из параметров after_seq и since_ts")
+
+        with self.lock:
+            state = self._room(room)
+            ring = state.ring
+            if after_seq is not None:
+                if ring and after_seq + 1 >= ring[0].seq:
+                    start = after_seq + 1 - ring[0].seq
+                    return list(itertools.islice(ring, start, start + limit))
+                return self._read(state, 0, after_seq + 1, limit)
+
+            if ring and ring[0].ts <= since_ts:
+                return [record for record in ring if record.ts >= since_ts][:limit]
+            return self._read(state, 1, since_ts, limit)
+
+    def _read(self, state, field, value, limit):
+        """Чтение с диска: поиск сегмента и места в нём по индексу, затем последовательное чтение"""
+        if state.writer is not None:
+            state.writer.flush()
+        segments = state.segments
+        if not segments:
+            return []
+
+        if field == 0:
+            keys = [segment.first_seq for segment in segments]
+        else:
+            keys = [segment.first_ts if segment.count else float('inf') for segment in segments]
+        first = max(0, bisect.bisect_right(keys, value) - 1)
+
+        result = []
+        for segment in segments[first:]:
+            offset = 0
+            if segment is segments[first] and segment.index:
+                position = bisect.bisect_right([entry[field] for entry in segment.index], value) - 1
+                if position >= 0:
+                    offset = segment.index[position][2]
+
+            for record in segment.records(offset):
+                if record[field] < value:
+                    continue
+                result.append(record)
+                if len(result) >= limit:
+                    return result
+        return result
+
+    def close(self):
+        with self.lock:
+            for state in self.rooms.values():
+                if state.writer is not None:
+                    state.writer.close()
+                    state.writer = None
+                for segment in state.segments:
+                    segment.close()
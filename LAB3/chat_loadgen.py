@@ -0,0 +1,259 @@
+"""Генератор нагрузки для сервера чата.
+
+Открывает N клиентов через loopback, проходит рукопожатие NAME/OK и
+рассылает сообщения с заданной частотой. В каждом сообщении - время
+отправки, по нему считается задержка доставки. Результат выводится в JSON.
+
+Пример:
+    python chat_loadgen.py --clients 2000 --senders 50 --rate 5 --duration 20 \\
+        --spawn --server-args "--mode selectors --framing 2" --output result.json
+"""
+import argparse
+import asyncio
+import json
+import shlex
+import socket
+import time
+
+from chat_protocol import FrameDecoder, encode_frame, parse_greeting, MSG_TEXT
+from chat_util import raise_fd_limit, spawn_server, latency_summary, process_tree_status
+
+
+# В первой версии клиент шлёт текст без кадров: сервер может склеить несколько
+# сообщений в одно, и генератор насчитает ложные потери и искажённые задержки
+V1_ERROR = ("Сервер использует кадры первой версии, сообщения без границ склеиваются и результат "
+            "недостоверен; запустите сервер с --framing 2 или передайте --allow-v1")
+
+class LoadClient:
+    """Один симулированный клиент"""
+
+    def __init__(self, index, report):
+        self.nickname = f"lg{index}"
+        self.report = report
+        self.reader = None
+        self.writer = None
+        self.framing = 1
+        self.decoder = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.framing = parse_greeting(await self.reader.read(1024))
+        if self.framing is None:
+            raise ConnectionError("Неверный протокол подключения")
+        self.writer.write(self.nickname.encode('utf-8'))
+        await self.writer.drain()
+
+        response = await self.reader.read(1024)
+        if not response.startswith(b"OK"):
+            raise ConnectionError("Ошибка подключения")
+        self.decoder = FrameDecoder(self.framing)
+        self.decoder.feed(response[2:])
+
+        sock = self.writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    async def receive(self):
+        """Приём кадров и подсчёт задержки по метке времени в сообщении"""
+        while True:
+            for msg_type, content in self.decoder.frames():
+                if msg_type != MSG_TEXT:
+                    continue
+                now = time.monotonic_ns()
+                # "ник: отправитель номер время заполнение"
+                try:
+                    sent_ns = int(content.split(b': ', 1)[1].split(b' ', 3)[2])
+                except (IndexError, ValueError):
+                    continue
+                self.report.latencies.append((now - sent_ns) / 1e6)
+                self.report.delivered += 1
+                self.report.last_delivery = time.monotonic()
+
+            data = await self.reader.read(65536)
+            if not data:
+                break
+            self.decoder.feed(data)
+
+    async def send_loop(self, rate, deadline, size):
+        """Отправка сообщений с заданной частотой до окончания теста"""
+        interval = 1 / rate
+        next_time = time.monotonic()
+        seq = 0
+        while next_time < deadline:
+            payload = f"{self.nickname} {seq} {time.monotonic_ns()} ".encode()
+            payload += b'x' * max(0, size - len(payload))
+            if self.framing > 1:
+                payload = encode_frame(MSG_TEXT, payload, self.framing)
+            self.writer.write(payload)
+            await self.writer.drain()
+            self.report.sent += 1
+            seq += 1
+
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Report:
+    def __init__(self):
+        self.connect_times = []
+        self.connect_failures = 0
+        self.latencies = []
+        self.sent = 0
+        self.delivered = 0
+        self.last_delivery = None
+        self.server_rss_kb = []
+        self.server_threads = []
+        self.server_processes = []
+
+
+async def sample_server(pid, report, interval=0.25):
+    """Периодический замер памяти и потоков сервера вместе с воркерами (--workers)"""
+    while True:
+        status = process_tree_status(pid)
+        if status is not None:
+            report.server_rss_kb.append(status[0])
+            report.server_threads.append(status[1])
+            report.server_processes.append(status[2])
+        await asyncio.sleep(interval)
+
+
+async def run(args, server_pid):
+    report = Report()
+    sampler = asyncio.create_task(sample_server(server_pid, report)) if server_pid else None
+
+    # фаза подключения
+    clients = [LoadClient(i, report) for i in range(args.clients)]
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client):
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                await client.connect(args.host, args.port)
+            except (OSError, ConnectionError):
+                report.connect_failures += 1
+                return None
+            report.connect_times.append((time.monotonic() - start) * 1000)
+            return client
+
+    connect_start = time.monotonic()
+    # версию кадров узнаём по первому клиенту, до остальных подключений
+    first = await connect(clients[0])
+    warnings = []
+    if first is not None and first.framing == 1:
+        if not args.allow_v1:
+            first.close()
+            if sampler is not None:
+                sampler.cancel()
+            raise SystemExit(V1_ERROR)
+        warnings.append(V1_ERROR)
+    connected = [c for c in await asyncio.gather(*(connect(c) for c in clients[1:])) if c is not None]
+    if first is not None:
+        connected.insert(0, first)
+    connect_elapsed = time.monotonic() - connect_start
+
+    receivers = [asyncio.create_task(client.receive()) for client in connected]
+    await asyncio.sleep(args.settle)  # рассылки о подключении
+    report.latencies.clear()
+    report.delivered = 0
+
+    # фаза рассылки
+    senders = connected[:args.senders]
+    send_start = time.monotonic()
+    deadline = send_start + args.duration
+    await asyncio.gather(*(client.send_loop(args.rate, deadline, args.message_size) for client in senders),
+                         return_exceptions=True)
+    await asyncio.sleep(args.drain)  # доставка сообщений, отправленных последними
+    send_elapsed = (report.last_delivery or time.monotonic()) - send_start
+
+    for client in connected:
+        client.close()
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+    if sampler is not None:
+        sampler.cancel()
+
+    expected = report.sent * max(0, len(connected) - 1)
+    connect_stats = latency_summary(report.connect_times)
+    return {
+        "config": {
+            "clients": args.clients,
+            "senders": len(senders),
+            "rate_per_sender": args.rate,
+            "duration_s": args.duration,
+            "message_size": args.message_size,
+            "framing": connected[0].framing if connected else None,
+        },
+        "connect": {
+            "connected": len(connected),
+            "failed": report.connect_failures,
+            "elapsed_s": round(connect_elapsed, 3),
+            "per_sec": round(len(connected) / connect_elapsed, 1) if connect_elapsed else None,
+            "latency": connect_stats,
+        },
+        "broadcast": {
+            "sent": report.sent,
+            "expected_deliveries": expected,
+            "delivered": report.delivered,
+            "delivery_ratio": round(report.delivered / expected, 4) if expected else None,
+            "deliveries_per_sec": round(report.delivered / send_elapsed, 1),
+        },
+        "latency": latency_summary(report.latencies),
+        "warnings": warnings,
+        "server": {
+            "pid": server_pid,
+            "rss_kb_max": max(report.server_rss_kb, default=None),
+            "rss_kb_last": report.server_rss_kb[-1] if report.server_rss_kb else None,
+            "threads_max": max(report.server_threads, default=None),
+            "processes_max": max(report.server_processes, default=None),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор нагрузки для сервера чата")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--clients', type=int, default=100, help="число подключений")
+    parser.add_argument('--senders', type=int, default=10, help="сколько из них отправляют сообщения")
+    parser.add_argument('--rate', type=float, default=10, help="сообщений/с от каждого отправителя")
+    parser.add_argument('--duration', type=float, default=10, help="длительность рассылки, с")
+    parser.add_argument('--message-size', type=int, default=64, help="размер сообщения, байт")
+    parser.add_argument('--connect-concurrency', type=int, default=200,
+                        help="сколько подключений устанавливать одновременно")
+    parser.add_argument('--settle', type=float, default=1.0, help="пауза после подключения, с")
+    parser.add_argument('--drain', type=float, default=2.0, help="ожидание доставки после рассылки, с")
+    parser.add_argument('--spawn', action='store_true', help="запустить сервер самостоятельно")
+    parser.add_argument('--server-args', default='', help="аргументы сервера при --spawn")
+    parser.add_argument('--server-pid', type=int, default=None, help="pid уже запущенного сервера")
+    parser.add_argument('--output', default=None, help="файл для JSON (по умолчанию stdout)")
+    parser.add_argument('--allow-v1', action='store_true',
+                        help="работать с сервером на кадрах v1 (в JSON будет предупреждение)")
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    proc = spawn_server(args.host, args.port, shlex.split(args.server_args)) if args.spawn else None
+    server_pid = proc.pid if proc is not None else args.server_pid
+    try:
+        result = asyncio.run(run(args, server_pid))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
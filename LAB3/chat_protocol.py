@@ -0,0 +1,167 @@
+import struct
+
+
+# Типы сообщений
+MSG_TEXT = 1    # обычное сообщение
+MSG_JOIN = 3    # пользователь подключился
+MSG_LEAVE = 4   # пользователь отключился
+MSG_NOTICE = 5  # служебное сообщение сервера
+MSG_HISTORY = 6  # запрос страницы истории / запись истории (только v2)
+
+# Заголовки кадров по версиям протокола
+HEADERS = {
+    1: struct.Struct('!BB'),  # тип, длина - до 255 байт
+    2: struct.Struct('!BI'),  # тип, длина - до 4 ГБ
+}
+MAX_FRAME = 1 << 20  # ограничение на размер кадра при разборе
+
+# Запись истории в ответе сервера: номер, время, тип, затем содержимое
+HISTORY_RECORD = struct.Struct('!QdB')
+MAX_HISTORY_PAGE = 1000
+
+# Приглашение сервера в рукопожатии сообщает версию кадров
+GREETINGS = {1: b"NAME", 2: b"NAME/2"}
+
+
+class ProtocolError(Exception):
+    """Нарушение формата кадров"""
+
+
+def greeting(version):
+    return GREETINGS[version]
+
+
+def parse_greeting(data):
+    """Версия протокола по приглашению сервера; None - приглашение не распознано"""
+    for version, value in GREETINGS.items():
+        if data == value:
+            return version
+    return None
+
+
+# Добавляется после кадра, обрезанного в первой версии протокола
+TRUNCATED_NOTICE = "Сообщение обрезано до 255 байт; для длинных сообщений нужен --framing 2".encode('utf-8')
+V1_LIMIT = 255
+
+
+def encode_frame(msg_type, content, version=1):
+    """Кадр: тип, длина, содержимое.
+
+    В первой версии длина занимает один байт: более длинное содержимое
+    обрезается по границе символа UTF-8, и следом идёт кадр MSG_NOTICE,
+    чтобы получатель видел, что текст потерян.
+    """
+    header = HEADERS[version]
+    if version == 1 and len(content) > V1_LIMIT:
+        content = content[:V1_LIMIT].decode('utf-8', 'ignore').encode('utf-8')
+        return (header.pack(msg_type, len(content)) + content
+                + header.pack(MSG_NOTICE, len(TRUNCATED_NOTICE)) + TRUNCATED_NOTICE)
+    return header.pack(msg_type, len(content)) + content
+
+
+def encode_history_request(after_seq=None, since_ts=None, limit=20):
+    """Запрос страницы истории: сообщения после номера after_seq или начиная со времени since_ts"""
+    if since_ts is not None:
+        content = f"since {since_ts} {limit}"
+    else:
+        content = f"seq {after_seq or 0} {limit}"
+    return encode_frame(MSG_HISTORY, content.encode('ascii'), 2)
+
+
+def parse_history_request(content):
+    """Разбор запроса истории: (after_seq, since_ts, limit)"""
+    try:
+        kind, value, limit = content.decode('ascii').split()
+        limit = max(1, min(int(limit), MAX_HISTORY_PAGE))
+        if kind == 'seq':
+            return int(value), None, limit
+        if kind == 'since':
+            return None, float(value), limit
+    except (UnicodeDecodeError, ValueError):
+        pass
+    raise ProtocolError(f"Неверный запрос истории: {content[:64]!r}")
+
+
+def encode_history_page(records, version=2):
+    """Ответ на запрос истории: кадр на запись и пустой кадр в конце страницы"""
+    frames = [encode_frame(MSG_HISTORY, HISTORY_RECORD.pack(seq, ts, msg_type) + bytes(content), version)
+              for seq, ts, msg_type, content in records]
+    frames.append(encode_frame(MSG_HISTORY, b'', version))
+    return b''.join(frames)
+
+
+def decode_history_record(content):
+    """Запись истории из кадра MSG_HISTORY: (номер, время, тип, содержимое); None - конец страницы"""
+    if not content:
+        return None
+    seq, ts, msg_type = HISTORY_RECORD.unpack_from(content)
+    return seq, ts, msg_type, bytes(content[HISTORY_RECORD.size:])
+
+
+class FrameDecoder:
+    """Потоковый разбор кадров.
+
+    Данные читаются в один переиспользуемый bytearray через recv_into,
+    за одно чтение может прийти сколько угодно кадров, а кадр может быть
+    разрезан между чтениями. Неразобранный хвост сдвигается в начало буфера
+    только когда в конце не хватает места.
+    """
+
+    def __init__(self, version=1, bufsize=65536, max_frame=MAX_FRAME):
+        self.header = HEADERS[version]
+        self.max_frame = max_frame
+        self.buf = bytearray(bufsize)
+        self.view = memoryview(self.buf)
+        self.start = 0  # начало неразобранных данных
+        self.end = 0    # конец прочитанных данных
+        self.need = 0   # размер незавершённого кадра
+
+    def recv_into(self, sock, size=4096):
+        """Чтение из сокета прямо в буфер; 0 - соединение закрыто"""
+        self._reserve(max(size, self.need - (self.end - self.start)))
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        """Добавление уже прочитанных данных"""
+        self._reserve(len(data))
+        self.buf[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def _reserve(self, size):
+        if len(self.buf) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if pending + size > len(self.buf):
+            # кадр не помещается - расширяем буфер
+            new_buf = bytearray(max(len(self.buf) * 2, pending + size))
+            new_buf[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buf = new_buf
+            self.view = memoryview(new_buf)
+        else:
+            # сдвигаем незавершённый кадр в начало
+            self.buf[:pending] = self.view[self.start:self.end].tobytes()
+        self.start = 0
+        self.end = pending
+
+    def frames(self):
+        """Извлечение всех целых кадров: список (тип, содержимое)"""
+        frames = []
+        header = self.header
+        while self.end - self.start >= header.size:
+            msg_type, length = header.unpack_from(self.buf, self.start)
+            if length > self.max_frame:
+                raise ProtocolError(f"Слишком большой кадр: {length} байт")
+            body = self.start + header.size
+            if body + length > self.end:
+                self.need = header.size + length
+                break
+            frames.append((msg_type, bytes(self.view[body:body + length])))
+            self.start = body + length
+            self.need = 0
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frames
@@ -1,55 +1,227 @@
+import argparse
+import os
+import selectors
+import signal
 import socket
+import struct
 import threading
+import time
+from collections import deque
 from datetime import datetime
 
+from chat_history import HistoryStore
+from chat_fanout import Outbox, POLICIES, DROP_OLDEST, sendmsg_all
+from chat_protocol import (FrameDecoder, ProtocolError, encode_frame, greeting, HEADERS, V1_LIMIT,
+                           encode_history_page, parse_history_request,
+                           MSG_TEXT, MSG_JOIN, MSG_LEAVE, MSG_NOTICE, MSG_HISTORY)
+from chat_util import raise_fd_limit
+
+
+HUB_RECORD = struct.Struct('!I')  # длина кадра при пересылке между воркерами
+ROOM = 'main'  # сервер ведёт одну общую комнату
+
+
+class _Connection:
+    """Состояние клиента в режиме selectors"""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.nickname = None
+        self.inbuf = bytearray()
+        self.decoder = None
+        self.outbox = None
+        self.events = selectors.EVENT_READ
+        self.closed = False
+
 
 class ChatServer:
-    def __init__(self, host='127.0.0.1', port=5555):
+    def __init__(self, host='127.0.0.1', port=5555, mode='threads', workers=1, backlog=None,
+                 queue_limit=256, slow_policy=DROP_OLDEST, framing=1,
+                 batch_window=0.0, tcp_nodelay=False, tcp_cork=False,
+                 history_dir=None, history_size=1000, replay=50):
+        if mode not in ('threads', 'selectors'):
+            raise ValueError(f"Неизвестный режим сервера: {mode}")
+        if workers > 1:
+            if mode != 'selectors':
+                raise ValueError("Несколько процессов поддерживаются только в режиме selectors")
+            if not hasattr(socket, 'SO_REUSEPORT') or not hasattr(os, 'fork'):
+                raise ValueError("SO_REUSEPORT и fork недоступны на этой платформе")
+        if slow_policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика для медленных клиентов: {slow_policy}")
+        if framing not in (1, 2):
+            raise ValueError(f"Неизвестная версия кадров: {framing}")
+        if tcp_cork and not hasattr(socket, 'TCP_CORK'):
+            raise ValueError("TCP_CORK доступен только в Linux")
+
         self.host = host
         self.port = port
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((self.host, self.port))
-        self.server.listen()
+        self.mode = mode
+        self.workers = workers
+        self.backlog = backlog
+        self.queue_limit = queue_limit
+        self.slow_policy = slow_policy
+        self.framing = framing
+        self.batch_window = batch_window  # окно накопления кадров перед отправкой, с
+        self.tcp_nodelay = tcp_nodelay
+        self.tcp_cork = tcp_cork
+        self.history_dir = history_dir
+        self.history_size = history_size
+        self.replay = replay  # сколько последних сообщений отправить новому клиенту
+        self.server = self._create_listener()
+        # у каждого воркера своя история, она открывается после запуска процесса
+        self.history = self._open_history(history_dir) if workers == 1 else None
 
         self.clients = {}  #список клиентов
         self.nicknames = {} #их имена
+        self.outboxes = {}  #очереди исходящих кадров
+        self.lock = threading.Lock()  # защищает словари выше
+
+        # счётчики отключённых клиентов
+        self.dropped_total = 0
+        self.slow_disconnects = 0
+
+        # режим selectors
+        self.selector = None
+        self.connections = {}  # сокет -> _Connection
+        self.hub_conn = None   # канал к процессу-ретранслятору (несколько воркеров)
+        self.dirty = set()     # клиенты с кадрами, ждущими конца окна накопления
+        self.flush_deadline = None
 
         print(f"Сервер запущен на {self.host}:{self.port}")
         print("Ожидание подключений...")
 
-    def broadcast(self, message, sender_addr=None):
-        """Отправка сообщения всем подключенным клиентам"""
-        for client_socket in self.clients.values():
-            if client_socket.getpeername() != sender_addr:
-                try:
-                    client_socket.send(message)
-                except:
-                    self.remove_client(client_socket)
+    def _create_listener(self):
+        """Создание слушающего сокета"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.workers > 1:
+            # каждый воркер слушает свой сокет, ядро распределяет подключения между ними
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.bind((self.host, self.port))
+        if self.backlog is None:
+            server.listen()
+        else:
+            server.listen(self.backlog)
+        return server
+
+    def _open_history(self, directory):
+        if directory is None:
+            return None
+        return HistoryStore(directory, ring_size=self.history_size)
+
+    def _replay_frames(self):
+        """Последние сообщения комнаты одним буфером для новых клиентов"""
+        if self.history is None or not self.replay:
+            return b''
+        return b''.join(self.format_message(record.msg_type, record.content)
+                        for record in self.history.recent(ROOM, self.replay))
+
+    def _publish(self, msg_type, content, sender_addr=None):
+        """Запись сообщения в историю и рассылка"""
+        self.broadcast(*self._record(msg_type, content, sender_addr))
+
+    def _record(self, msg_type, content, sender_addr=None):
+        """Запись сообщения в историю и выбор получателей: (кадр, отправитель, получатели).
+
+        Оба шага идут под self.lock, как и регистрация нового клиента вместе с
+        его историей, поэтому сообщение попадает клиенту либо в истории, либо рассылкой.
+        """
+        frame = self.format_message(msg_type, content)
+        with self.lock:
+            if self.history is not None:
+                self.history.append(ROOM, msg_type, content)
+            return frame, sender_addr, self._recipients(sender_addr)
+
+    def _recipients(self, sender_addr):
+        return [(addr, self.clients[addr], self.outboxes[addr])
+                for addr in self.clients if addr != sender_addr]
+
+    def _new_outbox(self):
+        return Outbox(self.queue_limit, self.slow_policy, self._skipped_notice)
+
+    def _skipped_notice(self, count):
+        return self.format_message(MSG_NOTICE, f"Пропущено сообщений: {count}".encode('utf-8'))
+
+    def broadcast(self, message, sender_addr=None, recipients=None, relay=True):
+        """Отправка сообщения всем подключенным клиентам.
+
+        Кадр кодируется один раз и кладётся в очередь каждого получателя,
+        сама отправка идёт в потоке записи клиента или в цикле событий.
+        """
+        if recipients is None:
+            with self.lock:
+                recipients = self._recipients(sender_addr)
+        leaves = deque(self._deliver(message, recipients, relay))
+        # сообщение об уходе медленного клиента само может переполнить чужие очереди,
+        # поэтому такие сообщения рассылаются здесь по очереди, без рекурсии
+        while leaves:
+            frame, _, recipients = self._record(MSG_LEAVE, leaves.popleft())
+            leaves.extend(self._deliver(frame, recipients, True))
+
+    def _deliver(self, message, recipients, relay):
+        """Кадр в очереди получателей; возвращает сообщения об уходе отключённых медленных клиентов"""
+        leaves = []
+        for client_addr, client_socket, outbox in recipients:
+            if not outbox.push(message):
+                print(f"Клиент {client_addr} не успевает получать сообщения, отключаем")
+                with self.lock:
+                    self.slow_disconnects += 1
+                leave_msg = self._detach(client_socket, client_addr)
+                if leave_msg is not None:
+                    leaves.append(leave_msg)
+            elif self.selector is not None:
+                conn = self.connections.get(client_socket)
+                if conn is not None:
+                    self._flush(conn)
+
+        # пересылаем кадр остальным воркерам
+        if relay and self.hub_conn is not None:
+            self.hub_conn.outbox.push(HUB_RECORD.pack(len(message)) + message)
+            self._flush(self.hub_conn)
+        return leaves
 
     def handle_client(self, client_socket, client_addr):
         """Обработка подключения клиента"""
         try:
             # Трехэтапное рукопожатие
-            client_socket.send(b"NAME")
+            client_socket.send(greeting(self.framing))
             nickname = client_socket.recv(1024).decode('utf-8')
             client_socket.send(b"OK")
 
-            self.clients[client_addr] = client_socket
-            self.nicknames[client_addr] = nickname
+            # история - первая запись в очереди клиента; снимок истории и регистрация
+            # идут под одной блокировкой, чтобы не потерять сообщение между ними
+            outbox = self._new_outbox()
+            with self.lock:
+                replay = self._replay_frames()
+                if replay:
+                    outbox.push(replay, force=True)
+                self.clients[client_addr] = client_socket
+                self.nicknames[client_addr] = nickname
+                self.outboxes[client_addr] = outbox
+
+            writer = threading.Thread(
+                target=self._writer,
+                args=(client_socket, client_addr, outbox),
+                daemon=True
+            )
+            writer.start()
 
             join_msg = f"{nickname} ({client_addr[0]}) присоединился к чату!".encode('utf-8')
-            self.broadcast(self.format_message(3, join_msg))
+            self._publish(MSG_JOIN, join_msg)
             print(f"{nickname} подключился с {client_addr}")
 
+            decoder = self._new_decoder()
             while True:
                 try:
-                    message = client_socket.recv(1024)
-                    if not message:
+                    messages = self._read_messages(client_socket, decoder)
+                    if messages is None:
                         break
 
-                    formatted_msg = self.format_message(1,
-                                                        f"{nickname}: {message.decode('utf-8')}".encode('utf-8'))
-                    self.broadcast(formatted_msg, client_addr)
+                    for msg_type, content in messages:
+                        if msg_type == MSG_HISTORY:
+                            outbox.push(self._history_page(content), force=True)
+                        else:
+                            self._chat_message(nickname, client_addr, content)
 
                 except ConnectionResetError:
                     break
@@ -59,49 +231,463 @@ class ChatServer:
         finally:
             self.remove_client(client_socket, client_addr)
 
+    def _writer(self, client_socket, client_addr, outbox):
+        """Поток записи: выгружает очередь клиента в сокет"""
+        try:
+            while True:
+                frames = outbox.take(self.batch_window)
+                if frames is None:
+                    break
+
+                self._cork(client_socket, True)
+                if self.batch_window:
+                    # всё, что накопилось за окно, уходит одним sendmsg
+                    sendmsg_all(client_socket, frames)
+                else:
+                    for frame in frames:
+                        client_socket.sendall(frame)
+                self._cork(client_socket, False)
+        except OSError:
+            pass
+        finally:
+            self.remove_client(client_socket, client_addr)
+
+    def _tune_socket(self, client_socket):
+        """Настройка алгоритма Нейгла для сокета клиента"""
+        if self.tcp_nodelay:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _cork(self, client_socket, enabled):
+        """TCP_CORK: пока включён, ядро собирает отправляемые данные в полные сегменты"""
+        if self.tcp_cork:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(enabled))
+
+    def _new_decoder(self):
+        # в первой версии клиент шлёт текст без кадров
+        return FrameDecoder(self.framing) if self.framing > 1 else None
+
+    def _read_messages(self, client_socket, decoder):
+        """Чтение кадров клиента (тип, содержимое); None - соединение закрыто"""
+        if decoder is None:
+            message = client_socket.recv(1024)
+            return [(MSG_TEXT, message)] if message else None
+
+        if decoder.recv_into(client_socket) == 0:
+            return None
+        return [(msg_type, content) for msg_type, content in decoder.frames()
+                if msg_type in (MSG_TEXT, MSG_HISTORY)]
+
+    def _history_page(self, content):
+        """Ответ на запрос страницы истории (кадры MSG_HISTORY, только v2)"""
+        try:
+            after_seq, since_ts, limit = parse_history_request(content)
+        except ProtocolError as e:
+            return self.format_message(MSG_NOTICE, str(e).encode('utf-8'))
+        if self.history is None:
+            notice = self.format_message(MSG_NOTICE, "История на сервере не ведётся".encode('utf-8'))
+            return notice + encode_history_page([], self.framing)
+        records = self.history.query(ROOM, after_seq=after_seq, since_ts=since_ts, limit=limit)
+        return encode_history_page(records, self.framing)
+
+    def _chat_message(self, nickname, client_addr, message):
+        self._publish(MSG_TEXT, f"{nickname}: {message.decode('utf-8')}".encode('utf-8'), client_addr)
+
     def format_message(self, msg_type, content):
         """Форматирование сообщения по протоколу"""
-        msg_len = len(content)
-        return bytes([msg_type, msg_len]) + content
+        if self.framing == 1 and len(content) > V1_LIMIT:
+            print(f"Сообщение длиной {len(content)} байт обрезано до {V1_LIMIT} (для длинных сообщений нужен --framing 2)")
+        return encode_frame(msg_type, content, self.framing)
 
     def remove_client(self, client_socket, client_addr=None):
         """Удаление клиента при отключении"""
+        leave_msg = self._detach(client_socket, client_addr)
+        if leave_msg is not None:
+            self._publish(MSG_LEAVE, leave_msg)
+
+    def _detach(self, client_socket, client_addr=None):
+        """Удаление клиента из списков и закрытие сокета; возвращает сообщение об уходе"""
+        conn = self.connections.pop(client_socket, None)
+        if conn is not None:
+            conn.closed = True
+            self.selector.unregister(client_socket)
+            client_addr = conn.addr
+
         if not client_addr:
             client_addr = client_socket.getpeername()
 
-        if client_addr in self.clients:
-            nickname = self.nicknames.get(client_addr, 'Unknown')
-            self.clients.pop(client_addr, None)
-            self.nicknames.pop(client_addr, None)
+        with self.lock:
+            removed = self.clients.pop(client_addr, None) is not None
+            nickname = self.nicknames.pop(client_addr, 'Unknown')
+            outbox = self.outboxes.pop(client_addr, None)
+            if outbox is not None:
+                self.dropped_total += outbox.dropped
 
-            leave_msg = f"{nickname} ({client_addr[0]}) покинул чат.".encode('utf-8')
-            self.broadcast(self.format_message(4, leave_msg))
+        if outbox is not None:
+            outbox.close()
+
+        if removed:
+            try:
+                # будим потоки, заблокированные на этом сокете
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client_socket.close()
             print(f"{nickname} отключился")
+            return f"{nickname} ({client_addr[0]}) покинул чат.".encode('utf-8')
 
+        if conn is not None:
+            # клиент отключился до завершения рукопожатия
             client_socket.close()
+        return None
+
+    def stats(self):
+        """Счётчики очередей рассылки"""
+        with self.lock:
+            outboxes = list(self.outboxes.values())
+            dropped = self.dropped_total
+            slow_disconnects = self.slow_disconnects
+
+        return {
+            "clients": len(outboxes),
+            "queued_frames": sum(outbox.depth for outbox in outboxes),
+            "max_queue_depth": max((outbox.max_depth for outbox in outboxes), default=0),
+            "dropped_frames": dropped + sum(outbox.dropped for outbox in outboxes),
+            "slow_disconnects": slow_disconnects,
+        }
 
     def start(self):
         """Запуск сервера"""
         try:
-            while True:
-                client_socket, client_addr = self.server.accept()
-                print(f"Подключение с {client_addr}")
-
-                thread = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket, client_addr)
-                )
-                thread.start()
+            if self.workers > 1:
+                self._run_workers()
+            elif self.mode == 'selectors':
+                self._serve_selectors()
+            else:
+                self._serve_threads()
 
         except KeyboardInterrupt:
             print("\nОстановка сервера...")
         finally:
+            print(f"Статистика рассылки: {self.stats()}")
+            if self.history is not None:
+                self.history.close()
             for client in list(self.clients.values()):
                 client.close()
             self.server.close()
             print("Сервер остановлен")
 
+    def _serve_threads(self):
+        """Поток на каждого клиента"""
+        while True:
+            client_socket, client_addr = self.server.accept()
+            print(f"Подключение с {client_addr}")
+            self._tune_socket(client_socket)
+
+            thread = threading.Thread(
+                target=self.handle_client,
+                args=(client_socket, client_addr)
+            )
+            thread.start()
+
+    # ---------- режим selectors ----------
+
+    def _serve_selectors(self):
+        """Однопоточный цикл событий: все клиенты обслуживаются одним потоком"""
+        raise_fd_limit()
+        self.selector = selectors.DefaultSelector()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, None)
+        if self.hub_conn is not None:
+            self.hub_conn.sock.setblocking(False)
+            self.selector.register(self.hub_conn.sock, selectors.EVENT_READ, self.hub_conn)
+
+        while True:
+            timeout = None
+            if self.flush_deadline is not None:
+                timeout = max(0.0, self.flush_deadline - time.monotonic())
+
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    self._accept()
+                elif key.data is self.hub_conn:
+                    self._on_hub(mask)
+                else:
+                    self._on_client(key.data, mask)
+
+            if self.flush_deadline is not None and time.monotonic() >= self.flush_deadline:
+                self._flush_dirty()
+
+    def _accept(self):
+        """Приём всех ожидающих подключений"""
+        while True:
+            try:
+                client_socket, client_addr = self.server.accept()
+            except BlockingIOError:
+                return
+            except OSError as e:
+                # например, исчерпан лимит дескрипторов
+                print(f"Ошибка приёма подключения: {e}")
+                return
+
+            print(f"Подключение с {client_addr}")
+            client_socket.setblocking(False)
+            self._tune_socket(client_socket)
+            conn = _Connection(client_socket, client_addr)
+            conn.outbox = self._new_outbox()
+            self.connections[client_socket] = conn
+            self.selector.register(client_socket, conn.events, conn)
+            # Трехэтапное рукопожатие
+            conn.outbox.push(greeting(self.framing), force=True)
+            self._flush(conn)
+
+    def _on_client(self, conn, mask):
+        """Обработка событий сокета клиента"""
+        if conn.closed:
+            return  # клиент удалён при обработке предыдущего события
+        try:
+            if mask & selectors.EVENT_READ:
+                try:
+                    if conn.nickname is None:
+                        messages = self._on_nickname(conn)
+                    else:
+                        messages = self._read_messages(conn.sock, conn.decoder)
+                except BlockingIOError:
+                    messages = []
+                except ConnectionResetError:
+                    messages = None
+
+                if messages is None:
+                    self.remove_client(conn.sock, conn.addr)
+                    return
+                for msg_type, content in messages:
+                    if msg_type == MSG_HISTORY:
+                        conn.outbox.push(self._history_page(content), force=True)
+                        self._flush(conn)
+                    else:
+                        self._chat_message(conn.nickname, conn.addr, content)
+
+            if mask & selectors.EVENT_WRITE and not conn.closed:
+                self._send_queued(conn)
+
+        except Exception as e:
+            print(f"Ошибка с клиентом {conn.addr}: {e}")
+            if not conn.closed:
+                self.remove_client(conn.sock, conn.addr)
+
+    def _on_nickname(self, conn):
+        """Вторая часть рукопожатия: никнейм клиента"""
+        data = conn.sock.recv(1024)
+        if not data:
+            return None
+
+        conn.nickname = data.decode('utf-8')
+        conn.decoder = self._new_decoder()
+        conn.outbox.push(b"OK", force=True)
+        replay = self._replay_frames()
+        if replay:
+            # история уходит одной записью, а не кадром на сообщение
+            conn.outbox.push(replay, force=True)
+        self._flush(conn)
+        if conn.closed:
+            return []
+
+        with self.lock:
+            self.clients[conn.addr] = conn.sock
+            self.nicknames[conn.addr] = conn.nickname
+            self.outboxes[conn.addr] = conn.outbox
+
+        join_msg = f"{conn.nickname} ({conn.addr[0]}) присоединился к чату!".encode('utf-8')
+        self._publish(MSG_JOIN, join_msg)
+        print(f"{conn.nickname} подключился с {conn.addr}")
+        return []
+
+    def _flush(self, conn):
+        """Неблокирующая отправка очереди клиента"""
+        if conn.closed or conn.events & selectors.EVENT_WRITE:
+            return  # сокет занят, очередь уйдёт по событию записи
+        if self.batch_window:
+            # копим кадры до конца окна, затем отправляем их одним вызовом
+            self.dirty.add(conn)
+            if self.flush_deadline is None:
+                self.flush_deadline = time.monotonic() + self.batch_window
+            return
+        self._send_queued(conn)
+
+    def _flush_dirty(self):
+        """Конец окна накопления: отправка всех накопленных очередей"""
+        dirty = self.dirty
+        self.dirty = set()
+        self.flush_deadline = None
+        for conn in dirty:
+            if not conn.closed:
+                self._send_queued(conn)
+
+    def _send_queued(self, conn):
+        try:
+            corked = conn is not self.hub_conn
+            if corked:
+                self._cork(conn.sock, True)
+            try:
+                conn.outbox.send(conn.sock, batch=self.batch_window > 0)
+            finally:
+                if corked:
+                    self._cork(conn.sock, False)
+        except BlockingIOError:
+            pass
+        except OSError:
+            if conn is self.hub_conn:
+                raise ConnectionError("Потеряна связь с процессом-ретранслятором")
+            self.remove_client(conn.sock, conn.addr)
+            return
+
+        events = selectors.EVENT_READ
+        if conn.outbox.depth:
+            events |= selectors.EVENT_WRITE
+        if events != conn.events:
+            conn.events = events
+            self.selector.modify(conn.sock, events, conn)
+
+    # ---------- несколько воркеров ----------
+
+    @staticmethod
+    def _pop_records(buf):
+        """Извлечение целых записей (длина + кадр) из буфера"""
+        records = []
+        offset = 0
+        while len(buf) - offset >= HUB_RECORD.size:
+            (length,) = HUB_RECORD.unpack_from(buf, offset)
+            end = offset + HUB_RECORD.size + length
+            if end > len(buf):
+                break
+            records.append(bytes(buf[offset + HUB_RECORD.size:end]))
+            offset = end
+        del buf[:offset]
+        return records
+
+    def _on_hub(self, mask):
+        """Кадры от других воркеров рассылаются своим клиентам"""
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.hub_conn.sock.recv(65536)
+            except BlockingIOError:
+                data = None
+            if data == b'':
+                raise ConnectionError("Процесс-ретранслятор завершился")
+            if data:
+                self.hub_conn.inbuf += data
+                header = HEADERS[self.framing]
+                for frame in self._pop_records(self.hub_conn.inbuf):
+                    if self.history is not None:
+                        msg_type, _ = header.unpack_from(frame)
+                        self.history.append(ROOM, msg_type, frame[header.size:])
+                    self.broadcast(frame, relay=False)
+
+        if mask & selectors.EVENT_WRITE:
+            self._send_queued(self.hub_conn)
+
+    def _run_workers(self):
+        """Запуск воркеров с SO_REUSEPORT; родитель ретранслирует сообщения между ними"""
+        self.server.close()  # родитель не принимает подключения
+        hubs = []
+        pids = []
+        for worker_id in range(self.workers):
+            parent_end, child_end = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                parent_end.close()
+                for hub in hubs:
+                    hub.close()
+                code = 0
+                try:
+                    self.server = self._create_listener()
+                    self.hub_conn = _Connection(child_end, None)
+                    self.hub_conn.outbox = Outbox(limit=None)
+                    if self.history_dir is not None:
+                        self.history = self._open_history(os.path.join(self.history_dir, f"worker{worker_id}"))
+                    self._serve_selectors()
+                except KeyboardInterrupt:
+                    pass
+                except Exception as e:
+                    print(f"Воркер {worker_id}: {e}")
+                    code = 1
+                finally:
+                    if self.history is not None:
+                        self.history.close()
+                    os._exit(code)
+
+            child_end.close()
+            hubs.append(parent_end)
+            pids.append(pid)
+            print(f"Запущен воркер {worker_id} (pid {pid})")
+
+        try:
+            self._relay(hubs)
+        finally:
+            for pid in pids:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                    os.waitpid(pid, 0)
+                except (ProcessLookupError, ChildProcessError):
+                    pass
+
+    def _relay(self, hubs):
+        """Пересылка кадров от каждого воркера всем остальным"""
+        selector = selectors.DefaultSelector()
+        buffers = {}
+        for hub in hubs:
+            selector.register(hub, selectors.EVENT_READ)
+            buffers[hub] = bytearray()
+
+        while buffers:
+            for key, _ in selector.select():
+                hub = key.fileobj
+                data = hub.recv(65536)
+                if not data:
+                    print("Воркер завершился")
+                    selector.unregister(hub)
+                    hub.close()
+                    del buffers[hub]
+                    continue
+
+                buf = buffers[hub]
+                buf += data
+                records = self._pop_records(buf)
+                if not records:
+                    continue
+                chunk = b''.join(HUB_RECORD.pack(len(r)) + r for r in records)
+                for other in buffers:
+                    if other is not hub:
+                        other.sendall(chunk)
+
 
 if __name__ == "__main__":
-    server = ChatServer()  # Используем параметры по умолчанию
-    server.start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Сервер чата")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--mode', choices=['threads', 'selectors'], default='threads',
+                        help="threads - поток на клиента, selectors - один цикл событий")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="число процессов с SO_REUSEPORT (только для selectors)")
+    parser.add_argument('--backlog', type=int, default=None, help="длина очереди listen()")
+    parser.add_argument('--queue-limit', type=int, default=256, help="максимум кадров в очереди клиента")
+    parser.add_argument('--slow-policy', choices=POLICIES, default=DROP_OLDEST,
+                        help="что делать с клиентом, который не успевает читать")
+    parser.add_argument('--framing', type=int, choices=[1, 2], default=1,
+                        help="версия кадров: 1 - длина в одном байте (сообщения длиннее 255 байт "
+                             "обрезаются), 2 - 32-битная длина")
+    parser.add_argument('--batch-window', type=float, default=0.0,
+                        help="окно накопления кадров перед отправкой, мс (0 - отправлять сразу)")
+    parser.add_argument('--nodelay', action='store_true', help="включить TCP_NODELAY")
+    parser.add_argument('--cork', action='store_true', help="включить TCP_CORK на время отправки (Linux)")
+    parser.add_argument('--history-dir', default=None,
+                        help="каталог журнала истории (по умолчанию история не ведётся); "
+                             "с --workers у каждого воркера свой журнал и своя нумерация сообщений")
+    parser.add_argument('--history-size', type=int, default=1000, help="сообщений истории в памяти")
+    parser.add_argument('--replay', type=int, default=50, help="сколько последних сообщений отправлять новому клиенту")
+    args = parser.parse_args()
+
+    server = ChatServer(args.host, args.port, mode=args.mode, workers=args.workers, backlog=args.backlog,
+                        queue_limit=args.queue_limit, slow_policy=args.slow_policy, framing=args.framing,
+                        batch_window=args.batch_window / 1000, tcp_nodelay=args.nodelay, tcp_cork=args.cork,
+                        history_dir=args.history_dir, history_size=args.history_size, replay=args.replay)
+    server.start()
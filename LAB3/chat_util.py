@@ -0,0 +1,96 @@
+"""Общие функции сервера чата и утилит нагрузки."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def raise_fd_limit():
+    """Поднятие лимита открытых дескрипторов до жёсткого (нужно для 10k+ соединений)"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else 1 << 20
+    if soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def spawn_server(host, port, options=()):
+    """Запуск chat_server.py отдельным процессом и ожидание, пока он начнёт принимать подключения"""
+    cmd = [sys.executable, 'chat_server.py', '--host', host, '--port', str(port), *options]
+    proc = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection((host, port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Сервер не запустился")
+
+
+def percentile(values, p):
+    """p-й перцентиль уже отсортированного списка"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def latency_summary(values):
+    """p50/p99/p999/max в миллисекундах"""
+    values = sorted(values)
+    result = {}
+    for name, p in (("p50_ms", 50), ("p99_ms", 99), ("p999_ms", 99.9)):
+        value = percentile(values, p)
+        result[name] = round(value, 3) if value is not None else None
+    result["max_ms"] = round(values[-1], 3) if values else None
+    return result
+
+
+def _children(pid):
+    """Дочерние процессы по /proc"""
+    children = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # поле comm в скобках может содержать пробелы, ppid идёт вторым после него
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            children.append(int(name))
+    return children
+
+
+def process_tree_status(pid):
+    """Суммарный RSS (КБ), число потоков и процессов для pid и всех его потомков; None, если недоступно"""
+    rss = threads = processes = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            rss += int(fields['VmRSS'].split()[0])
+            threads += int(fields['Threads'])
+        except (OSError, KeyError, ValueError):
+            if current == pid:
+                return None
+            continue
+        processes += 1
+        pending.extend(_children(current))
+    return rss, threads, processes
@@ -0,0 +1,88 @@
+"""Скорость проверки черного списка: HostFilter против линейного поиска в списке.
+
+Запуск: python bench_filter.py [--rules 1000000] [--lookups 200000]
+Правила - случайные домены, 1% путей и 1% сетей; запросы - наполовину поддомены
+заблокированных доменов, наполовину случайные имена.
+"""
+import argparse
+import random
+import string
+import time
+
+from host_filter import HostFilter
+
+TLDS = ['com', 'net', 'org', 'ru', 'by', 'io', 'de']
+
+
+def random_domain(rng, labels):
+    parts = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(labels)]
+    return '.'.join(parts + [rng.choice(TLDS)])
+
+
+def make_rules(rng, count):
+    rules = []
+    for i in range(count):
+        if i % 100 == 0:
+            rules.append(f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24")
+        elif i % 100 == 1:
+            rules.append(random_domain(rng, 1) + '/ads/')
+        else:
+            rules.append(random_domain(rng, rng.randint(1, 2)))
+    return rules
+
+
+def make_queries(rng, rules, count):
+    domains = [rule for rule in rules if '/' not in rule]
+    queries = []
+    for i in range(count):
+        if i % 2:
+            queries.append(random_domain(rng, 3))
+        else:
+            queries.append(random_domain(rng, 1).rsplit('.', 1)[0] + '.' + rng.choice(domains))
+    return queries
+
+
+def lookups_per_sec(check, queries):
+    start = time.perf_counter()
+    blocked = sum(1 for host in queries if check(host))
+    return len(queries) / (time.perf_counter() - start), blocked
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк черного списка прокси")
+    parser.add_argument('--rules', type=int, default=1000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rules = make_rules(rng, args.rules)
+    queries = make_queries(rng, rules, args.lookups)
+
+    before = rss_mb()
+    start = time.perf_counter()
+    host_filter = HostFilter(rules)
+    compile_time = time.perf_counter() - start
+    after = rss_mb()
+    memory = f", +{after - before:.0f} МБ" if before is not None else ""
+    print(f"Компиляция {len(host_filter)} правил: {compile_time:.2f} с{memory}")
+
+    rate, blocked = lookups_per_sec(lambda host: host_filter.blocked(host, '/') is not None, queries)
+    print(f"HostFilter: {rate:,.0f} проверок/с, заблокировано {blocked} из {len(queries)}")
+
+    # прежняя проверка host in list: на полном списке слишком медленно, берём 10 тыс. правил
+    sample = rules[:10000]
+    subset = queries[:2000]
+    rate, _ = lookups_per_sec(lambda host: host in sample, subset)
+    print(f"host in list (10 тыс. правил): {rate:,.0f} проверок/с")
@@ -0,0 +1,78 @@
+"""Скорость разбора запросов: конвейер заголовков в стиле браузера через HttpReader.
+
+Запуск: python bench_parser.py [--requests 200000]
+Данные отдаются поддельным сокетом кусками по 64 КБ, как их вернул бы recv; сравнивается
+строгий parse_request_head с прежним разбором через split без проверок.
+"""
+import argparse
+import time
+
+from http_message import HttpReader, parse_head, parse_request_head, request_body
+
+SMALL = (b"GET http://example.com/static/app.js?v=3 HTTP/1.1\r\n"
+         b"Host: example.com\r\n"
+         b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n"
+         b"Accept: */*\r\n"
+         b"Accept-Language: ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3\r\n"
+         b"Accept-Encoding: gzip, deflate\r\n"
+         b"Referer: http://example.com/\r\n"
+         b"Connection: keep-alive\r\n\r\n")
+
+# примерно 4 КБ: длинные cookie, как у сайтов со счётчиками и рекламой
+LARGE = SMALL[:-2] + b"Cookie: " + b"; ".join(b"c%02d=%s" % (i, b"v" * 90) for i in range(40)) + b"\r\n\r\n"
+
+
+class FakeSocket:
+    """recv из заранее подготовленных байт"""
+
+    def __init__(self, data, chunk=65536):
+        self.view = memoryview(data)
+        self.offset = 0
+        self.chunk = chunk
+
+    def recv(self, size):
+        size = min(size, self.chunk)
+        part = bytes(self.view[self.offset:self.offset + size])
+        self.offset += len(part)
+        return part
+
+
+def legacy_parse(head):
+    """Прежний разбор: split без проверок"""
+    first_line, headers = parse_head(head)
+    method, url, version = first_line.split()
+    return method, url, version, headers
+
+
+def strict_parse(head):
+    method, url, version, headers = parse_request_head(head)
+    request_body(headers)
+    return method, url, version, headers
+
+
+def run(parse, request, count):
+    reader = HttpReader(FakeSocket(request * count))
+    start = time.perf_counter()
+    parsed = 0
+    while True:
+        head = reader.read_head()
+        if head is None:
+            break
+        parse(head)
+        parsed += 1
+    elapsed = time.perf_counter() - start
+    assert parsed == count
+    return count / elapsed, len(request) * count / elapsed / 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора HTTP-запросов")
+    parser.add_argument('--requests', type=int, default=200000)
+    args = parser.parse_args()
+
+    for name, request in (("короткий запрос", SMALL), ("запрос с cookie", LARGE)):
+        count = args.requests if len(request) < 1024 else args.requests // 4
+        print(f"{name}, {len(request)} байт:")
+        for label, parse in (("split", legacy_parse), ("строгий", strict_parse)):
+            rate, mb = run(parse, request, count)
+            print(f"  {label:8} {rate:12,.0f} запросов/с {mb:8.1f} МБ/с")
@@ -0,0 +1,107 @@
+"""Сравнение способов пересылки тела ответа: пропускная способность и процессорное время на ГБ.
+
+Запуск: python bench_relay.py [--size-mb 1024] [--repeat 3]
+Источник и приёмник работают в отдельных потоках, пересылка между двумя TCP-соединениями
+через loopback идёт в главном потоке; время процессора считается только для него.
+"""
+import argparse
+import socket
+import threading
+import time
+
+from http_message import HttpReader, BodyTracker, LENGTH, SPLICE, RECV_INTO, COPY
+
+
+def legacy_loop(reader, tracker, dest):
+    """Прежний цикл прокси: recv(4096) и send без проверки частичной записи"""
+    sock = reader.sock
+    while not tracker.done:
+        part = sock.recv(4096)
+        if not part:
+            break
+        tracker.feed(part)
+        dest.sendall(part)
+
+
+def relay_with(mode):
+    def relay(reader, tracker, dest):
+        reader.relay_mode = mode
+        reader.relay_to(tracker, dest)
+    return relay
+
+
+MODES = [
+    ("recv(4096)/send", legacy_loop),
+    ("relay_body (bytes на recv)", relay_with(COPY)),
+    ("recv_into + memoryview", relay_with(RECV_INTO)),
+    ("os.splice", relay_with(SPLICE)),
+]
+
+
+def socket_pair(listener):
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    return client, server
+
+
+def run(relay, size):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(2)
+    source_out, relay_in = socket_pair(listener)
+    relay_out, sink_in = socket_pair(listener)
+    listener.close()
+    for sock in (relay_in, relay_out):
+        sock.settimeout(10)
+
+    def produce():
+        chunk = memoryview(bytes(1024 * 1024))
+        left = size
+        while left:
+            sent = source_out.send(chunk[:min(left, len(chunk))])
+            left -= sent
+        source_out.close()
+
+    received = [0]
+
+    def consume():
+        view = memoryview(bytearray(1024 * 1024))
+        while True:
+            n = sink_in.recv_into(view)
+            if not n:
+                break
+            received[0] += n
+        sink_in.close()
+
+    threads = [threading.Thread(target=produce), threading.Thread(target=consume)]
+    for thread in threads:
+        thread.start()
+
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    relay(HttpReader(relay_in), BodyTracker(LENGTH, size), relay_out)
+    elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+    relay_out.close()
+    relay_in.close()
+    for thread in threads:
+        thread.join()
+    if received[0] != size:
+        raise RuntimeError(f"Получено {received[0]} байт из {size}")
+    return elapsed, cpu
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк пересылки тела ответа в прокси")
+    parser.add_argument('--size-mb', type=int, default=1024, help="размер тела, МБ")
+    parser.add_argument('--repeat', type=int, default=3, help="прогонов на режим, берётся лучший")
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    gigabytes = size / 1024 ** 3
+    print(f"{'режим':28} {'МБ/с':>8} {'CPU, с/ГБ':>10}")
+    for name, relay in MODES:
+        try:
+            elapsed, cpu = min(run(relay, size) for _ in range(args.repeat))
+        except (OSError, AttributeError) as e:
+            print(f"{name:28} недоступно: {e}")
+            continue
+        print(f"{name:28} {size / 1024 ** 2 / elapsed:8.0f} {cpu / gigabytes:10.2f}")
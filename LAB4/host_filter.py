@@ -0,0 +1,191 @@
+"""Черный список прокси: правила для доменов, путей и IP-сетей.
+
+Формат правила (по одному в строке файла, # - комментарий):
+    example.com            домен и все его поддомены
+    *.example.com          только поддомены
+    =example.com           только сам домен
+    example.com/ads        путь с префиксом /ads на домене и поддоменах
+    example.com/*.mp3      путь по шаблону fnmatch
+    10.0.0.0/8, ::1        IP-сеть или адрес (для запросов по IP)
+"""
+import ipaddress
+import os
+import threading
+import time
+from fnmatch import fnmatchcase
+
+EXACT = 1       # правило действует на сам домен
+SUBDOMAINS = 2  # правило действует на поддомены
+
+
+def normalize_host(host):
+    return host.strip().rstrip('.').lower()
+
+
+class HostFilter:
+    """Скомпилированный набор правил; после создания не меняется.
+
+    Домены хранятся в словаре суффиксов, поэтому проверка имени из n меток -
+    это n обращений к словарю независимо от числа правил. Сети сгруппированы
+    по длине префикса: по одной проверке множества на каждую встреченную длину.
+    """
+
+    def __init__(self, rules=()):
+        self.domains = {}  # суффикс -> EXACT | SUBDOMAINS
+        self.paths = {}    # суффикс -> [(шаблон пути, исходное правило)]
+        self.networks = {4: {}, 6: {}}  # версия -> {длина префикса: множество адресов сетей}
+        self.count = 0
+        self.invalid = 0
+        for rule in rules:
+            self.add(rule)
+
+    @classmethod
+    def from_files(cls, paths, rules=()):
+        result = cls(rules)
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    result.add(line)
+        return result
+
+    def add(self, rule):
+        rule = rule.split('#', 1)[0].strip()
+        if not rule:
+            return
+        network = None
+        if rule[0].isdigit() or ':' in rule:
+            try:
+                network = ipaddress.ip_network(rule, strict=False)
+            except ValueError:
+                pass
+        if network is not None:
+            by_length = self.networks[network.version].setdefault(network.prefixlen, set())
+            by_length.add(int(network.network_address))
+            self.count += 1
+            return
+
+        domain, slash, path = rule.partition('/')
+        flags = EXACT | SUBDOMAINS
+        if domain.startswith('*.'):
+            domain, flags = domain[2:], SUBDOMAINS
+        elif domain.startswith('='):
+            domain, flags = domain[1:], EXACT
+        domain = normalize_host(domain)
+        if not domain or '*' in domain or ' ' in domain:
+            self.invalid += 1
+            return
+
+        if slash:
+            self.paths.setdefault(domain, []).append(('/' + path, rule))
+        else:
+            self.domains[domain] = self.domains.get(domain, 0) | flags
+        self.count += 1
+
+    def blocked(self, host, path=None):
+        """Правило, под которое попадает запрос, или None"""
+        host = normalize_host(host)
+        if host and (host[-1].isdigit() or ':' in host or host[0] == '['):
+            # имя домена верхнего уровня не может кончаться цифрой: это IP-адрес или ошибка
+            try:
+                ip = ipaddress.ip_address(host.strip('[]'))
+            except ValueError:
+                pass
+            else:
+                return self._blocked_ip(ip) or self._blocked_path(host.strip('[]'), path)
+
+        suffix = host
+        flag = EXACT
+        while True:
+            flags = self.domains.get(suffix)
+            if flags is not None and flags & flag:
+                return suffix
+            rule = self._blocked_path(suffix, path)
+            if rule is not None:
+                return rule
+            dot = suffix.find('.')
+            if dot < 0:
+                return None
+            suffix = suffix[dot + 1:]
+            flag = SUBDOMAINS
+
+    def _blocked_path(self, suffix, path):
+        if path is None or suffix not in self.paths:
+            return None
+        for pattern, rule in self.paths[suffix]:
+            if path.startswith(pattern) or fnmatchcase(path, pattern):
+                return rule
+        return None
+
+    def _blocked_ip(self, ip):
+        bits = ip.max_prefixlen
+        value = int(ip)
+        for prefixlen, networks in self.networks[ip.version].items():
+            network = value >> (bits - prefixlen) << (bits - prefixlen)
+            if network in networks:
+                return f"{ipaddress.ip_address(network)}/{prefixlen}"
+        return None
+
+    def __len__(self):
+        return self.count
+
+
+class BlockList:
+    """Черный список из правил и файлов; файлы перечитываются при изменении.
+
+    Новый HostFilter собирается целиком и подменяет старый одним присваиванием,
+    поэтому запросы во время перезагрузки видят либо старые правила, либо новые.
+    """
+
+    def __init__(self, rules=(), files=(), reload_interval=5.0):
+        self.rules = list(rules)
+        self.files = list(files)
+        self.reload_interval = reload_interval
+        self._mtimes = self._stat()
+        self.filter = HostFilter.from_files(self.files, self.rules)
+        self._report()
+        if self.files and reload_interval:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def blocked(self, host, path=None):
+        return self.filter.blocked(host, path)
+
+    def __contains__(self, host):
+        return self.blocked(host) is not None
+
+    def __len__(self):
+        return len(self.filter)
+
+    def _stat(self):
+        mtimes = []
+        for path in self.files:
+            try:
+                stat = os.stat(path)
+                mtimes.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def _report(self):
+        message = f"[*] Blacklist: {len(self.filter)} rules"
+        if self.filter.invalid:
+            message += f", {self.filter.invalid} invalid skipped"
+        print(message)
+
+    def reload(self):
+        """Пересборка фильтра; при ошибке чтения остаются прежние правила"""
+        try:
+            new_filter = HostFilter.from_files(self.files, self.rules)
+        except OSError as e:
+            print(f"[!] Blacklist reload error: {e}")
+            return False
+        self.filter = new_filter
+        self._report()
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            mtimes = self._stat()
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                self.reload()
@@ -0,0 +1,415 @@
+import errno
+import os
+import re
+import select
+import socket
+
+MAX_HEAD = 64 * 1024  # ограничение на размер стартовой строки и заголовков
+MAX_TARGET = 8 * 1024  # ограничение на длину URL в запросе
+MAX_HEADERS = 100      # ограничение на число заголовков запроса
+
+STATUS_TEXT = {
+    400: 'Bad Request',
+    414: 'URI Too Long',
+    431: 'Request Header Fields Too Large',
+    501: 'Not Implemented',
+    505: 'HTTP Version Not Supported',
+}
+
+_TOKEN = re.compile(r"[!#$%&'*+\-.^_`|~0-9A-Za-z]+\Z")
+_VERSION = re.compile(r"HTTP/[0-9]\.[0-9]\Z")
+# управляющие символы, кроме табуляции
+_CONTROL = bytes(range(0x09)) + bytes(range(0x0a, 0x20)) + b'\x7f'
+# строка заголовка не начинается с "токен:" (в том числе продолжение через пробел)
+_BAD_LINE = re.compile(rb"\r\n(?![!#$%&'*+\-.^_`|~0-9A-Za-z]+:|\r\n\Z|\Z)")
+
+# Заголовки, относящиеся к одному соединению; дальше прокси не передаются
+HOP_BY_HOP = {'connection', 'proxy-connection', 'keep-alive', 'te', 'upgrade', 'proxy-authorization'}
+
+# Способы определить конец тела сообщения
+NONE = 'none'        # тела нет
+LENGTH = 'length'    # Content-Length
+CHUNKED = 'chunked'  # Transfer-Encoding: chunked
+CLOSE = 'close'      # до закрытия соединения
+
+# безопасные методы: повторная отправка не меняет состояние на сервере
+RETRY_METHODS = {'GET', 'HEAD', 'OPTIONS', 'TRACE'}
+
+# Способы пересылки тела с известной границей (relay_to)
+SPLICE = 'splice'        # сокет -> канал -> сокет внутри ядра (Linux)
+RECV_INTO = 'recv_into'  # чтение в заранее выделенный буфер без создания bytes
+COPY = 'copy'            # relay_body: bytes на каждый recv
+
+
+class HttpError(Exception):
+    """Некорректное HTTP-сообщение; status - код ответа, если ошибка в запросе клиента"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def error_response(status):
+    """Ответ клиенту на некорректный запрос; соединение после него закрывается"""
+    text = STATUS_TEXT.get(status, 'Error')
+    body = f"<html><body><h1>{status} {text}</h1></body></html>\r\n"
+    return (f"HTTP/1.1 {status} {text}\r\n"
+            "Content-Type: text/html\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n" + body).encode()
+
+
+def parse_head(head, strict=False):
+    """Разбор стартовой строки и заголовков.
+
+    strict - для запросов клиента: имя заголовка должно быть токеном без пробелов,
+    продолжение строки (obs-fold) и управляющие символы запрещены (RFC 9112),
+    иначе прокси и сервер могут по-разному понять границы запроса.
+    """
+    if strict:
+        # проверки всего блока сразу вместо цикла по строкам
+        # кроме CR и LF в парах CRLF, управляющих символов быть не должно
+        lines_count = head.count(b'\r\n')
+        if len(head) - len(head.translate(None, _CONTROL)) != 2 * lines_count:
+            raise HttpError("Управляющий символ в заголовках")
+        match = _BAD_LINE.search(head)
+        if match:
+            line = head[match.end():].split(b'\r\n', 1)[0]
+            raise HttpError(f"Некорректный заголовок: {line[:100].decode('iso-8859-1')!r}")
+        if lines_count - 2 > MAX_HEADERS:
+            raise HttpError("Слишком много заголовков", 431)
+    lines = head.decode('iso-8859-1').split('\r\n')
+    headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise HttpError(f"Некорректный заголовок: {line!r}")
+        headers.append((name.strip(), value.strip()))
+    return lines[0], headers
+
+
+def parse_request_head(head):
+    """Строгий разбор заголовков запроса: (method, target, version, headers)"""
+    start_line, headers = parse_head(head, strict=True)
+    parts = start_line.split(' ')
+    if len(parts) != 3:
+        raise HttpError(f"Некорректная стартовая строка: {start_line[:100]!r}")
+    method, target, version = parts
+    if not _TOKEN.match(method):
+        raise HttpError(f"Некорректный метод: {method[:100]!r}")
+    if len(target) > MAX_TARGET:
+        raise HttpError("Слишком длинный URL", 414)
+    if not target or not target.isprintable():
+        raise HttpError(f"Некорректный URL: {target[:100]!r}")
+    if not _VERSION.match(version):
+        raise HttpError(f"Некорректная версия: {version[:100]!r}")
+    if version not in ('HTTP/1.0', 'HTTP/1.1'):
+        raise HttpError(f"Неподдерживаемая версия: {version}", 505)
+    if version == 'HTTP/1.1' and get_header(headers, 'Host') is None:
+        raise HttpError("Нет заголовка Host")
+    return method, target, version, headers
+
+
+def build_head(start_line, headers):
+    lines = [start_line] + [f"{name}: {value}" for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('iso-8859-1')
+
+
+def get_header(headers, name, default=None):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return default
+
+
+def connection_tokens(headers):
+    tokens = set()
+    for key, value in headers:
+        if key.lower() in ('connection', 'proxy-connection'):
+            tokens.update(token.strip().lower() for token in value.split(','))
+    return tokens
+
+
+def strip_hop_by_hop(headers):
+    """Удаление заголовков соединения, в том числе перечисленных в Connection"""
+    drop = HOP_BY_HOP | connection_tokens(headers)
+    return [(key, value) for key, value in headers if key.lower() not in drop]
+
+
+def wants_keep_alive(version, headers):
+    """Можно ли оставить соединение открытым после сообщения"""
+    tokens = connection_tokens(headers)
+    if 'close' in tokens:
+        return False
+    if version.upper() == 'HTTP/1.1':
+        return True
+    return 'keep-alive' in tokens
+
+
+def _body_by_headers(headers, default, request=False):
+    # Transfer-Encoding важнее Content-Length (RFC 9112, 6.3)
+    codings = [coding.strip().lower() for key, value in headers if key.lower() == 'transfer-encoding'
+               for coding in value.split(',') if coding.strip()]
+    if codings:
+        if codings[-1] == 'chunked':
+            return BodyTracker(CHUNKED)
+        if request:
+            raise HttpError(f"Тело запроса без chunked: Transfer-Encoding {', '.join(codings)}")
+        return BodyTracker(CLOSE)
+
+    # повторы Content-Length допустимы, только если значения совпадают
+    lengths = {length.strip() for key, value in headers if key.lower() == 'content-length'
+               for length in value.split(',')}
+    if lengths:
+        length = lengths.pop()
+        if lengths or not (length.isascii() and length.isdigit()):
+            raise HttpError(f"Некорректный Content-Length: {get_header(headers, 'Content-Length')!r}")
+        return BodyTracker(LENGTH, int(length))
+    return BodyTracker(default)
+
+
+def request_body(headers):
+    """Граница тела запроса"""
+    return _body_by_headers(headers, NONE, request=True)
+
+
+def response_body(method, status, headers):
+    """Граница тела ответа"""
+    if method == 'HEAD' or 100 <= status < 200 or status in (204, 304):
+        return BodyTracker(NONE)
+    return _body_by_headers(headers, CLOSE)
+
+
+class BodyTracker:
+    """Отслеживание конца тела сообщения, которое пересылается без изменений"""
+
+    MAX_LINE = 8192
+
+    def __init__(self, mode, length=0):
+        self.mode = mode
+        self.remaining = length
+        self.done = mode == NONE or (mode == LENGTH and length == 0)
+        self._state = 'size'  # для chunked: size, data, data_end, trailer
+        self._pending = b''   # начало строки chunked-разметки из предыдущего фрагмента
+
+    def feed(self, data):
+        """Сколько байт из data относится к телу; остальное - начало следующего сообщения"""
+        if self.done:
+            return 0
+        if self.mode == CLOSE:
+            return len(data)
+        if self.mode == LENGTH:
+            return self.consume(len(data))
+        return self._feed_chunked(data)
+
+    def consume(self, size):
+        """То же, что feed, когда сами данные не нужны; только для Content-Length и тела до закрытия"""
+        if self.done:
+            return 0
+        if self.mode == LENGTH:
+            size = min(self.remaining, size)
+            self.remaining -= size
+            self.done = self.remaining == 0
+        return size
+
+    def next_size(self, limit):
+        """Сколько байт можно прочитать, не захватив следующее сообщение"""
+        return min(self.remaining, limit) if self.mode == LENGTH else limit
+
+    def _feed_chunked(self, data):
+        pos = 0
+        while pos < len(data) and not self.done:
+            if self._state == 'data':
+                used = min(self.remaining, len(data) - pos)
+                self.remaining -= used
+                pos += used
+                if self.remaining == 0:
+                    self._state = 'data_end'
+                continue
+
+            # строковые состояния: размер блока, CRLF после блока, трейлер
+            end = data.find(b'\n', pos)
+            if end < 0:
+                self._pending += bytes(data[pos:])
+                if len(self._pending) > self.MAX_LINE:
+                    raise HttpError("Слишком длинная строка в chunked-теле")
+                return len(data)
+
+            line = (self._pending + bytes(data[pos:end])).strip()
+            self._pending = b''
+            pos = end + 1
+
+            if self._state == 'size':
+                try:
+                    size = int(line.split(b';', 1)[0], 16)
+                except ValueError:
+                    raise HttpError(f"Некорректный размер блока: {line!r}")
+                if size:
+                    self._state = 'data'
+                    self.remaining = size
+                else:
+                    self._state = 'trailer'
+            elif self._state == 'data_end':
+                if line:
+                    raise HttpError("Нет CRLF после блока chunked-тела")
+                self._state = 'size'
+            elif not line:
+                self.done = True  # пустая строка завершает трейлер
+        return pos
+
+
+def _wait(sock, event):
+    """Ожидание готовности сокета с его собственным таймаутом"""
+    timeout = sock.gettimeout()
+    poller = select.poll()
+    poller.register(sock, event)
+    if not poller.poll(None if timeout is None else timeout * 1000):
+        raise socket.timeout("timed out")
+
+
+class HttpReader:
+    """Буферизованное чтение HTTP-сообщений из блокирующего сокета"""
+
+    MAX_BUFSIZE = 1024 * 1024  # предел роста буфера relay_to
+    PIPE_SIZE = 1024 * 1024    # желаемый размер канала для splice
+
+    # способ пересылки в relay_to; splice требует Linux и poll
+    relay_mode = SPLICE if hasattr(os, 'splice') and hasattr(select, 'poll') else RECV_INTO
+
+    def __init__(self, sock, bufsize=65536):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.buffer = bytearray()
+
+    def read_head(self, limit=MAX_HEAD):
+        """Стартовая строка и заголовки; None - соединение закрыто до начала сообщения"""
+        searched = 0
+        while True:
+            end = self.buffer.find(b'\r\n\r\n', max(0, searched - 3))
+            if (end if end >= 0 else len(self.buffer)) > limit:
+                raise HttpError("Слишком большие заголовки", 431)
+            if end >= 0:
+                head = bytes(self.buffer[:end + 4])
+                del self.buffer[:end + 4]
+                return head
+
+            searched = len(self.buffer)
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                if self.buffer:
+                    raise HttpError("Соединение закрыто посреди заголовков")
+                return None
+            self.buffer += data
+
+    def relay_body(self, tracker, send):
+        """Пересылка тела через send (обычно sendall получателя); возвращает число байт"""
+        total = 0
+        while not tracker.done:
+            if self.buffer:
+                data = bytes(self.buffer)
+                self.buffer.clear()
+            else:
+                data = self.sock.recv(self.bufsize)
+                if not data:
+                    if tracker.mode == CLOSE:
+                        break
+                    raise HttpError("Соединение закрыто посреди тела сообщения")
+
+            used = tracker.feed(data)
+            if used:
+                send(data[:used] if used < len(data) else data)
+                total += used
+            if used < len(data):
+                self.buffer += data[used:]
+        return total
+
+    def relay_to(self, tracker, dest):
+        """Пересылка тела прямо в сокет dest, минуя разбор и лишние копии; возвращает число байт.
+
+        Chunked-тело надо разбирать, поэтому оно идёт через relay_body.
+        """
+        if tracker.mode == CHUNKED or self.relay_mode == COPY:
+            return self.relay_body(tracker, dest.sendall)
+
+        total = 0
+        if self.buffer and not tracker.done:
+            # начало тела уже прочитано вместе с заголовками
+            used = tracker.consume(len(self.buffer))
+            dest.sendall(self.buffer[:used])
+            del self.buffer[:used]
+            total += used
+        if tracker.done:
+            return total
+
+        if self.relay_mode == SPLICE:
+            moved = self._splice(tracker, dest)
+            if moved is not None:
+                return total + moved
+        return total + self._relay_into(tracker, dest)
+
+    def _relay_into(self, tracker, dest):
+        """recv_into в один буфер, который растёт, пока данные приходят быстрее, чем мы их читаем"""
+        size = self.bufsize
+        view = memoryview(bytearray(size))
+        total = 0
+        while not tracker.done:
+            received = self.sock.recv_into(view, tracker.next_size(size))
+            if not received:
+                if tracker.mode == CLOSE:
+                    break
+                raise HttpError("Соединение закрыто посреди тела сообщения")
+            tracker.consume(received)
+            dest.sendall(view[:received])
+            total += received
+            if received == size and size < self.MAX_BUFSIZE:
+                size *= 2
+                view = memoryview(bytearray(size))
+        return total
+
+    def _splice(self, tracker, dest):
+        """Пересылка через канал os.splice: данные не попадают в память процесса.
+
+        None - splice для этих сокетов не поддерживается и ничего не переслано.
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            try:
+                import fcntl
+                pipe_size = fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, self.PIPE_SIZE)
+            except (ImportError, AttributeError, OSError):
+                pipe_size = 65536
+            flags = os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK
+            source, target = self.sock.fileno(), dest.fileno()
+
+            total = 0
+            while not tracker.done:
+                try:
+                    moved = os.splice(source, write_fd, tracker.next_size(pipe_size), flags=flags)
+                except BlockingIOError:
+                    _wait(self.sock, select.POLLIN)
+                    continue
+                except OSError as e:
+                    if e.errno in (errno.EINVAL, errno.ENOSYS) and total == 0:
+                        return None
+                    raise
+                if not moved:
+                    if tracker.mode == CLOSE:
+                        break
+                    raise HttpError("Соединение закрыто посреди тела сообщения")
+                tracker.consume(moved)
+
+                # канал пуст перед каждым чтением, поэтому всё прочитанное надо отдать целиком
+                pending = moved
+                while pending:
+                    try:
+                        pending -= os.splice(read_fd, target, pending, flags=flags)
+                    except BlockingIOError:
+                        _wait(dest, select.POLLOUT)
+                total += moved
+            return total
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
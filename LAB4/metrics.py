@@ -0,0 +1,318 @@
+"""Метрики прокси: фазы запросов, гистограммы, экспорт для Prometheus и журнал доступа.
+
+Запрос описывается объектом Trace, который хранится в contextvars: у каждого потока
+и у каждой задачи asyncio он свой, поэтому DNS и соединение с сервером отмечаются
+через mark() без передачи trace по всем вызовам. Счётчики пишутся в shard своего
+потока без блокировок; при запросе /metrics они суммируются.
+"""
+import bisect
+import contextvars
+import json
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# фазы по порядку: длительность фазы - от предыдущей отметки до её собственной
+PHASES = ('parse', 'dns', 'connect', 'first_byte', 'last_byte')
+
+CURRENT = contextvars.ContextVar('proxy_trace', default=None)
+
+
+class Trace:
+    """Один запрос: отметки времени фаз, объём данных, результат"""
+
+    def __init__(self, accepted=None, head_size=0):
+        self.start = time.monotonic()
+        self.accepted = accepted  # время accept, только для первого запроса соединения
+        self.times = {}
+        self.method = None
+        self.url = None
+        self.status = None
+        self.cache = None   # hit, revalidated, collapsed, miss, bypass; None - без кэша
+        self.error = None
+        self.bytes_in = head_size
+        self.bytes_out = 0
+
+    def mark(self, phase):
+        self.times[phase] = time.monotonic()
+
+    def durations(self):
+        """Длительность каждой отмеченной фазы"""
+        result = {}
+        previous = self.start
+        for phase in PHASES:
+            moment = self.times.get(phase)
+            if moment is not None:
+                result[phase] = moment - previous
+                previous = moment
+        return result
+
+    def record(self):
+        """Запись для журнала доступа"""
+        durations = self.durations()
+        return {
+            'time': round(time.time(), 3),
+            'method': self.method,
+            'url': self.url,
+            'status': self.status,
+            'cache': self.cache,
+            'error': self.error,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'queued_ms': round((self.start - self.accepted) * 1000, 3) if self.accepted else None,
+            'phases_ms': {phase: round(value * 1000, 3) for phase, value in durations.items()},
+            'total_ms': round((self.times.get('last_byte', self.start) - self.start) * 1000, 3),
+        }
+
+
+def current():
+    return CURRENT.get()
+
+
+def mark(phase):
+    """Отметка фазы текущего запроса, если он есть"""
+    trace = CURRENT.get()
+    if trace is not None:
+        trace.mark(phase)
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя - больше всех границ
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+
+class _Shard:
+    """Счётчики одного потока; пишет в них только он сам"""
+
+    def __init__(self):
+        self.requests = {}  # (код, кэш) -> число
+        self.histograms = {}  # фаза -> _Histogram
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.opened = 0
+        self.closed = 0
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = _Histogram()
+        return histogram
+
+    def merge(self, other):
+        for key, count in list(other.requests.items()):
+            self.requests[key] = self.requests.get(key, 0) + count
+        for name, histogram in list(other.histograms.items()):
+            self.histogram(name).merge(histogram)
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.opened += other.opened
+        self.closed += other.closed
+
+
+class Metrics:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()  # счётчики завершившихся потоков
+        self._lock = threading.Lock()  # только для списка shard'ов, не для записи в них
+        self.gauges = {}  # имя -> (описание, функция без аргументов)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def release(self):
+        """Поток больше не будет писать метрики (поток на соединение завершается)"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            return
+        self._local.shard = None
+        with self._lock:
+            self._shards.remove(shard)
+            self._retired.merge(shard)
+
+    def connection_opened(self):
+        self._shard().opened += 1
+
+    def connection_closed(self):
+        self._shard().closed += 1
+
+    def start(self, accepted=None, head_size=0):
+        """Новый запрос становится текущим"""
+        trace = Trace(accepted, head_size)
+        CURRENT.set(trace)
+        return trace
+
+    def finish(self, trace):
+        """Учёт завершённого запроса в гистограммах и счётчиках"""
+        if 'last_byte' not in trace.times:
+            trace.mark('last_byte')
+        CURRENT.set(None)
+        shard = self._shard()
+        key = (str(trace.status) if trace.status is not None else 'error', trace.cache or 'none')
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        shard.bytes_in += trace.bytes_in
+        shard.bytes_out += trace.bytes_out
+        for phase, value in trace.durations().items():
+            shard.histogram(phase).observe(value)
+        shard.histogram('total').observe(trace.times['last_byte'] - trace.start)
+
+    def gauge(self, name, description, function):
+        self.gauges[name] = (description, function)
+
+    def snapshot(self):
+        total = _Shard()
+        with self._lock:
+            shards = [self._retired] + list(self._shards)
+        for shard in shards:
+            total.merge(shard)
+        return total
+
+    def render(self):
+        """Текст в формате Prometheus"""
+        total = self.snapshot()
+        lines = [
+            '# HELP proxy_requests_total Requests by response status and cache result.',
+            '# TYPE proxy_requests_total counter',
+        ]
+        for (code, cache), count in sorted(total.requests.items()):
+            lines.append(f'proxy_requests_total{{code="{code}",cache="{cache}"}} {count}')
+
+        lines += ['# HELP proxy_phase_seconds Duration of each request phase.',
+                  '# TYPE proxy_phase_seconds histogram']
+        for phase in PHASES + ('total',):
+            histogram = total.histograms.get(phase)
+            if histogram is None:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'proxy_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+            lines.append(f'proxy_phase_seconds_sum{{phase="{phase}"}} {histogram.sum:.6f}')
+            lines.append(f'proxy_phase_seconds_count{{phase="{phase}"}} {cumulative}')
+
+        lines += ['# HELP proxy_bytes_in_total Bytes received from clients.',
+                  '# TYPE proxy_bytes_in_total counter',
+                  f'proxy_bytes_in_total {total.bytes_in}',
+                  '# HELP proxy_bytes_out_total Bytes sent to clients.',
+                  '# TYPE proxy_bytes_out_total counter',
+                  f'proxy_bytes_out_total {total.bytes_out}',
+                  '# HELP proxy_active_connections Client connections being served.',
+                  '# TYPE proxy_active_connections gauge',
+                  f'proxy_active_connections {total.opened - total.closed}']
+        for name, (description, function) in sorted(self.gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} gauge', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(metrics, host, port):
+    """HTTP-сервер с GET /metrics в отдельном потоке"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class AccessLog:
+    """Журнал без блокировок на пути запроса.
+
+    Строки консоли и JSON-записи копятся в очереди; отдельный поток раз в
+    flush_interval пишет их пачкой. При переполнении очереди записи теряются
+    и учитываются в dropped, обработка запросов не тормозится.
+    """
+
+    def __init__(self, path=None, console=sys.stdout, flush_interval=0.2, max_queue=100000):
+        self.console = console
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.dropped = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def message(self, line):
+        """Строка для консоли"""
+        self._put((False, line))
+
+    def record(self, record):
+        """Структурированная запись для файла журнала"""
+        if self.file is not None:
+            self._put((True, record))
+
+    def _put(self, item):
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self.queue.append(item)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        lines, records = [], []
+        while True:
+            try:
+                structured, item = self.queue.popleft()
+            except IndexError:
+                break
+            if structured:
+                records.append(json.dumps(item, ensure_ascii=False))
+            else:
+                lines.append(item)
+        if lines and self.console is not None:
+            self.console.write('\n'.join(lines) + '\n')
+            self.console.flush()
+        if records:
+            self.file.write('\n'.join(records) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        if self.file is not None:
+            self.file.close()
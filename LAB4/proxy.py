@@ -1,32 +1,112 @@
 import socket
 import threading
+import time
 from urllib.parse import urlparse, urlunparse
 
+import metrics
+from host_filter import BlockList
+from http_message import (HttpError, HttpReader, parse_head, parse_request_head, build_head, get_header,
+                          strip_hop_by_hop, wants_keep_alive, request_body, response_body, error_response,
+                          BodyTracker, CHUNKED, CLOSE, LENGTH, NONE, RETRY_METHODS)
+from resolver import Resolver
+from response_cache import ResponseCache, BodyCapture, cache_directives, is_storable
+from tunnel import CONNECT_RESPONSE, Tunnel, TunnelPump
+from upstream_pool import UpstreamPool
+
+# пометка ответа из кэша в строке статуса
+CACHE_SUFFIX = {'hit': ' (cache)', 'revalidated': ' (cache, revalidated)', 'collapsed': ' (cache, collapsed)'}
+
+# заголовки условного запроса клиента; такие запросы идут на сервер мимо кэша
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since', 'If-Match', 'If-Unmodified-Since', 'If-Range', 'Range')
+
+_FORBIDDEN_BODY = (
+    "<html><body><h1>403 Forbidden</h1>"
+    "<p>Access to this site is blocked by proxy server.</p>"
+    "</body></html>\r\n"
+)
+FORBIDDEN_RESPONSE = (
+    "HTTP/1.1 403 Forbidden\r\n"
+    "Content-Type: text/html\r\n"
+    f"Content-Length: {len(_FORBIDDEN_BODY)}\r\n"
+    "Connection: close\r\n\r\n" + _FORBIDDEN_BODY
+).encode()
+
+
+class ProxyRequest:
+    """Запрос клиента, подготовленный к отправке на сервер"""
+
+    def __init__(self, method, http_version, headers, host, port, clean_url, start_line, upstream_headers, body):
+        self.method = method
+        self.http_version = http_version
+        self.headers = headers
+        self.host = host
+        self.port = port
+        self.clean_url = clean_url
+        self.start_line = start_line              # стартовая строка для сервера (путь без схемы и хоста)
+        self.upstream_headers = upstream_headers  # без hop-by-hop, с Connection: keep-alive
+        self.body = body                          # BodyTracker тела запроса
+        self.keep_alive = wants_keep_alive(http_version, headers)
+
 
 class ProxyServer:
-    def __init__(self, host='127.0.0.11', port=8888, blacklist=None):
+    def __init__(self, host='127.0.0.11', port=8888, blacklist=None, blacklist_files=(),
+                 keep_alive_timeout=15.0, max_pool_per_host=8, pool_idle_timeout=30.0,
+                 cache_size=64 * 1024 * 1024, cache_dir=None, collapse_timeout=30.0,
+                 engine='threads', max_connections=1000, backlog=128,
+                 tunnel_idle_timeout=300.0, connect_ports=(443,), dns_ttl=60.0, dns_negative_ttl=5.0,
+                 access_log=None, metrics_port=None):
         self.host = host
         self.port = port
-        self.blacklist = blacklist or []
+        self.engine = engine                    # threads - поток на соединение, asyncio - один цикл событий
+        self.max_connections = max_connections  # сверх лимита соединения ждут в очереди accept
+        self.backlog = backlog
+        # blacklist - правила host_filter (домен закрывает и поддомены), blacklist_files - файлы с ними
+        self.blacklist = BlockList(blacklist or [], blacklist_files)
+        self.keep_alive_timeout = keep_alive_timeout  # сколько ждать следующего запроса клиента
+        self.resolver = Resolver(ttl=dns_ttl, negative_ttl=dns_negative_ttl)
+        self.pool = UpstreamPool(max_per_host=max_pool_per_host, idle_timeout=pool_idle_timeout,
+                                 resolver=self.resolver)
+        # кэш ответов на GET; cache_size=0 отключает его
+        self.cache = ResponseCache(max_memory_bytes=cache_size, directory=cache_dir) if cache_size else None
+        self.collapse_timeout = collapse_timeout  # сколько ждать чужой загрузки того же URL
+        # строки статуса и журнал доступа пишет отдельный поток, а не каждый обработчик в stdout
+        self.log = metrics.AccessLog(access_log)
+        self.metrics = metrics.Metrics()
+        self.metrics_port = metrics_port  # порт GET /metrics на 127.0.0.1; None - не запускать
+        self.tunnels = TunnelPump(idle_timeout=tunnel_idle_timeout, report=self.log.message)  # туннели CONNECT
+        self.tunnel_idle_timeout = tunnel_idle_timeout
+        self.connect_ports = connect_ports  # куда разрешён CONNECT; None - на любой порт
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
     def start(self):
         try:
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            print(f"[*] Proxy server started on {self.host}:{self.port}")
+            self.server_socket.listen(self.backlog)
+            print(f"[*] Proxy server started on {self.host}:{self.port} ({self.engine})")
+            self.register_gauges()
+            if self.metrics_port is not None:
+                metrics.serve_metrics(self.metrics, '127.0.0.1', self.metrics_port)
+                print(f"[*] Metrics on http://127.0.0.1:{self.metrics_port}/metrics")
+
+            if self.engine == 'asyncio':
+                from proxy_async import AsyncProxyEngine
+                AsyncProxyEngine(self, max_connections=self.max_connections).run()
+                return
 
+            slots = threading.BoundedSemaphore(self.max_connections)
             while True:
+                slots.acquire()
                 try:
                     client_socket, addr = self.server_socket.accept()
-                    print(f"[*] New connection from {addr[0]}:{addr[1]}")
+                    self.log.message(f"[*] New connection from {addr[0]}:{addr[1]}")
                     proxy_thread = threading.Thread(
                         target=self.handle_client,
-                        args=(client_socket,)
+                        args=(client_socket, slots, time.monotonic())
                     )
                     proxy_thread.start()
                 except Exception as e:
+                    slots.release()
                     print(f"[!] Accept error: {e}")
         except KeyboardInterrupt:
             print("\n[*] Shutting down proxy server")
@@ -34,135 +114,515 @@ class ProxyServer:
             print(f"[!] Server error: {e}")
         finally:
             self.server_socket.close()
+            self.pool.close()
+            print(f"[*] Resolver: {self.resolver.stats()}")
+            self.resolver.close()
+            if self.tunnels.opened:
+                print(f"[*] Tunnels: {self.tunnels.stats()}")
+            if self.cache is not None:
+                print(f"[*] Cache: {self.cache.stats()}")
+                self.cache.close()
+            self.log.close()
 
-    def handle_client(self, client_socket):
+    def register_gauges(self):
+        """Показатели, которые считаются в момент запроса /metrics"""
+        self.metrics.gauge('proxy_active_tunnels', 'CONNECT tunnels being pumped.', lambda: len(self.tunnels.tunnels))
+        self.metrics.gauge('proxy_resolver_hit_ratio', 'Share of name lookups answered from the cache.',
+                           lambda: self.resolver.stats()['hit_rate'])
+        self.metrics.gauge('proxy_access_log_dropped', 'Access log records dropped on queue overflow.',
+                           lambda: self.log.dropped)
+        if self.cache is not None:
+            self.metrics.gauge('proxy_cache_hit_ratio', 'Share of cacheable requests served from the cache.',
+                               lambda: self.cache.stats()['hit_ratio'])
+
+    def log_status(self, url, status_code, status_text, cache=None):
+        """Строка статуса в консоль и результат ответа в метрики текущего запроса"""
+        trace = metrics.current()
+        if trace is not None:
+            trace.url = url
+            trace.status = int(status_code)
+            trace.cache = cache
+        self.log.message(f"{url} - {status_code} {status_text}{CACHE_SUFFIX.get(cache, '')}")
+
+    def log_failure(self, url, text):
+        trace = metrics.current()
+        if trace is not None:
+            trace.url = url
+            trace.error = text
+        self.log.message(f"{url} - {text}")
+
+    def finish_request(self, trace):
+        self.metrics.finish(trace)
+        self.log.record(trace.record())
+
+    def handle_client(self, client_socket, slots=None, accepted=None):
+        """Обработка соединения клиента: запросы идут один за другим, пока соединение keep-alive"""
+        reader = HttpReader(client_socket)
+        self.metrics.connection_opened()
         try:
-            request_data = client_socket.recv(4096)
-            if not request_data:
-                return
+            client_socket.settimeout(self.keep_alive_timeout)
+            while True:
+                try:
+                    request_head = reader.read_head()
+                except socket.timeout:
+                    break  # клиент не прислал следующий запрос
+                except HttpError as e:
+                    self.log.message(f"[!] Bad request: {e}")
+                    client_socket.sendall(error_response(e.status))
+                    break
+                if request_head is None:
+                    break
+                trace = self.metrics.start(accepted, len(request_head))
+                accepted = None
+                try:
+                    keep_alive = self.handle_request(client_socket, reader, request_head)
+                finally:
+                    self.finish_request(trace)
+                if not keep_alive:
+                    break
+
+        except Exception as e:
+            self.log.message(f"[!] Client handling error: {e}")
+        finally:
+            client_socket.close()
+            self.metrics.connection_closed()
+            self.metrics.release()
+            if slots is not None:
+                slots.release()
+
+    def prepare_request(self, request_head):
+        """Разбор запроса клиента и подготовка запроса к серверу; общий для обоих движков.
+
+        Возвращает (ProxyRequest, None) или (None, ответ клиенту перед закрытием соединения
+        либо None, если соединение просто закрывается).
+        """
+        # строгий разбор: неоднозначный запрос нельзя передавать серверу
+        try:
+            method, url, http_version, headers = parse_request_head(request_head)
+        except HttpError as e:
+            return self.reject(f"Bad request: {e}", e.status)
+        trace = metrics.current()
+        if trace is not None:
+            trace.method = method
+
+        if method == 'CONNECT':
+            return self.prepare_connect(url, http_version, headers)
+
+        if '://' not in url:
+            return self.reject(f"Invalid URL (no scheme): {url}")
+
+        try:
+            parsed_url = urlparse(url)
+            if not parsed_url.hostname:
+                return self.reject(f"Invalid URL (no host): {url}")
+
+            host = parsed_url.hostname
+            port = parsed_url.port if parsed_url.port else 80
+            clean_url = urlunparse((
+                parsed_url.scheme, #http
+                parsed_url.netloc, #live.legendy.by:8000
+                parsed_url.path,   #/legendyfm
+                parsed_url.params, #параметры пути, для старых url
+                parsed_url.query,  #строка запроса
+                ''  # удалить фрагмент
+            ))
+        except ValueError as e:
+            return self.reject(f"URL parsing error: {e}")
+
+        #коррекция запроса
+        path = parsed_url.path if parsed_url.path else '/'
+        if parsed_url.query:
+            path += '?' + parsed_url.query
+
+        # проверка на черный лист
+        if self.blacklist.blocked(host, path) is not None:
+            self.log_status(clean_url, 403, 'Forbidden')
+            return None, FORBIDDEN_RESPONSE
+
+        try:
+            request_tracker = request_body(headers)
+        except HttpError as e:
+            return self.reject(f"Bad request: {e}", e.status)
+
+        upstream_headers = strip_hop_by_hop(headers)
+        if request_tracker.mode == CHUNKED:
+            # при Transfer-Encoding длину задаёт он, Content-Length серверу передавать нельзя
+            upstream_headers = [(key, value) for key, value in upstream_headers if key.lower() != 'content-length']
+        if get_header(upstream_headers, 'Host') is None:
+            upstream_headers.insert(0, ('Host', parsed_url.netloc))
+        upstream_headers.append(('Connection', 'keep-alive'))
+
+        request = ProxyRequest(method, http_version, headers, host, port, clean_url,
+                               f"{method} {path} {http_version}", upstream_headers, request_tracker)
+        return request, None
+
+    def prepare_connect(self, target, http_version, headers):
+        """Разбор CONNECT host:port"""
+        host, sep, port = target.rpartition(':')
+        host = host.strip('[]')
+        if not sep or not host or not (port.isascii() and port.isdigit()) or not 0 < int(port) < 65536:
+            return self.reject(f"Invalid CONNECT target: {target}")
+        port = int(port)
+
+        if self.blacklist.blocked(host) is not None or (self.connect_ports is not None and port not in self.connect_ports):
+            self.log_status(target, 403, 'Forbidden')
+            return None, FORBIDDEN_RESPONSE
+
+        return ProxyRequest('CONNECT', http_version, headers, host, port, target,
+                            None, None, BodyTracker(NONE)), None
+
+    def reject(self, message, status=400):
+        """Отказ в некорректном запросе: результат для prepare_request"""
+        self.log.message(f"[!] {message}")
+        trace = metrics.current()
+        if trace is not None:
+            trace.status = status
+            trace.error = message
+        return None, error_response(status)
 
-            # извлечение первой строки
+    def handle_request(self, client_socket, reader, request_head):
+        """Обработка одного запроса; True - соединение с клиентом можно использовать дальше"""
+        request, refusal = self.prepare_request(request_head)
+        metrics.mark('parse')
+        if request is None:
+            if refusal is not None:
+                client_socket.sendall(refusal)
+                metrics.current().bytes_out += len(refusal)
+            return False
+        trace = metrics.current()
+        trace.method, trace.url = request.method, request.clean_url
+
+        # подключение к целевому серверу
+        try:
+            if request.method == 'CONNECT':
+                return self.open_tunnel(client_socket, reader, request)
+            if (self.cache is not None and request.method == 'GET' and request.body.done
+                    and not any(get_header(request.headers, name) is not None for name in CONDITIONAL_HEADERS)):
+                return self.forward_cached(client_socket, reader, request.host, request.port, request.clean_url,
+                                           request.start_line, request.headers, request.upstream_headers,
+                                           request.body, request.keep_alive)
+            return self.forward(client_socket, reader, request.method, request.host, request.port,
+                                request.clean_url, build_head(request.start_line, request.upstream_headers),
+                                request.body, request.keep_alive)
+        except socket.timeout:
+            self.log_failure(request.clean_url, "Connection Timeout")
+        except ConnectionRefusedError:
+            self.log_failure(request.clean_url, "Connection Refused")
+        except Exception as e:
+            self.log_failure(request.clean_url, f"Connection Error: {str(e)}")
+        return False
+
+    def open_tunnel(self, client_socket, reader, request):
+        """CONNECT: сокеты передаются общему потоку перекачки, поток клиента освобождается"""
+        upstream = self.resolver.connect(request.host, request.port, timeout=self.pool.connect_timeout)
+        try:
+            client_socket.sendall(CONNECT_RESPONSE)
+        except:
+            upstream.close()
+            raise
+        self.log_status(request.clean_url, 200, 'Connection Established')
+        # handle_client закроет уже пустой объект сокета, а дескриптор останется у туннеля
+        client = socket.socket(fileno=client_socket.detach())
+        self.tunnels.add(Tunnel(request.clean_url, client, upstream, bytes(reader.buffer)))
+        return False
+
+    def forward_cached(self, client_socket, reader, host, port, clean_url, start_line,
+                       headers, upstream_headers, request_tracker, client_keep_alive):
+        """GET через кэш: свежая запись отдаётся сразу, устаревшая проверяется условным запросом"""
+        no_cache = 'no-cache' in cache_directives(headers)
+        inflight = None
+        entry = self.cache.lookup(clean_url)
+        if entry is None or no_cache or not entry.is_fresh():
+            # одновременные промахи по URL: к серверу идёт только первый запрос
+            leader, inflight = self.cache.begin(clean_url)
+            if not leader:
+                capture = inflight.wait(self.collapse_timeout)
+                if capture is not None:
+                    return self.send_capture(client_socket, clean_url, capture, client_keep_alive)
+                inflight = None
+                entry = self.cache.lookup(clean_url)
+
+        body = self.cache.open_body(entry) if entry is not None else None
+        if body is None:
+            entry = None  # файл записи уже вытеснен
+        try:
+            if entry is not None and entry.is_fresh() and not no_cache:
+                return self.send_cached(client_socket, clean_url, entry, body, client_keep_alive)
+            if entry is not None:
+                upstream_headers = upstream_headers + entry.validators()
+            return self.forward(client_socket, reader, 'GET', host, port, clean_url,
+                                build_head(start_line, upstream_headers), request_tracker, client_keep_alive,
+                                request_headers=headers, cached=entry, cached_body=body, inflight=inflight)
+        finally:
+            if inflight is not None:
+                self.cache.finish(clean_url, inflight)
+            if body is not None and not isinstance(body, bytes):
+                body.close()
+
+    def send_cached(self, client_socket, clean_url, entry, body, client_keep_alive, revalidated=False):
+        """Ответ клиенту из кэша"""
+        headers = entry.headers + [('Age', str(int(entry.age()))),
+                                   ('Connection', 'keep-alive' if client_keep_alive else 'close')]
+        head = build_head(entry.status_line, headers)
+        if isinstance(body, bytes):
+            client_socket.sendall(head + body)
+        else:
+            client_socket.sendall(head)
+            body.seek(0)
+            client_socket.sendfile(body)
+        self.cache.record_hit(entry.size, revalidated)
+        metrics.current().bytes_out += len(head) + entry.size
+
+        status_parts = entry.status_line.split(' ', 2)
+        status_text = status_parts[2] if len(status_parts) > 2 else ''
+        self.log_status(clean_url, status_parts[1], status_text, 'revalidated' if revalidated else 'hit')
+        return client_keep_alive
+
+    def send_capture(self, client_socket, clean_url, capture, client_keep_alive, collapsed=True):
+        """Ответ из копии тела, которая ещё загружается с сервера"""
+        status_line, headers = capture.head
+        client_headers = headers + [('Connection', 'keep-alive' if client_keep_alive else 'close')]
+        head = build_head(status_line, client_headers)
+        client_socket.sendall(head)
+        if collapsed:
+            status_parts = status_line.split(' ', 2)
+            status_text = status_parts[2] if len(status_parts) > 2 else ''
+            self.log_status(clean_url, status_parts[1], status_text, 'collapsed')
+        offset = 0
+        while True:
+            data = capture.read(offset, self.collapse_timeout)
+            if not data:
+                break
+            client_socket.sendall(data)
+            offset += len(data)
+
+        metrics.current().bytes_out += len(head) + offset
+        if collapsed:
+            self.cache.record_hit(offset)
+        return client_keep_alive
+
+    def forward(self, client_socket, reader, method, host, port, clean_url,
+                modified_request, request_tracker, client_keep_alive,
+                request_headers=None, cached=None, cached_body=None, inflight=None):
+        """Пересылка запроса через соединение из пула и ответа обратно клиенту.
+
+        request_headers передаётся для запросов через кэш: тогда подходящий ответ
+        сохраняется, а 304 на проверку записи cached отдаётся клиенту из кэша.
+        inflight - загрузка, к которой присоединяются одновременные запросы того же URL.
+        """
+        # безопасный запрос без тела можно повторить, если соединение из пула
+        # оказалось закрыто сервером раньше, чем пришёл хоть один байт ответа
+        can_retry = request_tracker.done and method in RETRY_METHODS
+        while True:
+            remote_socket, reused = self.pool.acquire(host, port)
+            remote_socket.settimeout(10)
+            remote = HttpReader(remote_socket)
             try:
-                first_line = request_data.split(b'\n')[0].decode()
-                parts = first_line.split()
-                if len(parts) < 3:
-                    return
-                method, url, http_version = parts
+                remote_socket.sendall(modified_request)
+                metrics.current().bytes_in += reader.relay_to(request_tracker, remote_socket)
+
+                # получение заголовков ответа
+                response = remote.read_head()
+                if response is None:
+                    raise ConnectionResetError("server closed connection")
+                metrics.mark('first_byte')
+            except ConnectionError:
+                remote_socket.close()
+                if reused and can_retry and not remote.buffer:
+                    continue
+                raise
             except:
-                return
+                remote_socket.close()
+                raise
+            break
 
+        detached = False  # соединением с сервером владеет поток загрузки в кэш
+        try:
+            while True:
+                status_line, response_headers = parse_head(response)
+                status_parts = status_line.split(' ', 2)
+                status_code = int(status_parts[1])
+                if 100 <= status_code < 200 and status_code != 101:
+                    # промежуточный ответ (100 Continue), настоящий идёт следом
+                    client_socket.sendall(response)
+                    response = remote.read_head()
+                    if response is None:
+                        raise ConnectionResetError("server closed connection")
+                    continue
+                break
 
-            if '://' not in url:
-                print(f"[!] Invalid URL (no scheme): {url}")
-                return
+            response_tracker = response_body(method, status_code, response_headers)
+            # тело до закрытия соединения: ни клиента, ни сервер дальше использовать нельзя
+            upstream_reusable = (response_tracker.mode != CLOSE
+                                 and wants_keep_alive(status_parts[0], response_headers))
 
-            try:
-                parsed_url = urlparse(url)
-                if not parsed_url.netloc:
-                    print(f"[!] Invalid URL (no host): {url}")
-                    return
-
-                host = parsed_url.netloc.split(':')[0]
-                port = parsed_url.port if parsed_url.port else 80
-                clean_url = urlunparse((
-                    parsed_url.scheme, #http
-                    parsed_url.netloc, #live.legendy.by:8000
-                    parsed_url.path,   #/legendyfm
-                    parsed_url.params, #параметры пути, для старых url
-                    parsed_url.query,  #строка запроса
-                    ''  # удалить фрагмент
-                ))
-            except Exception as e:
-                print(f"[!] URL parsing error: {e}")
-                return
+            if cached is not None and status_code == 304:
+                # запись в кэше не изменилась, обновляем только заголовки
+                cached.refresh(strip_hop_by_hop(response_headers))
+                if inflight is not None:
+                    self.cache.finish(clean_url, inflight)
+                self.send_cached(client_socket, clean_url, cached, cached_body, client_keep_alive, revalidated=True)
+            else:
+                # извлечение кода статутса и его вывод в консоль
+                status_text = status_parts[2] if len(status_parts) > 2 else ''
+                cache_status = 'miss' if request_headers is not None else ('bypass' if self.cache else None)
+                self.log_status(clean_url, status_code, status_text, cache_status)
 
-            # проверка на черный лист
-            if host in self.blacklist:
-                print(f"{clean_url} - 403 Forbidden")
-                response = (
-                    "HTTP/1.1 403 Forbidden\r\n"
-                    "Content-Type: text/html\r\n\r\n"
-                    "<html><body><h1>403 Forbidden</h1>"
-                    "<p>Access to this site is blocked by proxy server.</p>"
-                    "</body></html>\r\n"
-                )
-                client_socket.send(response.encode())
-                return
+                client_keep_alive = client_keep_alive and response_tracker.mode != CLOSE
+                stored_headers = strip_hop_by_hop(response_headers)
+                capture = None
+                if request_headers is not None:
+                    capture = self.start_capture(clean_url, status_line, status_code, request_headers,
+                                                 response_headers, stored_headers, response_tracker, inflight)
 
-            #коррекция запроса
-            path = parsed_url.path if parsed_url.path else '/'
-            if parsed_url.query:
-                path += '?' + parsed_url.query
+                if capture is not None and inflight is not None and inflight.capture is capture:
+                    # тело загружает отдельный поток, клиент читает его из копии наравне с остальными
+                    threading.Thread(
+                        target=self.fill_capture,
+                        args=(remote, host, port, upstream_reusable, response_tracker, capture, clean_url, inflight),
+                        daemon=True
+                    ).start()
+                    detached = True
+                    return self.send_capture(client_socket, clean_url, capture, client_keep_alive, collapsed=False)
 
-            modified_request = request_data.replace(
-                f"{method} {url}".encode(),
-                f"{method} {path}".encode(),
-                1
-            )
+                client_headers = stored_headers + [('Connection', 'keep-alive' if client_keep_alive else 'close')]
+                head = build_head(status_line, client_headers)
+                client_socket.sendall(head)
+                sent = self.relay_response(client_socket, remote, response_tracker, capture, clean_url)
+                metrics.current().bytes_out += len(head) + sent
+        except:
+            if not detached:
+                remote_socket.close()
+            raise
 
-            # подключение к целевому серверу
-            try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as remote_socket:
-                    remote_socket.settimeout(10)
-                    remote_socket.connect((host, port))
-                    remote_socket.send(modified_request)
-
-                    # получение заголовков ответа
-                    response = b''
-                    while True:
-                        part = remote_socket.recv(4096)
-                        if not part:
-                            break
-                        response += part
-                        if b'\r\n\r\n' in response:  # заголовки получены
-                            break
-
-                    if not response:
-                        print(f"{clean_url} - No Response")
-                        return
-
-                    # извлечение кода статутса и его вывод в консоль
-                    status_line = response.split(b'\r\n')[0]
-                    try:
-                        status_parts = status_line.decode().split(' ', 2)
-                        status_code = status_parts[1]
-                        status_text = status_parts[2] if len(status_parts) > 2 else ''
-                        print(f"{clean_url} - {status_code} {status_text}")
-                    except:
-                        print(f"{clean_url} - Unknown Status")
-
-                    # прямой ответ клиенту
-                    client_socket.send(response)
-
-
-                    while True:
-                        part = remote_socket.recv(4096)
-                        if not part:
-                            break
-                        client_socket.send(part)
-
-            except socket.timeout:
-                print(f"{clean_url} - Connection Timeout")
-            except ConnectionRefusedError:
-                print(f"{clean_url} - Connection Refused")
-            except Exception as e:
-                print(f"{clean_url} - Connection Error: {str(e)}")
+        self.release_upstream(host, port, remote, upstream_reusable)
+        return client_keep_alive
+
+    def release_upstream(self, host, port, remote, reusable):
+        """Возврат соединения в пул, если ответ прочитан целиком и сервер его не закрывает"""
+        if reusable and not remote.buffer:
+            self.pool.release(host, port, remote.sock)
+        else:
+            remote.sock.close()
 
+    def start_capture(self, clean_url, status_line, status_code, request_headers, response_headers,
+                      stored_headers, response_tracker, inflight):
+        """Копия тела для кэша или None, если ответ сохранять нельзя.
+
+        Если длина тела известна и оно помещается в кэш, ожидающие запросы того же URL
+        читают его из копии; иначе они сразу отпускаются и идут на сервер сами.
+        """
+        self.cache.record_miss()
+        if not is_storable(status_code, request_headers, response_headers):
+            self.cache.remove(clean_url)
+            if inflight is not None:
+                self.cache.finish(clean_url, inflight)
+            return None
+
+        capture = BodyCapture(self.cache, status_line, stored_headers)
+        if inflight is not None:
+            if response_tracker.mode == LENGTH and response_tracker.remaining <= self.cache.max_object_size:
+                self.cache.share(inflight, capture)
+            else:
+                self.cache.finish(clean_url, inflight)
+        return capture
+
+    def fill_capture(self, remote, host, port, upstream_reusable, response_tracker, capture, clean_url, inflight):
+        """Загрузка тела в копию для кэша независимо от скорости клиентов"""
+        try:
+            remote.relay_body(response_tracker, capture.write)
+            entry = capture.entry()
+            if entry is not None:
+                self.cache.store(clean_url, entry)
+            capture.close()
+            self.release_upstream(host, port, remote, upstream_reusable)
         except Exception as e:
-            print(f"[!] Client handling error: {e}")
+            capture.abort()
+            remote.sock.close()
+            self.log.message(f"{clean_url} - Connection Error: {str(e)}")
         finally:
-            client_socket.close()
+            self.cache.finish(clean_url, inflight)
+
+    def relay_response(self, client_socket, remote, response_tracker, capture, clean_url):
+        """Пересылка тела клиенту с сохранением копии в кэш, если она есть; возвращает число байт"""
+        if capture is None:
+            # прямой ответ клиенту
+            return remote.relay_to(response_tracker, client_socket)
+
+        def send(data):
+            client_socket.sendall(data)
+            capture.write(data)
+
+        try:
+            sent = remote.relay_body(response_tracker, send)
+        except:
+            capture.abort()
+            raise
+        status_line, stored_headers = capture.head
+        if response_tracker.mode == CLOSE:
+            # в кэше длина тела уже известна
+            stored_headers = stored_headers + [('Content-Length', str(capture.size))]
+        entry = capture.entry(status_line, stored_headers)
+        if entry is not None:
+            self.cache.store(clean_url, entry)
+        capture.close()
+        return sent
+
+
+def raise_fd_limit():
+    """Поднятие лимита открытых дескрипторов до жёсткого: на каждого клиента нужно два сокета"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
 
 
 if __name__ == "__main__":
+    import argparse
+
     #черный список
     BLACKLIST = [
         "store.steampowered.com",
         "soundcloud.com"
     ]
 
+    parser = argparse.ArgumentParser(description="HTTP прокси-сервер")
+    parser.add_argument('--host', default='127.0.0.11')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--blacklist-file', action='append', default=[],
+                        help="файл с правилами черного списка (перечитывается при изменении); можно несколько")
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help="threads - поток на соединение (с кэшем), asyncio - один цикл событий "
+                             "на все соединения (без кэша)")
+    parser.add_argument('--max-connections', type=int, default=1000,
+                        help="сколько клиентов обслуживать одновременно; остальные ждут в очереди accept")
+    parser.add_argument('--backlog', type=int, default=128, help="длина очереди accept")
+    parser.add_argument('--tunnel-idle-timeout', type=float, default=300.0,
+                        help="через сколько секунд без данных закрывать туннель CONNECT")
+    parser.add_argument('--connect-ports', type=int, nargs='*', default=[443],
+                        help="порты, на которые разрешён CONNECT; без значений - любые")
+    parser.add_argument('--dns-ttl', type=float, default=60.0, help="сколько секунд хранить адреса сервера")
+    parser.add_argument('--dns-negative-ttl', type=float, default=5.0,
+                        help="сколько секунд помнить, что имя не разрешается")
+    parser.add_argument('--access-log', help="файл журнала доступа (JSON по строке на запрос)")
+    parser.add_argument('--metrics-port', type=int, help="порт GET /metrics в формате Prometheus на 127.0.0.1")
+    args = parser.parse_args()
+    raise_fd_limit()
+
     try:
-        proxy = ProxyServer(host='127.0.0.11', port=8888, blacklist=BLACKLIST)
+        proxy = ProxyServer(host=args.host, port=args.port, blacklist=BLACKLIST,
+                            blacklist_files=args.blacklist_file, engine=args.engine,
+                            max_connections=args.max_connections, backlog=args.backlog,
+                            tunnel_idle_timeout=args.tunnel_idle_timeout,
+                            connect_ports=set(args.connect_ports) if args.connect_ports else None,
+                            dns_ttl=args.dns_ttl, dns_negative_ttl=args.dns_negative_ttl,
+                            access_log=args.access_log, metrics_port=args.metrics_port)
         proxy.start()
     except Exception as e:
         print(f"[!] Fatal error: {e}")
@@ -0,0 +1,356 @@
+import asyncio
+import time
+from collections import deque
+
+import metrics
+
+from http_message import (HttpError, MAX_HEAD, parse_head, build_head, strip_hop_by_hop, wants_keep_alive,
+                          response_body, error_response, CLOSE, RETRY_METHODS)
+from tunnel import CONNECT_RESPONSE, TunnelStats
+
+
+class AsyncHttpReader:
+    """Буферизованное чтение HTTP-сообщений из asyncio.StreamReader (аналог HttpReader)"""
+
+    def __init__(self, stream, timeout=None, bufsize=65536):
+        self.stream = stream
+        self.timeout = timeout  # None - ждать без ограничения
+        self.bufsize = bufsize
+        self.buffer = bytearray()
+
+    async def _recv(self):
+        if self.timeout is None:
+            return await self.stream.read(self.bufsize)
+        return await asyncio.wait_for(self.stream.read(self.bufsize), self.timeout)
+
+    async def read_head(self, limit=MAX_HEAD):
+        """Стартовая строка и заголовки; None - соединение закрыто до начала сообщения"""
+        searched = 0
+        while True:
+            end = self.buffer.find(b'\r\n\r\n', max(0, searched - 3))
+            if (end if end >= 0 else len(self.buffer)) > limit:
+                raise HttpError("Слишком большие заголовки", 431)
+            if end >= 0:
+                head = bytes(self.buffer[:end + 4])
+                del self.buffer[:end + 4]
+                return head
+
+            searched = len(self.buffer)
+            data = await self._recv()
+            if not data:
+                if self.buffer:
+                    raise HttpError("Соединение закрыто посреди заголовков")
+                return None
+            self.buffer += data
+
+    async def relay_body(self, tracker, writer):
+        """Пересылка тела в writer; drain() притормаживает чтение, пока получатель не заберёт данные"""
+        total = 0
+        while not tracker.done:
+            if self.buffer:
+                data = bytes(self.buffer)
+                self.buffer.clear()
+            else:
+                data = await self._recv()
+                if not data:
+                    if tracker.mode == CLOSE:
+                        break
+                    raise HttpError("Соединение закрыто посреди тела сообщения")
+
+            used = tracker.feed(data)
+            if used:
+                writer.write(data[:used] if used < len(data) else data)
+                await writer.drain()
+                total += used
+            if used < len(data):
+                self.buffer += data[used:]
+        return total
+
+
+class AsyncUpstreamPool:
+    """Пул keep-alive соединений к серверам для asyncio-движка (аналог UpstreamPool)"""
+
+    def __init__(self, resolver, max_per_host=8, idle_timeout=30.0, connect_timeout=10.0):
+        self.resolver = resolver
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.idle = {}  # (host, port) -> deque[(reader, writer, время возврата в пул)]
+
+        # счётчики
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    async def acquire(self, host, port):
+        """Соединение к серверу: (reader, writer, взято ли оно из пула)"""
+        key = (host, port)
+        connections = self.idle.get(key)
+        while connections:
+            reader, writer, since = connections.pop()  # самое свежее соединение
+            if not connections:
+                del self.idle[key]
+            # сервер закрыл соединение или прислал что-то без запроса - использовать нельзя
+            if (time.monotonic() - since < self.idle_timeout and not reader.at_eof()
+                    and not writer.is_closing()):
+                self.reused += 1
+                return reader, writer, True
+            self.discarded += 1
+            writer.close()
+
+        sock = await asyncio.wait_for(self.resolver.connect_async(host, port), self.connect_timeout)
+        reader, writer = await asyncio.open_connection(sock=sock)
+        self.created += 1
+        return reader, writer, False
+
+    def release(self, host, port, reader, writer):
+        """Возврат соединения в пул после полностью прочитанного ответа"""
+        now = time.monotonic()
+        connections = self.idle.setdefault((host, port), deque())
+        while connections and now - connections[0][2] >= self.idle_timeout:
+            connections.popleft()[1].close()
+            self.discarded += 1
+        if len(connections) < self.max_per_host:
+            connections.append((reader, writer, now))
+            return
+        writer.close()
+        self.discarded += 1
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self.idle.clear()
+
+
+class AsyncProxyEngine:
+    """Движок ProxyServer на asyncio: все соединения обслуживает один цикл событий.
+
+    Не больше max_connections клиентов одновременно: когда лимит исчерпан, новые
+    соединения не принимаются и ждут в очереди ядра (её длина - backlog).
+    Кэш ответов используется только потоковым движком.
+    """
+
+    def __init__(self, proxy, max_connections=10000, upstream_timeout=10.0):
+        self.proxy = proxy
+        self.max_connections = max_connections
+        self.upstream_timeout = upstream_timeout
+        self.pool = AsyncUpstreamPool(proxy.resolver, max_per_host=proxy.pool.max_per_host,
+                                      idle_timeout=proxy.pool.idle_timeout,
+                                      connect_timeout=proxy.pool.connect_timeout)
+        self.active = 0
+        self.active_tunnels = 0
+        self.tasks = set()
+
+    def run(self):
+        self.proxy.metrics.gauge('proxy_active_tunnels', 'CONNECT tunnels being pumped.', lambda: self.active_tunnels)
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.pool.close()
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        listener = self.proxy.server_socket
+        listener.setblocking(False)
+        slots = asyncio.Semaphore(self.max_connections)
+        while True:
+            await slots.acquire()
+            try:
+                client_socket, addr = await loop.sock_accept(listener)
+            except OSError as e:
+                slots.release()
+                print(f"[!] Accept error: {e}")
+                await asyncio.sleep(0.1)  # например, EMFILE: даём освободиться дескрипторам
+                continue
+            self.proxy.log.message(f"[*] New connection from {addr[0]}:{addr[1]}")
+            task = asyncio.create_task(self.handle_client(client_socket, slots, time.monotonic()))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def handle_client(self, client_socket, slots, accepted=None):
+        """Обработка соединения клиента: запросы идут один за другим, пока соединение keep-alive"""
+        self.active += 1
+        self.proxy.metrics.connection_opened()
+        writer = None
+        try:
+            stream, writer = await asyncio.open_connection(sock=client_socket)
+            reader = AsyncHttpReader(stream, self.proxy.keep_alive_timeout)
+            while True:
+                try:
+                    request_head = await reader.read_head()
+                except asyncio.TimeoutError:
+                    break  # клиент не прислал следующий запрос
+                except HttpError as e:
+                    self.proxy.log.message(f"[!] Bad request: {e}")
+                    writer.write(error_response(e.status))
+                    await writer.drain()
+                    break
+                if request_head is None:
+                    break
+                # у каждой задачи свой контекст, поэтому текущий запрос не смешивается с чужими
+                trace = self.proxy.metrics.start(accepted, len(request_head))
+                accepted = None
+                try:
+                    keep_alive = await self.handle_request(reader, writer, request_head)
+                finally:
+                    self.proxy.finish_request(trace)
+                if not keep_alive:
+                    break
+
+        except ConnectionError:
+            pass
+        except Exception as e:
+            self.proxy.log.message(f"[!] Client handling error: {e}")
+        finally:
+            if writer is not None:
+                writer.close()
+            else:
+                client_socket.close()
+            self.proxy.metrics.connection_closed()
+            self.active -= 1
+            slots.release()
+
+    async def handle_request(self, reader, writer, request_head):
+        """Обработка одного запроса; True - соединение с клиентом можно использовать дальше"""
+        request, refusal = self.proxy.prepare_request(request_head)
+        metrics.mark('parse')
+        trace = metrics.current()
+        if request is None:
+            if refusal is not None:
+                writer.write(refusal)
+                await writer.drain()
+                trace.bytes_out += len(refusal)
+            return False
+        trace.method, trace.url = request.method, request.clean_url
+
+        try:
+            if request.method == 'CONNECT':
+                return await self.tunnel(reader, writer, request)
+            return await self.forward(reader, writer, request)
+        except asyncio.TimeoutError:
+            self.proxy.log_failure(request.clean_url, "Connection Timeout")
+        except ConnectionRefusedError:
+            self.proxy.log_failure(request.clean_url, "Connection Refused")
+        except Exception as e:
+            self.proxy.log_failure(request.clean_url, f"Connection Error: {str(e)}")
+        return False
+
+    async def forward(self, reader, writer, request):
+        """Пересылка запроса через соединение из пула и ответа обратно клиенту"""
+        head = build_head(request.start_line, request.upstream_headers)
+        can_retry = request.body.done and request.method in RETRY_METHODS
+        while True:
+            upstream_stream, upstream_writer, reused = await self.pool.acquire(request.host, request.port)
+            remote = AsyncHttpReader(upstream_stream, self.upstream_timeout)
+            try:
+                upstream_writer.write(head)
+                await upstream_writer.drain()
+                metrics.current().bytes_in += await reader.relay_body(request.body, upstream_writer)
+
+                response = await remote.read_head()
+                if response is None:
+                    raise ConnectionResetError("server closed connection")
+                metrics.mark('first_byte')
+            except ConnectionError:
+                upstream_writer.close()
+                if reused and can_retry and not remote.buffer:
+                    continue
+                raise
+            except BaseException:
+                upstream_writer.close()
+                raise
+            break
+
+        try:
+            while True:
+                status_line, response_headers = parse_head(response)
+                status_parts = status_line.split(' ', 2)
+                status_code = int(status_parts[1])
+                if 100 <= status_code < 200 and status_code != 101:
+                    # промежуточный ответ (100 Continue), настоящий идёт следом
+                    writer.write(response)
+                    response = await remote.read_head()
+                    if response is None:
+                        raise ConnectionResetError("server closed connection")
+                    continue
+                break
+
+            response_tracker = response_body(request.method, status_code, response_headers)
+            upstream_reusable = (response_tracker.mode != CLOSE
+                                 and wants_keep_alive(status_parts[0], response_headers))
+
+            status_text = status_parts[2] if len(status_parts) > 2 else ''
+            self.proxy.log_status(request.clean_url, status_code, status_text)
+
+            client_keep_alive = request.keep_alive and response_tracker.mode != CLOSE
+            client_headers = strip_hop_by_hop(response_headers) + [
+                ('Connection', 'keep-alive' if client_keep_alive else 'close')]
+            head = build_head(status_line, client_headers)
+            writer.write(head)
+            sent = await remote.relay_body(response_tracker, writer)
+            metrics.current().bytes_out += len(head) + sent
+        except BaseException:
+            upstream_writer.close()
+            raise
+
+        if upstream_reusable and not remote.buffer:
+            self.pool.release(request.host, request.port, upstream_stream, upstream_writer)
+        else:
+            upstream_writer.close()
+        return client_keep_alive
+
+    async def tunnel(self, reader, writer, request):
+        """CONNECT: перекачка в обе стороны до закрытия или простоя дольше tunnel_idle_timeout"""
+        sock = await asyncio.wait_for(self.proxy.resolver.connect_async(request.host, request.port),
+                                      self.pool.connect_timeout)
+        upstream_stream, upstream_writer = await asyncio.open_connection(sock=sock)
+        stats = TunnelStats(request.clean_url)
+        idle_timeout = self.proxy.tunnel_idle_timeout
+
+        async def pump(stream, dest, upstream):
+            while True:
+                try:
+                    data = await asyncio.wait_for(stream.read(65536), idle_timeout)
+                except asyncio.TimeoutError:
+                    if time.monotonic() - stats.last_active < idle_timeout:
+                        continue  # простаивает только это направление
+                    raise
+                if not data:
+                    if dest.can_write_eof():
+                        dest.write_eof()
+                    return
+                dest.write(data)
+                await dest.drain()
+                stats.last_active = time.monotonic()
+                if upstream:
+                    stats.sent_up += len(data)
+                else:
+                    stats.sent_down += len(data)
+
+        self.active_tunnels += 1
+        try:
+            writer.write(CONNECT_RESPONSE)
+            self.proxy.log_status(request.clean_url, 200, 'Connection Established')
+            if reader.buffer:
+                # начало TLS пришло вместе с запросом CONNECT
+                upstream_writer.write(bytes(reader.buffer))
+                stats.sent_up += len(reader.buffer)
+                reader.buffer.clear()
+            tasks = [asyncio.create_task(pump(reader.stream, upstream_writer, True)),
+                     asyncio.create_task(pump(upstream_stream, writer, False))]
+            try:
+                await asyncio.gather(*tasks)
+            except asyncio.TimeoutError:
+                self.proxy.log.message(f"{request.clean_url} - Tunnel idle timeout")
+            finally:
+                for task in tasks:
+                    task.cancel()
+        finally:
+            self.active_tunnels -= 1
+            upstream_writer.close()
+            trace = metrics.current()
+            trace.bytes_in += stats.sent_up
+            trace.bytes_out += stats.sent_down
+            self.proxy.log.message(stats.summary())
+        return False
@@ -0,0 +1,263 @@
+import asyncio
+import errno
+import ipaddress
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from metrics import mark
+
+
+def system_lookup(host):
+    """Адреса host через getaddrinfo: [(семейство, ip)] без повторов, в порядке ответа"""
+    addresses = []
+    for family, _, _, _, sockaddr in socket.getaddrinfo(host, None, type=socket.SOCK_STREAM):
+        if family in (socket.AF_INET, socket.AF_INET6) and (family, sockaddr[0]) not in addresses:
+            addresses.append((family, sockaddr[0]))
+    return addresses
+
+
+def interleave(addresses):
+    """Чередование семейств адресов, начиная с семейства первого (RFC 8305)"""
+    if not addresses:
+        return []
+    first = [address for address in addresses if address[0] == addresses[0][0]]
+    other = [address for address in addresses if address[0] != addresses[0][0]]
+    result = []
+    for i in range(max(len(first), len(other))):
+        result += first[i:i + 1] + other[i:i + 1]
+    return result
+
+
+def _literal(host):
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    return [(socket.AF_INET6 if ip.version == 6 else socket.AF_INET, host)]
+
+
+def happy_eyeballs(addresses, port, timeout=None, delay=0.25):
+    """Подключение к первому ответившему адресу (RFC 8305).
+
+    Следующая попытка начинается через delay, не дожидаясь неудачи предыдущих,
+    или сразу после неудачи; победивший сокет возвращается с таймаутом timeout.
+    """
+    if len(addresses) == 1:
+        return socket.create_connection((addresses[0][1], port), timeout)
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    pending = list(addresses)
+    attempts = set()
+    error = OSError("no addresses to connect to")
+    next_start = time.monotonic()
+    try:
+        while pending or attempts:
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                raise socket.timeout("timed out")
+            if pending and (now >= next_start or not attempts):
+                family, ip = pending.pop(0)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                code = sock.connect_ex((ip, port))
+                if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    sock.close()
+                    error = OSError(code, os.strerror(code))
+                    continue
+                selector.register(sock, selectors.EVENT_WRITE)
+                attempts.add(sock)
+                next_start = now + delay
+
+            wait = max(0.0, next_start - now) if pending else None
+            if deadline is not None:
+                wait = deadline - now if wait is None else min(wait, deadline - now)
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                attempts.discard(sock)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code == 0:
+                    sock.settimeout(timeout)
+                    return sock
+                sock.close()
+                error = OSError(code, os.strerror(code))  # например, ConnectionRefusedError
+                next_start = time.monotonic()
+        raise error
+    finally:
+        for sock in attempts:
+            sock.close()
+        selector.close()
+
+
+async def happy_eyeballs_async(addresses, port, delay=0.25):
+    """То же для asyncio: неблокирующий сокет первого ответившего адреса"""
+    loop = asyncio.get_running_loop()
+
+    async def attempt(family, ip):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await loop.sock_connect(sock, (ip, port))
+        except BaseException:
+            sock.close()
+            raise
+        return sock
+
+    pending = list(addresses)
+    tasks = set()
+    error = OSError("no addresses to connect to")
+    try:
+        while pending or tasks:
+            if pending:
+                tasks.add(asyncio.create_task(attempt(*pending.pop(0))))
+            done, _ = await asyncio.wait(tasks, timeout=delay if pending else None,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tasks.discard(task)
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                task.result().close()  # второй успевший подключиться
+            else:
+                task.cancel()
+
+
+class Resolver:
+    """Кэш имён серверов: положительные и отрицательные ответы с TTL.
+
+    Разрешение идёт в пуле потоков; одновременные запросы одного имени ждут
+    одного обращения к lookup. lookup(host) -> [(семейство, ip)] можно подменить
+    заглушкой. getaddrinfo не сообщает TTL записей, поэтому TTL общий.
+    """
+
+    def __init__(self, ttl=60.0, negative_ttl=5.0, max_entries=4096, workers=8,
+                 lookup=system_lookup, attempt_delay=0.25):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.lookup = lookup
+        self.attempt_delay = attempt_delay  # пауза перед попыткой следующего адреса
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='resolver')
+        self.cache = OrderedDict()  # host -> (истекает, адреса или socket.gaierror)
+        self.pending = {}           # host -> Future выполняющегося разрешения
+        self.lock = threading.Lock()
+
+        # счётчики
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=1024)  # длительность обращений к lookup, мс
+
+    def resolve_future(self, host):
+        """Future со списком адресов host; из кэша - уже готовый"""
+        future = Future()
+        literal = _literal(host)
+        if literal is not None:
+            future.set_result(literal)
+            return future
+
+        with self.lock:
+            entry = self.cache.get(host)
+            if entry is not None and entry[0] > time.monotonic():
+                self.cache.move_to_end(host)
+                result = entry[1]
+                if isinstance(result, socket.gaierror):
+                    self.negative_hits += 1
+                    future.set_exception(socket.gaierror(*result.args))
+                else:
+                    self.hits += 1
+                    future.set_result(result)
+                return future
+
+            shared = self.pending.get(host)
+            if shared is not None:
+                self.coalesced += 1
+                return shared
+            self.misses += 1
+            # RUNNING: отмена одним ожидающим не должна отменять разрешение для остальных
+            future.set_running_or_notify_cancel()
+            self.pending[host] = future
+        self.executor.submit(self._lookup, host, future)
+        return future
+
+    def resolve(self, host, timeout=None):
+        return self.resolve_future(host).result(timeout)
+
+    def _lookup(self, host, future):
+        start = time.perf_counter()
+        cached = True
+        try:
+            result = self.lookup(host)
+            if not result:
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        except socket.gaierror as e:
+            result = e
+        except Exception as e:
+            result = e
+            cached = False  # не ответ DNS, а сбой самого lookup
+        self.latencies.append((time.perf_counter() - start) * 1000)
+
+        with self.lock:
+            del self.pending[host]
+            if isinstance(result, Exception):
+                self.failures += 1
+            if cached:
+                ttl = self.negative_ttl if isinstance(result, Exception) else self.ttl
+                self.cache[host] = (time.monotonic() + ttl, result)
+                self.cache.move_to_end(host)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+
+        if isinstance(result, Exception):
+            future.set_exception(result)
+        else:
+            future.set_result(result)
+
+    def connect(self, host, port, timeout=None):
+        """Блокирующее подключение к host по всем его адресам"""
+        addresses = interleave(self.resolve(host, timeout))
+        mark('dns')
+        sock = happy_eyeballs(addresses, port, timeout, self.attempt_delay)
+        mark('connect')
+        return sock
+
+    async def connect_async(self, host, port):
+        """Подключение для asyncio; таймаут задаёт вызывающий через wait_for"""
+        addresses = interleave(await asyncio.wrap_future(self.resolve_future(host)))
+        mark('dns')
+        sock = await happy_eyeballs_async(addresses, port, self.attempt_delay)
+        mark('connect')
+        return sock
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            answered = self.hits + self.negative_hits + self.coalesced
+            total = answered + self.misses
+            return {
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'coalesced': self.coalesced,
+                'misses': self.misses,
+                'failures': self.failures,
+                'hit_rate': round(answered / total, 3) if total else None,
+                'lookup_p50_ms': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                'lookup_p99_ms': round(latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)], 2)
+                if latencies else None,
+                'entries': len(self.cache),
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,396 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from http_message import get_header
+
+
+CACHEABLE_STATUS = {200, 203, 301, 404, 410}
+HEURISTIC_FRACTION = 0.1  # доля возраста Last-Modified, если срок жизни не указан явно
+
+
+def cache_directives(headers):
+    """Директивы Cache-Control: имя -> значение (None для директив без значения)"""
+    directives = {}
+    for key, value in headers:
+        if key.lower() != 'cache-control':
+            continue
+        for item in value.split(','):
+            name, _, argument = item.strip().partition('=')
+            if name:
+                directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def parse_http_date(value):
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def freshness_lifetime(headers, now):
+    """Сколько секунд ответ считается свежим (RFC 9111, 4.2.1)"""
+    directives = cache_directives(headers)
+    for name in ('s-maxage', 'max-age'):
+        if directives.get(name) is not None:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return 0
+
+    date = parse_http_date(get_header(headers, 'Date')) or now
+    if get_header(headers, 'Expires') is not None:
+        expires = parse_http_date(get_header(headers, 'Expires'))
+        return max(0, expires - date) if expires is not None else 0
+
+    last_modified = parse_http_date(get_header(headers, 'Last-Modified'))
+    if last_modified is not None and last_modified < date:
+        return (date - last_modified) * HEURISTIC_FRACTION
+    return 0
+
+
+def initial_age(headers, response_time):
+    """Возраст ответа в момент получения: Age от промежуточных кэшей или по Date (RFC 9111, 4.2.3)"""
+    try:
+        age_value = max(0, int(get_header(headers, 'Age', '0')))
+    except ValueError:
+        age_value = 0
+    date = parse_http_date(get_header(headers, 'Date'))
+    apparent_age = max(0, response_time - date) if date is not None else 0
+    return max(apparent_age, age_value)
+
+
+def is_storable(status, request_headers, response_headers):
+    """Можно ли сохранить ответ в общем кэше"""
+    if status not in CACHEABLE_STATUS:
+        return False
+    if get_header(request_headers, 'Authorization') is not None:
+        return False
+    request = cache_directives(request_headers)
+    response = cache_directives(response_headers)
+    if 'no-store' in request or 'no-store' in response or 'private' in response:
+        return False
+    # ответы с Vary зависят от заголовков запроса, а ключ кэша - только URL
+    if get_header(response_headers, 'Vary') is not None:
+        return False
+    return True
+
+
+class CacheEntry:
+    """Сохранённый ответ: стартовая строка, заголовки без hop-by-hop и тело в памяти или в файле"""
+
+    def __init__(self, status_line, headers, body=None, path=None, size=0):
+        self.status_line = status_line
+        self.body = body   # bytes для памяти
+        self.path = path   # файл для диска
+        self.size = size
+        self._update(headers)
+
+    def _update(self, headers):
+        self.stored_at = time.time()
+        self.initial_age = initial_age(headers, self.stored_at)
+        # Age при отдаче вычисляется заново, сохранённый не нужен
+        self.headers = [(k, v) for k, v in headers if k.lower() != 'age']
+        self.lifetime = freshness_lifetime(self.headers, self.stored_at)
+        self.must_revalidate = 'no-cache' in cache_directives(self.headers)
+
+    @property
+    def etag(self):
+        return get_header(self.headers, 'ETag')
+
+    @property
+    def last_modified(self):
+        return get_header(self.headers, 'Last-Modified')
+
+    def age(self, now=None):
+        """Текущий возраст: возраст при получении плюс время в кэше"""
+        return self.initial_age + (now or time.time()) - self.stored_at
+
+    def is_fresh(self, now=None):
+        return not self.must_revalidate and self.age(now) < self.lifetime
+
+    def validators(self):
+        """Заголовки условного запроса для проверки устаревшей записи"""
+        headers = []
+        if self.etag is not None:
+            headers.append(('If-None-Match', self.etag))
+        if self.last_modified is not None:
+            headers.append(('If-Modified-Since', self.last_modified))
+        return headers
+
+    def refresh(self, headers):
+        """Обновление после 304 Not Modified: новые заголовки поверх сохранённых"""
+        updated = {key.lower() for key, _ in headers} - {'content-length', 'transfer-encoding'}
+        merged = [(k, v) for k, v in self.headers if k.lower() not in updated]
+        self._update(merged + [(k, v) for k, v in headers if k.lower() in updated])
+
+
+class _Tier:
+    """Один уровень кэша с вытеснением давно не использованных записей (LRU) по объёму"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        """Добавление записи; возвращает вытесненные записи"""
+        evicted = []
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old.size
+            evicted.append(old)
+        self.entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes and self.entries:
+            _, victim = self.entries.popitem(last=False)
+            self.bytes -= victim.size
+            evicted.append(victim)
+        return evicted
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+        return entry
+
+
+class BodyCapture:
+    """Копия тела ответа во время пересылки клиенту.
+
+    Небольшие тела копятся в памяти; когда тело перерастает memory_object_limit,
+    оно переносится во временный файл в каталоге кэша. Слишком большие тела
+    не сохраняются. Пока копия пишется, её могут читать запросы того же URL,
+    объединённые с загрузкой (read).
+    """
+
+    READ_SIZE = 256 * 1024
+
+    def __init__(self, cache, status_line=None, headers=None):
+        self.cache = cache
+        self.head = (status_line, headers)
+        self.buffer = bytearray()
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.failed = False
+        self.complete = False
+        self.changed = threading.Condition()
+
+    def write(self, data):
+        with self.changed:
+            if self.failed:
+                return
+            self.size += len(data)
+            if self.size > self.cache.max_object_size:
+                self._abort()
+                return
+            if self.file is None and self.size > self.cache.memory_object_limit:
+                if self.cache.directory is None:
+                    self._abort()
+                    return
+                fd, self.path = tempfile.mkstemp(dir=self.cache.directory, suffix='.tmp')
+                self.file = os.fdopen(fd, 'wb')
+                self.file.write(self.buffer)
+                self.buffer = bytearray()
+            if self.file is not None:
+                self.file.write(data)
+                self.file.flush()  # читатели открывают файл отдельно
+            else:
+                self.buffer += data
+            self.changed.notify_all()
+
+    def abort(self):
+        with self.changed:
+            self._abort()
+
+    def _abort(self):
+        self.failed = True
+        self.buffer = bytearray()
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.path)
+            self.file = None
+        self.changed.notify_all()
+
+    def entry(self, status_line=None, headers=None):
+        """Готовая запись кэша или None, если тело не сохранено"""
+        with self.changed:
+            if self.failed:
+                return None
+            status_line = status_line or self.head[0]
+            headers = headers if headers is not None else self.head[1]
+            if self.file is None:
+                return CacheEntry(status_line, headers, body=bytes(self.buffer), size=self.size)
+            self.file.close()
+            return CacheEntry(status_line, headers, path=self.path, size=self.size)
+
+    def close(self):
+        """Тело записано полностью: читатели получат конец тела"""
+        with self.changed:
+            self.complete = True
+            self.changed.notify_all()
+
+    def read(self, offset, timeout=None):
+        """Часть тела начиная с offset; b'' - тело закончилось"""
+        with self.changed:
+            while offset >= self.size and not self.complete and not self.failed:
+                if not self.changed.wait(timeout):
+                    raise TimeoutError("Загрузка тела остановилась")
+            if self.failed:
+                raise ConnectionError("Загрузка тела прервана")
+            if offset >= self.size:
+                return b''
+            if self.file is None:
+                return bytes(self.buffer[offset:offset + self.READ_SIZE])
+            path, end = self.path, self.size
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(min(self.READ_SIZE, end - offset))
+
+
+class Inflight:
+    """Загрузка URL, к которой присоединяются одновременные запросы"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.capture = None  # BodyCapture, если тело можно читать по мере загрузки
+
+    def wait(self, timeout):
+        """Копия загружаемого тела или None: ответ уже в кэше, либо его надо запрашивать самостоятельно"""
+        self.ready.wait(timeout)
+        return self.capture
+
+
+class ResponseCache:
+    """Общий кэш ответов прокси по URL.
+
+    Маленькие ответы хранятся в памяти, большие - в файлах каталога directory;
+    у каждого уровня свой лимит по байтам. Одновременные промахи по одному URL
+    объединяются: запрос к серверу делает первый поток, остальные читают тело
+    из его копии по мере загрузки.
+    """
+
+    def __init__(self, max_memory_bytes=64 * 1024 * 1024, directory=None, max_disk_bytes=1024 * 1024 * 1024,
+                 memory_object_limit=256 * 1024, max_object_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.memory_object_limit = memory_object_limit
+        self.max_object_size = max_object_size if directory else min(max_object_size, memory_object_limit)
+        self.memory = _Tier(max_memory_bytes)
+        self.disk = _Tier(max_disk_bytes)
+        self.lock = threading.Lock()
+        self.inflight = {}  # URL -> Inflight, пока ответ загружается
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        # статистика
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.collapsed = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        with self.lock:
+            return self.memory.get(key) or self.disk.get(key)
+
+    def store(self, key, entry):
+        with self.lock:
+            stale = [tier.pop(key) for tier in (self.memory, self.disk)]
+            tier = self.memory if entry.path is None else self.disk
+            evicted = tier.put(key, entry)
+            self.evictions += len(evicted)
+        self._discard([e for e in stale + evicted if e is not None and e is not entry])
+
+    def remove(self, key):
+        with self.lock:
+            removed = [tier.pop(key) for tier in (self.memory, self.disk)]
+        self._discard([entry for entry in removed if entry is not None])
+
+    @staticmethod
+    def _discard(entries):
+        for entry in entries:
+            if entry.path is not None:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def open_body(self, entry):
+        """Тело записи: bytes или открытый файл; None, если файл уже вытеснен"""
+        if entry.path is None:
+            return entry.body
+        try:
+            return open(entry.path, 'rb')
+        except OSError:
+            return None
+
+    def begin(self, key):
+        """Начало загрузки URL: (первый ли это запрос, Inflight)"""
+        with self.lock:
+            inflight = self.inflight.get(key)
+            if inflight is not None:
+                self.collapsed += 1
+                return False, inflight
+            inflight = self.inflight[key] = Inflight()
+            return True, inflight
+
+    def share(self, inflight, capture):
+        """Ожидающие запросы читают тело из capture, не дожидаясь конца загрузки"""
+        inflight.capture = capture
+        inflight.ready.set()
+
+    def finish(self, key, inflight):
+        """Конец загрузки: новые запросы идут в кэш или на сервер"""
+        with self.lock:
+            if self.inflight.get(key) is inflight:
+                del self.inflight[key]
+        inflight.ready.set()
+
+    def record_hit(self, size, revalidated=False):
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += size
+            if revalidated:
+                self.revalidated += 1
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+                "revalidated": self.revalidated,
+                "collapsed": self.collapsed,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+                "memory_entries": len(self.memory.entries),
+                "memory_bytes": self.memory.bytes,
+                "disk_entries": len(self.disk.entries),
+                "disk_bytes": self.disk.bytes,
+            }
+
+    def close(self):
+        """Удаление файлов дискового уровня"""
+        with self.lock:
+            entries = list(self.disk.entries.values())
+            self.disk = _Tier(self.disk.max_bytes)
+        self._discard(entries)
@@ -0,0 +1,200 @@
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+CONNECT_RESPONSE = b"HTTP/1.1 200 Connection Established\r\n\r\n"
+BUFFER_LIMIT = 256 * 1024  # сторону не читаем, пока для другой накоплено больше
+
+
+class TunnelStats:
+    """Счётчики одного туннеля CONNECT"""
+
+    def __init__(self, target):
+        self.target = target
+        self.sent_up = 0    # клиент -> сервер
+        self.sent_down = 0  # сервер -> клиент
+        self.started = self.last_active = time.monotonic()
+
+    def summary(self):
+        return (f"{self.target} - Tunnel closed: {self.sent_up} bytes up, {self.sent_down} bytes down, "
+                f"{time.monotonic() - self.started:.1f}s")
+
+
+class Tunnel(TunnelStats):
+    """Пара сокетов туннеля и данные, ещё не отданные каждому из них"""
+
+    def __init__(self, target, client, upstream, initial=b''):
+        super().__init__(target)
+        self.client = client
+        self.upstream = upstream
+        # начало TLS могло прийти вместе с запросом CONNECT
+        self.pending = {client: bytearray(), upstream: bytearray(initial)}
+        self.events = {client: 0, upstream: 0}  # на что сокет подписан в селекторе
+        self.eof = set()       # сокеты, приславшие EOF
+        self.shut = set()      # сокеты, которым уже передан EOF (shutdown SHUT_WR)
+        self.closed = False
+
+    def peer(self, sock):
+        return self.upstream if sock is self.client else self.client
+
+
+class TunnelPump:
+    """Перекачка данных всех туннелей одним потоком на selectors"""
+
+    def __init__(self, idle_timeout=300.0, bufsize=65536, report=print):
+        self.idle_timeout = idle_timeout
+        self.report = report  # вывод строк о закрытии туннелей
+        self.bufsize = bufsize
+        self.selector = selectors.DefaultSelector()
+        self.tunnels = set()
+        self.incoming = deque()
+        self.lock = threading.Lock()
+        self.thread = None
+        # будильник: новые туннели добавляются из потоков клиентов
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+        # счётчики
+        self.opened = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def add(self, tunnel):
+        """Передача туннеля потоку перекачки; сокеты дальше принадлежат ему"""
+        with self.lock:
+            self.incoming.append(tunnel)
+            self.opened += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        try:
+            self._wake_w.send(b'\0')
+        except BlockingIOError:
+            pass  # будильник уже взведён
+
+    def run(self):
+        last_sweep = time.monotonic()
+        while True:
+            for key, events in self.selector.select(timeout=1.0):
+                tunnel = key.data
+                if tunnel is None:
+                    self._take_new()
+                    continue
+                if tunnel.closed:
+                    continue
+                try:
+                    if events & selectors.EVENT_READ:
+                        self._read(tunnel, key.fileobj)
+                    if events & selectors.EVENT_WRITE:
+                        self._flush(tunnel, key.fileobj)
+                    self._update(tunnel)
+                except OSError:
+                    self._close(tunnel)
+
+            now = time.monotonic()
+            if now - last_sweep >= 1.0:
+                last_sweep = now
+                for tunnel in list(self.tunnels):
+                    if now - tunnel.last_active >= self.idle_timeout:
+                        self.report(f"{tunnel.target} - Tunnel idle timeout")
+                        self._close(tunnel)
+
+    def _take_new(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            new, self.incoming = self.incoming, deque()
+        for tunnel in new:
+            for sock in (tunnel.client, tunnel.upstream):
+                sock.setblocking(False)
+            self.tunnels.add(tunnel)
+            try:
+                self._flush(tunnel, tunnel.upstream)
+                self._update(tunnel)
+            except OSError:
+                self._close(tunnel)
+
+    def _read(self, tunnel, sock):
+        try:
+            data = sock.recv(self.bufsize)
+        except BlockingIOError:
+            return
+        if not data:
+            tunnel.eof.add(sock)
+            return
+        tunnel.last_active = time.monotonic()
+        peer = tunnel.peer(sock)
+        tunnel.pending[peer] += data
+        self._flush(tunnel, peer)
+
+    def _flush(self, tunnel, sock):
+        buffer = tunnel.pending[sock]
+        if not buffer:
+            return
+        try:
+            sent = sock.send(buffer)
+        except BlockingIOError:
+            return
+        del buffer[:sent]
+        tunnel.last_active = time.monotonic()
+        if sock is tunnel.upstream:
+            tunnel.sent_up += sent
+            self.bytes_up += sent
+        else:
+            tunnel.sent_down += sent
+            self.bytes_down += sent
+
+    def _update(self, tunnel):
+        """Подписка сокетов на события по состоянию буферов; закрытие, когда обе стороны закончили"""
+        for sock in (tunnel.client, tunnel.upstream):
+            peer = tunnel.peer(sock)
+            # EOF от peer передаём дальше, когда всё, что peer прислал, отдано
+            if peer in tunnel.eof and not tunnel.pending[sock] and sock not in tunnel.shut:
+                sock.shutdown(socket.SHUT_WR)
+                tunnel.shut.add(sock)
+
+        if len(tunnel.shut) == 2:
+            self._close(tunnel)
+            return
+
+        for sock in (tunnel.client, tunnel.upstream):
+            events = 0
+            if sock not in tunnel.eof and len(tunnel.pending[tunnel.peer(sock)]) < BUFFER_LIMIT:
+                events |= selectors.EVENT_READ
+            if tunnel.pending[sock]:
+                events |= selectors.EVENT_WRITE
+            if events == tunnel.events[sock]:
+                continue
+            if not events:
+                self.selector.unregister(sock)
+            elif not tunnel.events[sock]:
+                self.selector.register(sock, events, tunnel)
+            else:
+                self.selector.modify(sock, events, tunnel)
+            tunnel.events[sock] = events
+
+    def _close(self, tunnel):
+        if tunnel.closed:
+            return
+        tunnel.closed = True
+        self.tunnels.discard(tunnel)
+        for sock in (tunnel.client, tunnel.upstream):
+            if tunnel.events[sock]:
+                self.selector.unregister(sock)
+            sock.close()
+        self.report(tunnel.summary())
+
+    def stats(self):
+        return {
+            'opened': self.opened,
+            'active': len(self.tunnels),
+            'bytes_up': self.bytes_up,
+            'bytes_down': self.bytes_down,
+        }
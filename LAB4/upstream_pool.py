@@ -0,0 +1,82 @@
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from resolver import Resolver
+
+
+class UpstreamPool:
+    """Пул keep-alive соединений к серверам, по списку на каждую пару (host, port)"""
+
+    def __init__(self, max_per_host=8, idle_timeout=30.0, connect_timeout=10.0, resolver=None):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.resolver = resolver or Resolver()
+        self.idle = {}  # (host, port) -> deque[(сокет, время возврата в пул)]
+        self.lock = threading.Lock()
+
+        # счётчики
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def acquire(self, host, port):
+        """Соединение к серверу: (сокет, взят ли он из пула)"""
+        key = (host, port)
+        while True:
+            with self.lock:
+                connections = self.idle.get(key)
+                if not connections:
+                    break
+                sock, since = connections.pop()  # самое свежее соединение
+                if not connections:
+                    del self.idle[key]
+
+            if time.monotonic() - since < self.idle_timeout and self._healthy(sock):
+                self.reused += 1
+                return sock, True
+            self.discarded += 1
+            sock.close()
+
+        sock = self.resolver.connect(host, port, timeout=self.connect_timeout)
+        self.created += 1
+        return sock, False
+
+    def release(self, host, port, sock):
+        """Возврат соединения в пул после полностью прочитанного ответа"""
+        key = (host, port)
+        now = time.monotonic()
+        with self.lock:
+            connections = self.idle.setdefault(key, deque())
+            # выбрасываем просроченные соединения с начала очереди
+            while connections and now - connections[0][1] >= self.idle_timeout:
+                connections.popleft()[0].close()
+                self.discarded += 1
+            if len(connections) < self.max_per_host:
+                connections.append((sock, now))
+                return
+        sock.close()
+        self.discarded += 1
+
+    @staticmethod
+    def _healthy(sock):
+        """Простаивающее соединение живо, если читать из него нечего: данные или EOF значат, что сервер его закрыл"""
+        try:
+            if hasattr(select, 'poll'):
+                poller = select.poll()
+                poller.register(sock, select.POLLIN)
+                return not poller.poll(0)
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for sock, _ in connections:
+                    sock.close()
+            self.idle.clear()
@@ -1,14 +1,50 @@
-from flask import Flask, request, jsonify, send_file, make_response
+from flask import Flask, Response, request, jsonify, make_response
+from werkzeug.exceptions import HTTPException
 import os
+import secrets
 import shutil
-from datetime import datetime
+import threading
+from urllib.parse import quote
 from pathlib import Path
 import mimetypes
+from file_response import file_response
+from chunk_store import Uploads, UploadError
+from listing import DirectoryCache, page, json_stream
+from metadata import MetadataCache, evaluate, path_lock
+from content_coding import CompressionCache
 
 app = Flask(__name__)
 # Использование абсолютного пути для хранилища
 STORAGE_ROOT = os.path.abspath("./storage")  # Папка для хранения файлов
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Размер блока при записи загружаемого файла
+MAX_UPLOAD_SIZE = None           # Ограничение размера файла в байтах, None - без ограничения
+# fsync при загрузке: "none" - не вызывать, "file" - для файла перед переименованием,
+# "full" - ещё и для каталога после переименования
+FSYNC_POLICY = "file"
+TEMP_PREFIX = ".upload-"  # Временные файлы незавершённых загрузок
+# Кэш списков каталогов; сбрасывается при PUT/DELETE и проверяется по mtime каталога
+directory_cache = DirectoryCache(TEMP_PREFIX)
+# Блоки, сессии загрузки по частям и манифесты собранных из блоков файлов
+UPLOADS_ROOT = os.path.abspath("./uploads")
+_uploads = None
+# ETag по sha256 содержимого (считается в фоне) вместо тега по inode, размеру и mtime
+CONTENT_HASHES = False
+metadata_cache = MetadataCache(hash_content=CONTENT_HASHES)
+# Сжатие ответов по Accept-Encoding; сжатые варианты популярных файлов хранятся
+# в VARIANTS_ROOT (не больше VARIANTS_BUDGET байт). COMPRESSION = False - отключить
+COMPRESSION = True
+VARIANTS_ROOT = os.path.abspath("./variants")
+VARIANTS_BUDGET = 256 * 1024 * 1024
+_variants = None
+_variants_lock = threading.Lock()
+
+class UploadTooLarge(Exception):
+    pass
+
+class PreconditionFailed(Exception):
+    pass
+
 # Утилита для получения безопасного пути
 def get_safe_path(path):
     # Нормализуем путь и убираем начальные слеши
@@ -18,6 +54,98 @@ def get_safe_path(path):
         raise ValueError("Access outside storage root is forbidden")
     return safe_path
 
+# Проверка If-Match, If-None-Match и If-Unmodified-Since перед изменением файла
+def check_preconditions(safe_path):
+    headers = request.headers
+    if not ("If-Match" in headers or "If-None-Match" in headers or "If-Unmodified-Since" in headers):
+        return
+    if evaluate(headers, metadata_cache.info(safe_path), safe_method=False) is not None:
+        raise PreconditionFailed()
+
+def get_uploads():
+    global _uploads
+    if _uploads is None:
+        _uploads = Uploads(UPLOADS_ROOT, STORAGE_ROOT, TEMP_PREFIX)
+    return _uploads
+
+def get_variants():
+    global _variants
+    if _variants is None and COMPRESSION:
+        # каталог вариантов очищается при создании: создаём один раз
+        with _variants_lock:
+            if _variants is None:
+                _variants = CompressionCache(VARIANTS_ROOT, VARIANTS_BUDGET)
+    return _variants
+
+# Сброс кэшей после изменения файла или каталога
+def invalidate(safe_path):
+    directory_cache.invalidate(safe_path)
+    if _variants is not None:
+        _variants.invalidate(safe_path)
+
+# Копия файла без копирования данных: жёсткая ссылка. Файлы в хранилище не меняются
+# на месте (PUT и сборка из частей заменяют файл целиком), поэтому копии независимы.
+def link_file(source_path, safe_path):
+    temp_path = os.path.join(os.path.dirname(safe_path), TEMP_PREFIX + secrets.token_hex(8))
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        # файловая система без жёстких ссылок
+        shutil.copy2(source_path, temp_path)
+    try:
+        with path_lock(safe_path):
+            check_preconditions(safe_path)
+            os.replace(temp_path, safe_path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+# Потоковая запись тела запроса во временный файл рядом с целевым и атомарная замена.
+# В памяти только один блок UPLOAD_CHUNK_SIZE, каким бы большим ни был файл.
+# Возвращает число записанных байт; при пустом теле целевой файл не меняется.
+# Условия запроса (If-Match и др.) проверяются ещё раз непосредственно перед заменой.
+def save_stream(stream, safe_path, content_length=None):
+    if MAX_UPLOAD_SIZE is not None and content_length is not None and content_length > MAX_UPLOAD_SIZE:
+        raise UploadTooLarge()
+    directory = os.path.dirname(safe_path)
+    temp_path = os.path.join(directory, TEMP_PREFIX + secrets.token_hex(8))
+    # O_EXCL: не затираем чужой файл; права как у open(), с учётом umask
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        buffer = bytearray(UPLOAD_CHUNK_SIZE)
+        view = memoryview(buffer)
+        total = 0
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                n = stream.readinto(buffer)
+                if not n:
+                    break
+                total += n
+                if MAX_UPLOAD_SIZE is not None and total > MAX_UPLOAD_SIZE:
+                    raise UploadTooLarge()
+                f.write(view[:n])
+            if total and FSYNC_POLICY in ("file", "full"):
+                f.flush()
+                os.fsync(f.fileno())
+        if not total:
+            os.remove(temp_path)
+            return 0
+        with path_lock(safe_path):
+            check_preconditions(safe_path)
+            os.replace(temp_path, safe_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if FSYNC_POLICY == "full":
+        # запись о новом имени в каталоге тоже должна попасть на диск
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return total
+
 # GET: Получение файла или списка файлов в каталоге
 @app.route("/<path:path>", methods=["GET"])
 def get_resource(path):
@@ -27,16 +155,23 @@ def get_resource(path):
             return jsonify({"error": "Not found"}), 404
 
         if os.path.isfile(safe_path):
-            # Отправляем файл с правильным Content-Type
+            # Отправляем файл с правильным Content-Type, с поддержкой Range и сжатия
             mime_type, _ = mimetypes.guess_type(safe_path)
-            return send_file(safe_path, mimetype=mime_type or "application/octet-stream")
+            return file_response(safe_path, mime_type or "application/octet-stream", metadata_cache,
+                                 get_variants())
         elif os.path.isdir(safe_path):
-            # Возвращаем список файлов и папок в формате JSON
-            files = [
-                {"name": f, "type": "directory" if os.path.isdir(os.path.join(safe_path, f)) else "file"}
-                for f in os.listdir(safe_path)
-            ]
-            return jsonify(files), 200
+            # Возвращаем список файлов и папок в формате JSON, по желанию постранично:
+            # ?limit=N&cursor=<имя последней записи>; курсор следующей страницы - в X-Next-Cursor
+            limit = request.args.get("limit")
+            if limit is not None:
+                if not (limit.isdigit() and int(limit) > 0):
+                    return jsonify({"error": "limit must be a positive integer"}), 400
+                limit = int(limit)
+            entries, next_cursor = page(directory_cache.entries(safe_path), request.args.get("cursor"), limit)
+            response = Response(json_stream(entries), mimetype="application/json")
+            if next_cursor is not None:
+                response.headers["X-Next-Cursor"] = quote(next_cursor)
+            return response
     except ValueError as e:
         return jsonify({"error": str(e)}), 403
     except Exception as e:
@@ -57,39 +192,135 @@ def upload_file(path):
         if not os.path.exists(directory):
             os.makedirs(directory, exist_ok=True)
 
+        # Условия записи проверяем сразу, чтобы не принимать тело зря
+        check_preconditions(safe_path)
+
         # Проверяем, есть ли заголовок для копирования
         copy_from = request.headers.get("X-Copy-From")
         if copy_from:
             source_path = get_safe_path(copy_from)
             if not os.path.isfile(source_path):
                 return jsonify({"error": "Source file not found"}), 404
-            shutil.copy2(source_path, safe_path)  # Копируем с сохранением метаданных
+            link_file(source_path, safe_path)  # Только метаданные, данные не копируются
+            invalidate(safe_path)
+            get_uploads().copy_manifest(os.path.relpath(source_path, STORAGE_ROOT),
+                                        os.path.relpath(safe_path, STORAGE_ROOT), safe_path)
             return jsonify({"message": "File copied"}), 201
 
-        # Обычная загрузка файла
-        if not request.data:
+        # Обычная загрузка файла: тело пишется на диск по мере поступления
+        if not save_stream(request.stream, safe_path, request.content_length):
             return jsonify({"error": "No file data provided"}), 400
-        with open(safe_path, "wb") as f:
-            f.write(request.get_data())
+        invalidate(safe_path)
         return jsonify({"message": "File uploaded"}), 201
+    except UploadTooLarge:
+        return jsonify({"error": "File is too large"}), 413
+    except PreconditionFailed:
+        return jsonify({"error": "Precondition failed"}), 412
+    except HTTPException as e:
+        # например, клиент оборвал соединение посреди тела
+        return jsonify({"error": e.description}), e.code
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 403
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# POST: Начало загрузки по частям. Тело - JSON {"path", "size", "chunk_size", "chunks"};
+# chunks - необязательный список sha256 всех частей: части, которые уже есть
+# в хранилище, передавать не нужно (их нет в "missing" ответа)
+@app.route("/_uploads", methods=["POST"])
+def start_upload():
+    try:
+        params = request.get_json(silent=True)
+        if not isinstance(params, dict) or not isinstance(params.get("path"), str):
+            return jsonify({"error": "JSON body with path and size expected"}), 400
+        safe_path = get_safe_path(params["path"])
+        if safe_path == STORAGE_ROOT or os.path.isdir(safe_path):
+            return jsonify({"error": "Cannot overwrite directory with file"}), 400
+        size = params.get("size")
+        if MAX_UPLOAD_SIZE is not None and isinstance(size, int) and size > MAX_UPLOAD_SIZE:
+            return jsonify({"error": "File is too large"}), 413
+        status = get_uploads().start(os.path.relpath(safe_path, STORAGE_ROOT), size,
+                                     params.get("chunk_size"), params.get("chunks"))
+        return jsonify(status), 201
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
     except ValueError as e:
         return jsonify({"error": str(e)}), 403
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-# HEAD: Получение метаданных файла (размер и дата изменения)
+# GET: Состояние загрузки (какие части ещё не получены); DELETE: отмена загрузки
+@app.route("/_uploads/<session_id>", methods=["GET", "DELETE"])
+def upload_session(session_id):
+    try:
+        if request.method == "DELETE":
+            get_uploads().abort(session_id)
+            return "", 204
+        return jsonify(get_uploads().status(session_id)), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# PUT: Часть файла по смещению, части можно отправлять в любом порядке и параллельно.
+# Необязательный заголовок X-Chunk-Digest - ожидаемый sha256 части
+@app.route("/_uploads/<session_id>/<int:offset>", methods=["PUT"])
+def upload_chunk(session_id, offset):
+    try:
+        expected = request.headers.get("X-Chunk-Digest")
+        digest = get_uploads().put_part(session_id, offset, request.stream,
+                                        expected.lower() if expected else None)
+        return jsonify({"offset": offset, "digest": digest}), 201
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except HTTPException as e:
+        return jsonify({"error": e.description}), e.code
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# POST: Сборка файла из полученных частей
+@app.route("/_uploads/<session_id>/commit", methods=["POST"])
+def commit_upload(session_id):
+    try:
+        uploads = get_uploads()
+        session, _ = uploads.load(session_id)
+        safe_path = get_safe_path(session["path"])
+        if os.path.isdir(safe_path):
+            return jsonify({"error": "Cannot overwrite directory with file"}), 400
+        with path_lock(safe_path):
+            check_preconditions(safe_path)
+            size = uploads.commit(session_id, safe_path, FSYNC_POLICY)
+        invalidate(safe_path)
+        return jsonify({"message": "File uploaded", "size": size}), 201
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except PreconditionFailed:
+        return jsonify({"error": "Precondition failed"}), 412
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 403
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# HEAD: Получение метаданных файла (размер, дата изменения и ETag)
 @app.route("/<path:path>", methods=["HEAD"])
 def get_metadata(path):
     try:
         safe_path = get_safe_path(path)
-        if not os.path.isfile(safe_path):
+        info = metadata_cache.info(safe_path)
+        if info is None:
             return jsonify({"error": "Not found"}), 404
 
-        stat = os.stat(safe_path)
         response = make_response()
-        response.headers["Content-Length"] = stat.st_size
-        response.headers["Last-Modified"] = datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
+        response.headers["Last-Modified"] = info.last_modified
+        response.headers["ETag"] = info.etag
+        # If-None-Match и If-Modified-Since: клиент может не скачивать файл повторно
+        status = evaluate(request.headers, info, safe_method=True)
+        if status is not None:
+            response.status_code = status
+            return response
+        response.headers["Content-Length"] = info.size
         response.headers["Content-Type"] = mimetypes.guess_type(safe_path)[0] or "application/octet-stream"
+        response.headers["Accept-Ranges"] = "bytes"
         return response
     except ValueError as e:
         return jsonify({"error": str(e)}), 403
@@ -104,11 +335,16 @@ def delete_resource(path):
         if not os.path.exists(safe_path):
             return jsonify({"error": "Not found"}), 404
 
-        if os.path.isfile(safe_path):
-            os.remove(safe_path)
-        elif os.path.isdir(safe_path):
-            shutil.rmtree(safe_path)
+        with path_lock(safe_path):
+            check_preconditions(safe_path)
+            if os.path.isfile(safe_path):
+                os.remove(safe_path)
+            elif os.path.isdir(safe_path):
+                shutil.rmtree(safe_path)
+        invalidate(safe_path)
         return "", 204
+    except PreconditionFailed:
+        return jsonify({"error": "Precondition failed"}), 412
     except ValueError as e:
         return jsonify({"error": str(e)}), 403
     except Exception as e:
@@ -118,7 +354,7 @@ def delete_resource(path):
 @app.route("/", methods=["GET", "PUT", "HEAD", "DELETE"])
 def root():
     if request.method == "GET":
-        if not os.listdir(STORAGE_ROOT):
+        if not directory_cache.entries(STORAGE_ROOT):
             return jsonify({"info": "Storage is empty"}), 200
         return get_resource("")
     elif request.method == "PUT":
@@ -131,6 +367,9 @@ def root():
 if __name__ == "__main__":
     # Создаём папку для хранения, если её нет
     os.makedirs(STORAGE_ROOT, exist_ok=True)
+    removed = get_uploads().collect_garbage()
+    if removed:
+        print(f"Removed {removed} unreferenced chunks")
     host = "127.0.0.3"
     port = 8000
     print(f"Storage directory: {STORAGE_ROOT}")
@@ -0,0 +1,142 @@
+"""Скачивание больших файлов многими клиентами: пропускная способность, CPU и память сервера.
+
+Запуск: python bench_download.py [--size-gb 2] [--clients 16] [--modes sendfile,read,send_file]
+Для каждого режима сервер (app.py на werkzeug, как при app.run) запускается отдельным
+процессом; клиенты в потоках скачивают разреженный файл целиком или случайные диапазоны
+(--range-mb) и отбрасывают данные. Режимы: sendfile - file_response с os.sendfile,
+read - file_response с чтением блоками, send_file - прежняя отдача через flask.send_file.
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HOST = '127.0.0.3'
+
+
+def serve(root, port, mode):
+    """Процесс сервера"""
+    from flask import send_file
+    from werkzeug.serving import make_server
+
+    import app
+    import file_response
+
+    app.STORAGE_ROOT = root
+    file_response.USE_SENDFILE = mode == 'sendfile'
+
+    @app.app.route('/legacy/<path:path>')
+    def legacy(path):
+        return send_file(app.get_safe_path(path), mimetype='application/octet-stream')
+
+    make_server(HOST, port, app.app, threaded=True).serve_forever()
+
+
+def download(port, path, headers, result):
+    sock = socket.create_connection((HOST, port))
+    request = f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\n{headers}Connection: close\r\n\r\n"
+    sock.sendall(request.encode())
+    head = b''
+    while b'\r\n\r\n' not in head:
+        data = sock.recv(65536)
+        if not data:
+            break
+        head += data
+    total = len(head.partition(b'\r\n\r\n')[2])  # начало тела, пришедшее вместе с заголовками
+    buffer = bytearray(1024 * 1024)
+    while True:
+        n = sock.recv_into(buffer)
+        if not n:
+            break
+        total += n
+    sock.close()
+    result.append(total)
+
+
+def process_stats(pid):
+    """(процессорное время, пик RSS в МБ) процесса"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return cpu, int(line.split()[1]) / 1024
+    return cpu, None
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((HOST, port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+
+def run(mode, root, port, clients, size, range_size):
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', root,
+                               '--port', str(port), '--mode', mode])
+    try:
+        wait_for_port(port)
+        cpu_before, _ = process_stats(server.pid)
+        path = '/legacy/big.bin' if mode == 'send_file' else '/big.bin'
+        rng = random.Random(1)
+        result = []
+        threads = []
+        for _ in range(clients):
+            headers = ''
+            if range_size:
+                start = rng.randrange(0, size - range_size)
+                headers = f"Range: bytes={start}-{start + range_size - 1}\r\n"
+            threads.append(threading.Thread(target=download, args=(port, path, headers, result)))
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        cpu_after, peak_rss = process_stats(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+    expected = (range_size or size) * clients
+    received = sum(result)
+    note = '' if received == expected else f" (получено {received} из {expected} байт)"
+    print(f"{mode:10} {received / elapsed / 2 ** 20:9.0f} МБ/с  CPU сервера {cpu_after - cpu_before:6.2f} с  "
+          f"пик RSS {peak_rss:6.0f} МБ{note}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Бенчмарк скачивания файлов из хранилища")
+    parser.add_argument('--size-gb', type=float, default=2)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--range-mb', type=float, default=0, help="скачивать случайные диапазоны такого размера")
+    parser.add_argument('--modes', default='sendfile,read,send_file')
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--mode', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.mode)
+        sys.exit()
+
+    size = int(args.size_gb * 2 ** 30)
+    range_size = int(args.range_mb * 2 ** 20)
+    with tempfile.TemporaryDirectory() as root:
+        # разреженный файл: на диске не занимает места, читается как нули
+        with open(os.path.join(root, 'big.bin'), 'wb') as f:
+            f.truncate(size)
+        what = f"диапазоны по {args.range_mb:g} МБ" if range_size else "файл целиком"
+        print(f"Файл {args.size_gb:g} ГБ, {args.clients} клиентов, {what}")
+        for mode in args.modes.split(','):
+            run(mode, root, args.port, args.clients, size, range_size)
@@ -0,0 +1,329 @@
+"""Хранилище блоков по содержимому и возобновляемая загрузка файлов по частям.
+
+Блок хранится один раз под именем sha256 своего содержимого (blocks/ab/abcd...),
+поэтому одинаковые части разных файлов занимают место один раз, а клиент, заранее
+приславший хэши частей, передаёт только недостающие. Сессия загрузки - каталог
+с описанием (session.json) и журналом принятых частей (parts.log, строки
+"смещение sha256"): части принимаются в любом порядке и параллельно, а после
+перезапуска сервера загрузку можно продолжить. При завершении файл собирается
+из блоков через os.copy_file_range (копирование в ядре) и атомарно заменяет
+целевой; список его блоков сохраняется в манифесте.
+"""
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+DIGEST = re.compile(r"[0-9a-f]{64}\Z")
+SESSION_ID = re.compile(r"[0-9a-f]{32}\Z")
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+SESSION_TTL = 24 * 3600  # незавершённые сессии старше удаляются при сборке мусора
+
+
+class UploadError(Exception):
+    """Ошибка клиента при загрузке; status - код ответа"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _copy_range(source, dest, length):
+    """Копирование length байт из текущих позиций файлов, по возможности в ядре"""
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while length:
+                copied = os.copy_file_range(source.fileno(), dest.fileno(), length)
+                if not copied:
+                    raise UploadError("Chunk file is shorter than expected", 500)
+                length -= copied
+            return
+        except OSError:
+            pass  # например, файловая система не поддерживает; дальше обычное копирование
+    while length:
+        data = source.read(min(length, 1024 * 1024))
+        if not data:
+            raise UploadError("Chunk file is shorter than expected", 500)
+        dest.write(data)
+        length -= len(data)
+
+
+class ChunkStore:
+    """Блоки, адресуемые sha256 содержимого"""
+
+    def __init__(self, root, buffer_size=1024 * 1024):
+        self.root = root
+        self.buffer_size = buffer_size
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    def put(self, stream, limit, expected=None):
+        """Запись блока из потока; возвращает (sha256, размер).
+
+        Блок длиннее limit отвергается (413); если блок уже есть, новая копия удаляется.
+        """
+        temp_path = os.path.join(self.root, f".tmp-{secrets.token_hex(8)}")
+        digest = hashlib.sha256()
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while True:
+                    n = stream.readinto(buffer)
+                    if not n:
+                        break
+                    size += n
+                    if size > limit:
+                        raise UploadError("Chunk is larger than expected", 413)
+                    digest.update(view[:n])
+                    f.write(view[:n])
+            digest = digest.hexdigest()
+            if expected is not None and expected != digest:
+                raise UploadError(f"Chunk digest mismatch: got {digest}")
+            final_path = self.path(digest)
+            if os.path.exists(final_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(temp_path, final_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return digest, size
+
+    def digests(self):
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if len(prefix) == 2 and os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if DIGEST.match(name):
+                        yield name
+
+    def collect(self, referenced, min_age=3600):
+        """Удаление блоков, на которые никто не ссылается; свежие не трогаются"""
+        removed = 0
+        now = time.time()
+        for digest in list(self.digests()):
+            if digest in referenced:
+                continue
+            path = self.path(digest)
+            try:
+                if now - os.stat(path).st_mtime >= min_age:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+class Uploads:
+    """Сессии загрузки по частям и манифесты собранных файлов.
+
+    Пути файлов - относительно storage_root; проверку пути делает вызывающий.
+    """
+
+    def __init__(self, root, storage_root, temp_prefix='.upload-'):
+        self.root = root
+        self.storage_root = storage_root
+        self.temp_prefix = temp_prefix
+        self.chunks = ChunkStore(os.path.join(root, 'blocks'))
+        self.sessions_root = os.path.join(root, 'sessions')
+        self.manifests_root = os.path.join(root, 'manifests')
+        os.makedirs(self.sessions_root, exist_ok=True)
+        os.makedirs(self.manifests_root, exist_ok=True)
+
+    # --- сессии ---
+
+    def _session_dir(self, session_id):
+        if not SESSION_ID.match(session_id):
+            raise UploadError("Upload session not found", 404)
+        return os.path.join(self.sessions_root, session_id)
+
+    def load(self, session_id):
+        """Описание сессии и принятые части {смещение: sha256}"""
+        directory = self._session_dir(session_id)
+        try:
+            with open(os.path.join(directory, 'session.json'), encoding='utf-8') as f:
+                session = json.load(f)
+            with open(os.path.join(directory, 'parts.log'), encoding='ascii') as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            raise UploadError("Upload session not found", 404)
+        parts = {}
+        for line in lines:
+            offset, _, digest = line.partition(' ')
+            if offset.isdigit() and DIGEST.match(digest):  # неполная последняя строка после сбоя
+                parts[int(offset)] = digest
+        return session, parts
+
+    @staticmethod
+    def offsets(session):
+        return range(0, session['size'], session['chunk_size'])
+
+    def status(self, session_id):
+        session, parts = self.load(session_id)
+        missing = [offset for offset in self.offsets(session) if offset not in parts]
+        return dict(session, id=session_id, received=len(parts), missing=missing)
+
+    def start(self, path, size, chunk_size=None, digests=None):
+        """Новая сессия; digests - sha256 всех частей, если клиент знает их заранее.
+
+        Части, блоки которых уже есть в хранилище, сразу считаются принятыми.
+        """
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        if not isinstance(size, int) or size < 0:
+            raise UploadError("size must be a non-negative integer")
+        if not isinstance(chunk_size, int) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadError(f"chunk_size must be between 1 and {MAX_CHUNK_SIZE}")
+        session = {'path': path, 'size': size, 'chunk_size': chunk_size, 'created': time.time()}
+        offsets = self.offsets(session)
+        if digests is not None:
+            if (not isinstance(digests, list) or len(digests) != len(offsets)
+                    or not all(isinstance(digest, str) and DIGEST.match(digest) for digest in digests)):
+                raise UploadError(f"chunks must list {len(offsets)} sha256 digests")
+
+        session_id = secrets.token_hex(16)
+        directory = os.path.join(self.sessions_root, session_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'session.json'), 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        with open(os.path.join(directory, 'parts.log'), 'w', encoding='ascii') as f:
+            for offset, digest in zip(offsets, digests or ()):
+                if self.chunks.has(digest):
+                    f.write(f"{offset} {digest}\n")
+        return self.status(session_id)
+
+    def put_part(self, session_id, offset, stream, expected=None):
+        """Приём части по смещению; повторная отправка части допустима"""
+        session, _ = self.load(session_id)
+        if offset % session['chunk_size'] or offset >= session['size']:
+            raise UploadError(f"Offset must be a multiple of {session['chunk_size']} below {session['size']}")
+        length = min(session['chunk_size'], session['size'] - offset)
+        digest, size = self.chunks.put(stream, length, expected)
+        if size != length:
+            raise UploadError(f"Chunk at offset {offset} must be {length} bytes, got {size}")
+        # строка короче PIPE_BUF с O_APPEND дописывается целиком и при параллельных запросах
+        fd = os.open(os.path.join(self._session_dir(session_id), 'parts.log'), os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, f"{offset} {digest}\n".encode('ascii'))
+        finally:
+            os.close(fd)
+        return digest
+
+    def abort(self, session_id):
+        self.load(session_id)
+        shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+
+    def commit(self, session_id, target_path, fsync='file'):
+        """Сборка файла из частей и атомарная замена target_path; возвращает размер.
+
+        fsync - как FSYNC_POLICY в app.py: "none", "file" или "full".
+        """
+        session, parts = self.load(session_id)
+        missing = [offset for offset in self.offsets(session) if offset not in parts]
+        if missing:
+            raise UploadError(f"{len(missing)} chunks are missing, first at offset {missing[0]}", 409)
+        digests = [parts[offset] for offset in self.offsets(session)]
+
+        directory = os.path.dirname(target_path)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, self.temp_prefix + secrets.token_hex(8))
+        try:
+            with open(temp_path, 'xb') as dest:
+                for offset, digest in zip(self.offsets(session), digests):
+                    length = min(session['chunk_size'], session['size'] - offset)
+                    try:
+                        source = open(self.chunks.path(digest), 'rb')
+                    except FileNotFoundError:
+                        raise UploadError(f"Chunk at offset {offset} was lost, upload it again", 409)
+                    with source:
+                        _copy_range(source, dest, length)
+                if fsync in ('file', 'full'):
+                    dest.flush()
+                    os.fsync(dest.fileno())
+            os.replace(temp_path, target_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        if fsync == 'full':
+            _fsync_dir(directory)
+        self.save_manifest(session['path'], target_path, session['chunk_size'], digests)
+        shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+        return session['size']
+
+    # --- манифесты ---
+
+    def _manifest_path(self, path):
+        return os.path.join(self.manifests_root, path.strip('/') + '.json')
+
+    def save_manifest(self, path, file_path, chunk_size, digests):
+        stat = os.stat(file_path)
+        manifest_path = self._manifest_path(path)
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'ino': stat.st_ino, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                       'chunk_size': chunk_size, 'chunks': digests}, f)
+
+    def manifest(self, path):
+        """Манифест файла, если файл не менялся после сборки из блоков"""
+        try:
+            with open(self._manifest_path(path), encoding='utf-8') as f:
+                manifest = json.load(f)
+            stat = os.stat(os.path.join(self.storage_root, path.strip('/')))
+        except (OSError, ValueError):
+            return None
+        if (stat.st_ino, stat.st_size, stat.st_mtime_ns) != (manifest['ino'], manifest['size'], manifest['mtime_ns']):
+            return None
+        return manifest
+
+    def copy_manifest(self, source, target, target_path):
+        manifest = self.manifest(source)
+        if manifest is not None:
+            self.save_manifest(target, target_path, manifest['chunk_size'], manifest['chunks'])
+
+    # --- сборка мусора ---
+
+    def collect_garbage(self, min_age=3600):
+        """Удаление устаревших сессий и манифестов и блоков без ссылок"""
+        referenced = set()
+        now = time.time()
+        for session_id in os.listdir(self.sessions_root):
+            try:
+                session, parts = self.load(session_id)
+            except UploadError:
+                continue
+            if now - session['created'] > SESSION_TTL:
+                shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+            else:
+                referenced.update(parts.values())
+        for directory, _, names in os.walk(self.manifests_root):
+            for name in names:
+                manifest_path = os.path.join(directory, name)
+                path = os.path.relpath(manifest_path, self.manifests_root)[:-len('.json')]
+                manifest = self.manifest(path)
+                if manifest is None:
+                    os.remove(manifest_path)  # файл удалён или перезаписан обычным PUT
+                else:
+                    referenced.update(manifest['chunks'])
+        return self.chunks.collect(referenced, min_age)
@@ -0,0 +1,245 @@
+"""Сжатие ответов: выбор кодировки по Accept-Encoding и кэш заранее сжатых файлов.
+
+gzip есть всегда (zlib); br и zstd - если установлены brotli и zstandard (или есть
+модуль compression.zstd из Python 3.14). Файл, который запрашивают впервые,
+сжимается потоком по мере отправки с быстрым уровнем. Когда версию файла запросили
+HOT_REQUESTS раз, фоновый пул процессов сжимает её с максимальным уровнем;
+дальше готовый вариант отдаётся с диска через sendfile, без затрат CPU на запрос.
+Варианты привязаны к (inode, размер, mtime_ns) исходного файла, поэтому изменённый
+файл никогда не отдаётся по старому варианту; PUT и DELETE удаляют варианты сразу.
+Общий объём вариантов ограничен, лишние удаляются в порядке давности использования.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+BLOCK_SIZE = 256 * 1024
+MIN_SIZE = 1024     # меньшие файлы не сжимаются: выигрыш меньше накладных расходов
+HOT_REQUESTS = 3    # запросов версии файла, после которых готовится сжатый вариант
+MIN_SAVING = 0.9    # вариант больше 90% исходного размера не хранится
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/javascript", "application/xml", "application/wasm",
+    "application/x-sh", "application/x-tar", "image/svg+xml", "image/bmp",
+}
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def _zstd(level):
+    if hasattr(zstd, 'ZstdCompressor') and hasattr(zstd.ZstdCompressor, 'compressobj'):
+        return zstd.ZstdCompressor(level=level).compressobj()  # zstandard
+    return zstd.ZstdCompressor(level)  # compression.zstd
+
+
+# кодировка -> (создание компрессора по уровню, уровень для потока, уровень для варианта)
+CODECS = {'gzip': (lambda level: zlib.compressobj(level, zlib.DEFLATED, 31), 6, 9)}
+if brotli is not None:
+    CODECS['br'] = (_Brotli, 4, 11)
+if zstd is not None:
+    CODECS['zstd'] = (_zstd, 3, 19)
+PREFERENCE = [coding for coding in ('zstd', 'br', 'gzip') if coding in CODECS]
+
+
+def compressible(mime_type, size):
+    if size < MIN_SIZE:
+        return False
+    mime_type = mime_type.split(';', 1)[0].strip().lower()
+    return (mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+            or mime_type.endswith('+json') or mime_type.endswith('+xml'))
+
+
+def negotiate(accept_encoding):
+    """Лучшая доступная кодировка из Accept-Encoding или None (без сжатия)"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights['gzip' if coding == 'x-gzip' else coding] = q
+    default = weights.get('*', 0.0)
+    best = None
+    for coding in PREFERENCE:  # при равных q - порядок сервера
+        q = weights.get(coding, default)
+        if q > 0 and (best is None or q > best[1]):
+            best = (coding, q)
+    return best[0] if best else None
+
+
+def compress_stream(f, coding):
+    """Тело ответа: файл f, сжатый по мере чтения (f закрывается в конце)"""
+    factory, level, _ = CODECS[coding]
+    compressor = factory(level)
+    try:
+        while True:
+            data = f.read(BLOCK_SIZE)
+            if not data:
+                break
+            data = compressor.compress(data)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        f.close()
+
+
+def compress_file(source, target, coding):
+    """Сжатие файла целиком (в процессе пула); возвращает размер результата"""
+    factory, _, level = CODECS[coding]
+    compressor = factory(level)
+    temp = target + '.tmp'
+    try:
+        with open(source, 'rb') as src, open(temp, 'wb') as dst:
+            while True:
+                data = src.read(BLOCK_SIZE)
+                if not data:
+                    break
+                dst.write(compressor.compress(data))
+            dst.write(compressor.flush())
+        os.replace(temp, target)
+    except BaseException:
+        _remove(temp)
+        raise
+    return os.path.getsize(target)
+
+
+def _version(stat):
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class CompressionCache:
+    """Сжатые варианты популярных файлов в каталоге root, не больше budget байт"""
+
+    def __init__(self, root, budget=256 * 1024 ** 2, workers=2, max_tracked=10000):
+        self.root = root
+        self.budget = budget
+        self.max_tracked = max_tracked
+        # варианты не переживают перезапуск: индекс только в памяти
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root)
+        self.variants = OrderedDict()  # (путь, кодировка) -> (версия, путь варианта, размер)
+        self.size = 0
+        # (путь, кодировка) -> (версия, число запросов; None - сжимается или не стоит сжимать)
+        self.requests = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ProcessPoolExecutor(workers)
+
+    def open_variant(self, path, stat, coding):
+        """Открытый файл готового варианта или None; при частых запросах заказывает вариант"""
+        key = (path, coding)
+        version = _version(stat)
+        with self.lock:
+            entry = self.variants.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self.variants.move_to_end(key)
+                    try:
+                        return open(entry[1], 'rb')
+                    except OSError:
+                        pass
+                self._drop(key)
+
+            counted = self.requests.pop(key, None)
+            count = counted[1] if counted is not None and counted[0] == version else 0
+            if count is not None:
+                count += 1
+                if count >= HOT_REQUESTS:
+                    count = None
+                    self._submit(path, version, coding)
+            self.requests[key] = (version, count)
+            while len(self.requests) > self.max_tracked:
+                self.requests.popitem(last=False)
+        return None
+
+    def _submit(self, path, version, coding):
+        name = hashlib.sha256(f'{path}\0{version}'.encode()).hexdigest() + '.' + coding
+        target = os.path.join(self.root, name)
+        future = self.executor.submit(compress_file, path, target, coding)
+        future.add_done_callback(lambda future: self._compressed(future, path, version, coding, target))
+
+    def _compressed(self, future, path, version, coding, target):
+        key = (path, coding)
+        try:
+            size = future.result()
+            current = _version(os.stat(path))
+        except Exception:
+            size, current = None, None
+        with self.lock:
+            keep = (size is not None and current == version and size <= version[1] * MIN_SAVING
+                    and size <= self.budget and self.requests.get(key, (None,))[0] == version)
+            if not keep:
+                _remove(target)
+                if key in self.requests and current == version:
+                    self.requests[key] = (version, None)  # эту версию больше не пробовать
+                return
+            self._drop(key)
+            self.variants[key] = (version, target, size)
+            self.size += size
+            while self.size > self.budget:
+                evicted = next(iter(self.variants))
+                if evicted in self.requests:
+                    # снова станет популярным - сожмём заново
+                    self.requests[evicted] = (self.variants[evicted][0], 0)
+                self._drop(evicted)
+
+    def _drop(self, key):
+        entry = self.variants.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+            _remove(entry[1])
+
+    def invalidate(self, path):
+        """Удаление вариантов path и, для каталога, всех вложенных файлов"""
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self.lock:
+            for key in [key for key in self.variants if key[0] == path or key[0].startswith(prefix)]:
+                self._drop(key)
+            for key in [key for key in self.requests if key[0] == path or key[0].startswith(prefix)]:
+                del self.requests[key]
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
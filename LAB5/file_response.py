@@ -0,0 +1,183 @@
+"""Отдача файлов с поддержкой условных запросов и Range/If-Range (RFC 9110, разделы 13, 14).
+
+Тело отдаётся без чтения файла в Python: на встроенном сервере werkzeug (app.run)
+сокет соединения доступен как environ['werkzeug.socket'], и после отправки заголовков
+байты файла уходят в него через socket.sendfile (os.sendfile в Linux). На других
+WSGI-серверах файл читается блоками.
+
+Сжатые ответы (content_coding) имеют свой ETag: к тегу файла добавляется кодировка.
+Запрос с Range получает несжатый файл, чтобы диапазоны относились к его байтам.
+"""
+import copy
+import os
+import secrets
+
+from flask import Response, request
+
+from content_coding import compress_stream, compressible, negotiate
+from metadata import evaluate, if_range_matches
+
+MAX_RANGES = 64          # больше диапазонов - заголовок Range игнорируется
+BLOCK_SIZE = 256 * 1024  # размер блока при чтении без sendfile
+USE_SENDFILE = hasattr(os, 'sendfile')
+
+
+class RangeNotSatisfiable(Exception):
+    """Ни один из запрошенных диапазонов не попадает в файл"""
+
+
+def parse_range(header, size):
+    """Диапазоны из заголовка Range: [(начало, конец включительно)] или None.
+
+    None - заголовок не разобран или не поддерживается, файл отдаётся целиком.
+    Пересекающиеся и соседние диапазоны объединяются.
+    """
+    unit, sep, specs = header.partition('=')
+    if not sep or unit.strip().lower() != 'bytes':
+        return None
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if not specs or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or not (first.isdigit() or last.isdigit()):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # суффикс: последние last байт
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(int(last), size - 1) if last else size - 1))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        if start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _send_file(environ, f, pieces, epilogue):
+    """Тело ответа: pieces - [(байты перед частью, начало, длина)]"""
+    sock = environ.get('werkzeug.socket') if USE_SENDFILE else None
+    try:
+        if sock is not None:
+            yield b''  # werkzeug отправляет заголовки при первой записи
+        for prefix, start, length in pieces:
+            if prefix:
+                yield prefix
+            if sock is not None:
+                if sock.sendfile(f, start, length) != length:
+                    raise OSError("File was truncated while sending")
+                continue
+            f.seek(start)
+            while length:
+                data = f.read(min(BLOCK_SIZE, length))
+                if not data:
+                    raise OSError("File was truncated while sending")
+                length -= len(data)
+                yield data
+        if epilogue:
+            yield epilogue
+    finally:
+        f.close()
+
+
+def encoded_info(info, coding):
+    """FileInfo сжатого представления: те же даты, теги с суффиксом кодировки"""
+    encoded = copy.copy(info)
+    encoded.tags = {f'{tag[:-1]}-{coding}"' for tag in info.tags}
+    encoded.etag = f'{info.etag[:-1]}-{coding}"'
+    return encoded
+
+
+def file_response(path, mime_type, metadata, variants=None):
+    """Ответ 200/206/304/412/416 на GET файла; metadata - MetadataCache для ETag,
+    variants - CompressionCache для сжатия по Accept-Encoding (None - без сжатия)"""
+    f = open(path, 'rb')
+    try:
+        stat = os.fstat(f.fileno())
+        info = metadata.info(path, stat)
+        size = info.size
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'Last-Modified': info.last_modified,
+        }
+        coding = None
+        if variants is not None and compressible(mime_type, size):
+            headers['Vary'] = 'Accept-Encoding'
+            if 'Range' not in request.headers:
+                coding = negotiate(request.headers.get('Accept-Encoding'))
+        if coding is not None:
+            info = encoded_info(info, coding)
+        headers['ETag'] = info.etag
+        status = evaluate(request.headers, info, safe_method=True)
+        if status is not None:
+            f.close()
+            return Response(status=status, headers=headers)
+
+        if coding is not None:
+            headers['Content-Type'] = mime_type
+            headers['Content-Encoding'] = coding
+            variant = variants.open_variant(path, stat, coding)
+            if variant is None:
+                # готового варианта нет: сжатие потоком, длина заранее неизвестна
+                return Response(compress_stream(f, coding), headers=headers, direct_passthrough=True)
+            f.close()
+            f = variant
+            length = os.fstat(f.fileno()).st_size
+            headers['Content-Length'] = str(length)
+            return Response(_send_file(request.environ, f, [(b'', 0, length)], b''),
+                            headers=headers, direct_passthrough=True)
+
+        ranges = None
+        range_header = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if range_header and (if_range is None or if_range_matches(if_range, info)):
+            try:
+                ranges = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                f.close()
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+
+        if ranges is None:
+            status, pieces, epilogue = 200, [(b'', 0, size)], b''
+            headers['Content-Type'] = mime_type
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            status, pieces, epilogue = 206, [(b'', start, end - start + 1)], b''
+            headers['Content-Type'] = mime_type
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        else:
+            boundary = secrets.token_hex(16)
+            status, pieces = 206, []
+            for start, end in ranges:
+                part_head = (f'\r\n--{boundary}\r\nContent-Type: {mime_type}\r\n'
+                             f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n')
+                pieces.append((part_head.encode('latin-1'), start, end - start + 1))
+            epilogue = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+            headers['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+
+        headers['Content-Length'] = str(sum(len(prefix) + length for prefix, _, length in pieces) + len(epilogue))
+    except BaseException:
+        f.close()
+        raise
+    return Response(_send_file(request.environ, f, pieces, epilogue), status=status,
+                    headers=headers, direct_passthrough=True)
@@ -0,0 +1,111 @@
+"""Списки файлов каталогов: os.scandir, кэш и постраничная выдача потоком JSON.
+
+Тип записи scandir берёт из самого каталога (d_type), размер и время изменения -
+из stat записи. Список кэшируется и считается верным, пока не изменились inode
+и mtime каталога (создание, удаление и переименование файлов меняют mtime);
+изменения, которые сервер делает сам, сбрасывают кэш сразу.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from operator import itemgetter
+
+# mtime каталога, изменённого недавно, могло не успеть обновиться при следующем
+# изменении (грубое разрешение часов ФС): такой список не кэшируется
+RACY_WINDOW = 1.0
+BATCH_SIZE = 1000  # записей в одном куске ответа
+
+
+def _entry(name, kind, size, mtime):
+    # JSON записи готовится один раз при чтении каталога, а не при каждой выдаче из кэша
+    text = '{"name": %s, "type": "%s", "size": %s, "mtime": %r}' % (
+        json.dumps(name, ensure_ascii=False), kind, "null" if size is None else size, mtime)
+    return name, text
+
+
+def scan(path, skip_prefix=None):
+    """Записи каталога [(имя, JSON записи)], отсортированные по имени"""
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if skip_prefix and entry.name.startswith(skip_prefix):
+                continue
+            try:
+                if entry.is_dir():
+                    entries.append(_entry(entry.name, "directory", None, entry.stat().st_mtime))
+                else:
+                    stat = entry.stat()
+                    entries.append(_entry(entry.name, "file", stat.st_size, stat.st_mtime))
+            except OSError:
+                continue  # удалён во время чтения или битая символьная ссылка
+    entries.sort(key=itemgetter(0))
+    return entries
+
+
+class DirectoryCache:
+    """Кэш списков каталогов, ограниченный общим числом записей (LRU)"""
+
+    def __init__(self, skip_prefix=None, max_entries=1000000):
+        self.skip_prefix = skip_prefix
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # путь -> ((st_ino, st_mtime_ns), записи)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def entries(self, path):
+        """Список каталога; возвращаемый список не изменяется, его можно отдавать потоком"""
+        stat = os.stat(path)
+        key = (stat.st_ino, stat.st_mtime_ns)
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached is not None and cached[0] == key:
+                self.cache.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        started = time.time()
+        entries = scan(path, self.skip_prefix)
+        if started - stat.st_mtime < RACY_WINDOW:
+            return entries
+        with self.lock:
+            old = self.cache.pop(path, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(entries) <= self.max_entries:
+                self.cache[path] = (key, entries)
+                self.size += len(entries)
+                while self.size > self.max_entries:
+                    _, (_, evicted) = self.cache.popitem(last=False)
+                    self.size -= len(evicted)
+        return entries
+
+    def invalidate(self, path):
+        """Сброс после изменения path: его каталог, предки и, для каталога, вложенные"""
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self.lock:
+            for cached in list(self.cache):
+                if path.startswith(cached + os.sep) or cached == path or cached.startswith(prefix):
+                    self.size -= len(self.cache.pop(cached)[1])
+
+
+def page(entries, cursor=None, limit=None):
+    """Записи после имени cursor, не больше limit; (записи, следующий cursor или None)"""
+    start = bisect_right(entries, cursor, key=itemgetter(0)) if cursor else 0
+    end = len(entries) if limit is None else min(len(entries), start + limit)
+    next_cursor = entries[end - 1][0] if end < len(entries) else None
+    return entries[start:end], next_cursor
+
+
+def json_stream(entries):
+    """JSON-массив записей кусками по BATCH_SIZE"""
+    yield "["
+    for i in range(0, len(entries), BATCH_SIZE):
+        yield ("," if i else "") + ",".join([text for _, text in entries[i:i + BATCH_SIZE]])
+    yield "]"
@@ -0,0 +1,156 @@
+"""ETag файлов и условные запросы (RFC 9110, раздел 13.2).
+
+ETag по умолчанию строится из (inode, размер, mtime_ns). Сервер не меняет файлы
+на месте: PUT и сборка из частей создают новый файл и атомарно подменяют старый,
+поэтому такой тег однозначно задаёт содержимое и считается сильным. По желанию
+в фоновом пуле считается sha256 содержимого; когда он готов, ETag становится
+"sha256-...", одинаковым у копий и повторных загрузок того же содержимого,
+а прежний тег продолжает совпадать, пока файл не изменился.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from stat import S_ISREG
+
+_ETAG = re.compile(r'(W/)?("[^"]*")')
+
+_LOCKS = [threading.Lock() for _ in range(256)]
+
+
+def path_lock(path):
+    """Блокировка для проверки условий и замены файла без гонки с другими запросами"""
+    return _LOCKS[hash(os.path.normpath(path)) % len(_LOCKS)]
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    """Время из даты HTTP в секундах или None, если дата некорректна"""
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    try:
+        return mktime_tz(parsed)
+    except (OverflowError, ValueError):
+        return None
+
+
+class FileInfo:
+    def __init__(self, stat, digest=None):
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.last_modified = http_date(stat.st_mtime)
+        meta_tag = f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        self.etag = f'"sha256-{digest}"' if digest else meta_tag
+        self.tags = {meta_tag, self.etag}  # все сильные теги текущего содержимого
+
+
+class MetadataCache:
+    """ETag файлов по (устройство, inode, размер, mtime_ns) и фоновые хэши содержимого"""
+
+    def __init__(self, hash_content=False, hash_max_size=1024 ** 3, workers=2, max_entries=100000):
+        self.hash_content = hash_content
+        self.hash_max_size = hash_max_size
+        self.max_entries = max_entries
+        self.digests = OrderedDict()  # ключ -> sha256 или None, пока хэш считается
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='etag') if hash_content else None
+
+    def info(self, path, stat=None):
+        """FileInfo файла; None, если файла нет (или это каталог)"""
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+        if not S_ISREG(stat.st_mode):
+            return None
+        if not self.hash_content:
+            return FileInfo(stat)
+
+        key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if key in self.digests:
+                self.digests.move_to_end(key)
+                return FileInfo(stat, self.digests[key])
+            if stat.st_size > self.hash_max_size:
+                return FileInfo(stat)
+            self.digests[key] = None
+            while len(self.digests) > self.max_entries:
+                self.digests.popitem(last=False)
+        self.executor.submit(self._hash, path, key)
+        return FileInfo(stat)
+
+    def _hash(self, path, key):
+        digest = hashlib.sha256()
+        buffer = bytearray(1024 * 1024)
+        try:
+            with open(path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                if (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) != key:
+                    raise OSError("file changed before hashing")
+                view = memoryview(buffer)
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    digest.update(view[:n])
+        except OSError:
+            with self.lock:
+                self.digests.pop(key, None)
+            return
+        with self.lock:
+            if key in self.digests:
+                self.digests[key] = digest.hexdigest()
+
+
+def _matches(value, info, weak):
+    """Совпадает ли список тегов If-Match/If-None-Match с текущим файлом"""
+    if info is None:
+        return False
+    if value.strip() == '*':
+        return True
+    for weak_prefix, tag in _ETAG.findall(value):
+        if (weak or not weak_prefix) and tag in info.tags:
+            return True
+    return False
+
+
+def evaluate(headers, info, safe_method):
+    """Проверка условий запроса: None - выполнять, 304 или 412 - ответить этим кодом.
+
+    info - FileInfo текущего файла или None; safe_method - GET или HEAD.
+    """
+    if_match = headers.get('If-Match')
+    if if_match is not None:
+        if not _matches(if_match, info, weak=False):
+            return 412
+    else:
+        since = parse_http_date(headers.get('If-Unmodified-Since', ''))
+        if since is not None and info is not None and int(info.mtime) > since:
+            return 412
+
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        if _matches(if_none_match, info, weak=True):
+            return 304 if safe_method else 412
+    elif safe_method and info is not None:
+        since = parse_http_date(headers.get('If-Modified-Since', ''))
+        if since is not None and int(info.mtime) <= since:
+            return 304
+    return None
+
+
+def if_range_matches(value, info):
+    """Не изменился ли файл с тех пор, как клиент получил его часть"""
+    value = value.strip()
+    if value.startswith('"') or value.startswith('W/'):
+        return value in info.tags  # только сильное сравнение
+    since = parse_http_date(value)
+    return since is not None and int(info.mtime) == since